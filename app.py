@@ -1,51 +1,183 @@
-from flask import Flask, redirect, url_for, session, request, render_template
-from authlib.integrations.flask_client import OAuth
-import requests
+from flask import Blueprint, Flask, Response, current_app, redirect, url_for, session, request, render_template, jsonify
 import os
-import concurrent.futures
-import ipdb
-
-# Initialize Flask application
-app = Flask(__name__)
-app.debug = True
-app.secret_key = 'development'
+import asyncio
+import collections
+import contextlib
+import functools
+import itertools
+import threading
+import time
+import clients
+import jobs
+import matching
+import metrics
+import quota
+import sse
+import tracing
+from journal import Journal, migration_key
+from plan import FAILED, INSERTED, Plan, as_plan, unique_title
+from resolver import SharedResolver
+from http_cache import ResponseCache
+from song_cache import SongCache
+from session_store import SqliteSessionInterface
+from sync_state import SyncStore
+from work_queue import WorkQueue
+from rate_limit import RateLimiter, QuotaExceededError, RateLimitedError
+from concurrency import AdaptiveLimiter
 
 spotify_client_id = os.environ.get("spotify_client_id")
 spotify_client_secret = os.environ.get("spotify_client_secret")
 youtube_client_id = os.environ.get("youtube_client_id")
 youtube_client_secret = os.environ.get("youtube_client_secret")
 youtube_api_key = os.environ.get("youtube_api_key")
+# API roots, overridable to point the app at local stand-ins
+spotify_api_base = os.environ.get("spotify_api_base", clients.SPOTIFY_API)
+youtube_api_base = os.environ.get("youtube_api_base", clients.YOUTUBE_API)
+spotify_page_workers = int(os.environ.get("spotify_page_workers", 8))
+session_store_path = os.environ.get("session_store_path", "sessions.db")
+journal_dir = os.environ.get("journal_dir", "journals")
+sync_store_path = os.environ.get("sync_store_path", "sync_state.db")
+session_ttl = int(os.environ.get("session_ttl", 24 * 3600))
+song_cache_path = os.environ.get("song_cache_path", "song_cache.db")
+song_cache_ttl = int(os.environ.get("song_cache_ttl", 30 * 24 * 3600))
+song_cache_max_entries = int(os.environ.get("song_cache_max_entries", 100000))
+response_cache_path = os.environ.get("response_cache_path", "response_cache.db")
+response_cache_max_entries = int(os.environ.get("response_cache_max_entries", 20000))
+response_cache_memory_mb = int(os.environ.get("response_cache_memory_mb", 32))
+youtube_requests_per_second = float(os.environ.get("youtube_requests_per_second", 5))
+# quota units the youtube project gets per day, 10000 unless google granted more.
+# Every process budgets this much on its own, so with worker.py processes spending quota too give each a share
+youtube_daily_quota = int(os.environ.get("youtube_daily_quota", 10000))
+# "on" spreads migrations over the daily quota windows and resumes them after the reset, "off" lets them fail
+quota_scheduling = os.environ.get("quota_scheduling", "on")
+youtube_burst = int(os.environ.get("youtube_burst", 10))
+# "threads" or "asyncio"
+migration_engine = os.environ.get("migration_engine", "threads")
+# "local" runs migrations in the web process, "queue" hands each playlist to the worker processes (worker.py)
+migration_backend = os.environ.get("migration_backend", "local")
+work_queue_path = os.environ.get("work_queue_path", "work_queue.db")
+# seconds between checks of the work queue while waiting on queued playlists
+queue_poll_interval = float(os.environ.get("queue_poll_interval", 1))
+# seconds a queued migration waits for a worker process to pick up any of its playlists before it fails
+queue_pickup_timeout = float(os.environ.get("queue_pickup_timeout", 300))
+# starting limits on calls in flight per API, adapted between 1 and the *_max_workers ceilings as responses come in
+spotify_workers = int(os.environ.get("spotify_workers", 20))
+youtube_workers = int(os.environ.get("youtube_workers", 16))
+spotify_max_workers = int(os.environ.get("spotify_max_workers", 64))
+youtube_max_workers = int(os.environ.get("youtube_max_workers", 32))
+playlist_workers = int(os.environ.get("playlist_workers", 8))
+# search results scored per song, at most 50
+match_candidates = int(os.environ.get("match_candidates", 5))
+# how many song searches may run ahead of a playlist's inserts
+youtube_search_window = int(os.environ.get("youtube_search_window", 32))
+# seconds the selection page reuses a user's playlist listing before asking spotify again
+playlist_cache_ttl = int(os.environ.get("playlist_cache_ttl", 300))
+# seconds between keep-alive comments on idle progress streams
+sse_heartbeat = float(os.environ.get("sse_heartbeat", 15))
+
+# Spotify caps playlist track pages at 100 items and playlist listing pages at 50
+SPOTIFY_TRACKS_PAGE_SIZE = 100
+SPOTIFY_PLAYLISTS_PAGE_SIZE = 50
+
+SPOTIFY_TOKEN_URL = 'https://accounts.spotify.com/api/token'
+YOUTUBE_TOKEN_URL = 'https://oauth2.googleapis.com/token'
+
+# Resolved song name -> videoId lookups, shared by every migration
+song_cache = SongCache(song_cache_path, ttl=song_cache_ttl, max_entries=song_cache_max_entries)
+
+# ETags and bodies of spotify and youtube reads, revalidated with If-None-Match instead of downloaded again
+response_cache = ResponseCache(response_cache_path, max_entries=response_cache_max_entries,
+                               memory_bytes=response_cache_memory_mb * 1024 * 1024)
+
+# Last synced snapshot and youtube playlist items of every synced playlist
+sync_store = SyncStore(sync_store_path)
+
+# Playlist tasks for the worker processes when migration_backend is "queue"
+work_queue = WorkQueue(work_queue_path)
+
+# Youtube quota spent by this process and promised to its migrations in the current daily window
+quota_budget = quota.QuotaBudget(youtube_daily_quota)
+
+# Every youtube call goes through one limiter so concurrent migrations share the pacing,
+# and every call's quota cost is charged to the budget, syncs and resets included
+youtube_limiter = RateLimiter(youtube_requests_per_second, youtube_burst, budget=quota_budget)
+
+# Calls in flight per API, raised while responses are healthy and cut on rate limits, errors and slowdowns
+spotify_concurrency = AdaptiveLimiter('spotify', spotify_workers, maximum=spotify_max_workers)
+youtube_concurrency = AdaptiveLimiter('youtube', youtube_workers, maximum=youtube_max_workers)
 
-# OAuth setup for Spotify and YouTube
-spotify_oauth = OAuth(app)
-youtube_oauth = OAuth(app)
-
-# Register Spotify OAuth with necessary details
-spotify = spotify_oauth.register(
-    name='spotify',
-    base_url='https://api.spotify.com/v1/',
-    request_token_url=None,
-    access_token_url='https://accounts.spotify.com/api/token',
-    access_token_params=None,
-    authorize_url='https://accounts.spotify.com/authorize',
-    client_id=spotify_client_id,
-    client_secret=spotify_client_secret
-)
-
-# Register YouTube OAuth with necessary details
-youtube = youtube_oauth.register(
-    name='youtube',
-    base_url='https://www.googleapis.com/youtube/v3',
-    authorize_url='https://accounts.google.com/o/oauth2/auth',
-    authorize_params=None,
-    access_token_url='https://oauth2.googleapis.com/token',
-    access_token_params=None,
-    client_kwargs={'scope': 'https://www.googleapis.com/auth/youtube'},
-    client_id=youtube_client_id,
-    client_secret=youtube_client_secret        
-)
-
-@app.route('/')
+# One keep-alive session for all API calls, pools sized to the most calls the limiters let through at once
+http_session = clients.pooled_session({
+    spotify_api_base: spotify_max_workers,
+    youtube_api_base: youtube_max_workers,
+})
+
+# Routes, registered on every app built by create_app
+views = Blueprint('views', __name__)
+_oauth_lock = threading.Lock()
+
+def create_app(config=None):
+    """
+    Builds the Flask app. config overrides the defaults read from the environment,
+    e.g. {'DEBUG': True} for local runs.
+    Nothing here opens connections or starts threads, so the app can be built before gunicorn forks (--preload)
+    """
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY=os.environ.get("secret_key", "development"),
+        SPOTIFY_CLIENT_ID=spotify_client_id,
+        SPOTIFY_CLIENT_SECRET=spotify_client_secret,
+        YOUTUBE_CLIENT_ID=youtube_client_id,
+        YOUTUBE_CLIENT_SECRET=youtube_client_secret,
+        SESSION_STORE_PATH=session_store_path,
+        SESSION_TTL=session_ttl,
+    )
+    app.config.update(config or {})
+    # Sessions live server-side, the cookie only carries the session id
+    app.session_interface = SqliteSessionInterface(app.config['SESSION_STORE_PATH'], app.config['SESSION_TTL'])
+    # Latency and status of every route, served with the outbound API metrics on /metrics
+    metrics.instrument(app)
+    app.register_blueprint(views)
+    return app
+
+def oauth_client(name):
+    """
+    The current app's spotify or youtube OAuth client.
+    They are registered on the first login, so workers that never see one don't import authlib
+    """
+    with _oauth_lock:
+        oauth = current_app.extensions.get('oauth')
+        if oauth is None:
+            from authlib.integrations.flask_client import OAuth
+            oauth = current_app.extensions['oauth'] = OAuth(current_app)
+            # Register Spotify OAuth with necessary details
+            oauth.register(
+                name='spotify',
+                base_url='https://api.spotify.com/v1/',
+                request_token_url=None,
+                access_token_url=SPOTIFY_TOKEN_URL,
+                access_token_params=None,
+                authorize_url='https://accounts.spotify.com/authorize',
+                client_id=current_app.config['SPOTIFY_CLIENT_ID'],
+                client_secret=current_app.config['SPOTIFY_CLIENT_SECRET']
+            )
+            # Register YouTube OAuth with necessary details
+            oauth.register(
+                name='youtube',
+                base_url='https://www.googleapis.com/youtube/v3',
+                authorize_url='https://accounts.google.com/o/oauth2/auth',
+                # offline access comes with a refresh token, so migrations waiting out the quota can resume.
+                # google only hands one out on a consent screen, so ask for consent on every login
+                authorize_params={'access_type': 'offline', 'prompt': 'consent'},
+                access_token_url=YOUTUBE_TOKEN_URL,
+                access_token_params=None,
+                client_kwargs={'scope': 'https://www.googleapis.com/auth/youtube'},
+                client_id=current_app.config['YOUTUBE_CLIENT_ID'],
+                client_secret=current_app.config['YOUTUBE_CLIENT_SECRET']
+            )
+        return oauth.create_client(name)
+
+@views.route('/')
 def index():
     """
     Route to the home page of the application.
@@ -53,14 +185,14 @@ def index():
     session.clear()
     return render_template('index.html')
 
-@app.route('/spotify_login', methods=['GET'])
+@views.route('/spotify_login', methods=['GET'])
 def spotify_login():
     """
     Route to handle Spotify login. Redirects to Spotify's authorization page.
     """
-    callback = url_for('authorized', _external=True)
+    callback = url_for('.authorized', _external=True)
     session['oauth_state'] = os.urandom(24).hex()
-    return spotify.authorize_redirect(callback, state = session['oauth_state'])
+    return oauth_client('spotify').authorize_redirect(callback, state = session['oauth_state'])
 
 # @app.route('/logout')
 # def logout():
@@ -71,7 +203,7 @@ def spotify_login():
 #     print('byebye')
 #     return redirect(url_for('index'))
 
-@app.route('/spotify_login/authorized')
+@views.route('/spotify_login/authorized')
 def authorized():
     """
     Callback route for Spotify authorization. 
@@ -82,27 +214,28 @@ def authorized():
     stored_state = session.get('oauth_state')
     if not state or state != stored_state:
         return 'State mismatch. Potential CSRF attack.', 400
-    response = spotify.authorize_access_token()
+    response = oauth_client('spotify').authorize_access_token()
     if response is None or response.get('access_token') is None:
         return 'access denied: reason = {0} error = {1}'.format(
             request.args('error_reason'),
             request.args('error_description')
         )
     session['spotify_token'] = (response['access_token'])
-    return redirect(url_for("youtube_login"))
+    session['spotify_refresh_token'] = response.get('refresh_token')
+    return redirect(url_for(".youtube_login"))
 
 
-@app.route('/youtube_login')
+@views.route('/youtube_login')
 def youtube_login():
     """
     Route to handle YouTube login. Retrieves the access token.
     """
-    callback = url_for('youtube_authorized', _external=True)
+    callback = url_for('.youtube_authorized', _external=True)
     session['oauth_state'] = os.urandom(24).hex()
-    return youtube.authorize_redirect(callback, state = session['oauth_state'])
+    return oauth_client('youtube').authorize_redirect(callback, state = session['oauth_state'])
 
 
-@app.route('/youtube_login/youtube_authorized')
+@views.route('/youtube_login/youtube_authorized')
 def youtube_authorized():
     """
     Route to handle YouTube login. Retrieves the access token.
@@ -113,150 +246,314 @@ def youtube_authorized():
     if not state or state != stored_state:
         return 'State mismatch. Potential CSRF attack.', 400
     
-    response = youtube.authorize_access_token()
+    response = oauth_client('youtube').authorize_access_token()
     if response is None or response.get('access_token') is None:
         return 'access denied: reason = {0} error = {1}'.format(
             request.args('error_reason'),
             request.args('error_description')
         )
     session['youtube_token'] = (response['access_token'])
-    return redirect(url_for('playlist_selection'))
+    session['youtube_refresh_token'] = response.get('refresh_token')
+    session['youtube_channel_id'] = get_channel_id(session['youtube_token'])
+    return redirect(url_for('.playlist_selection'))
 
-@app.route('/playlist_selection')
+@views.route('/playlist_selection')
 def playlist_selection():
     """
     Displays the playlist selection page after successful login.
+    The listing comes from the session's cached copy while it is fresh, ?refresh=1 fetches it again
     """
-    playlist_list = get_playlists(session['spotify_token']) 
-    return render_template('playlist_selection.html', playlists=playlist_list)
+    cached = session.get('playlist_info')
+    fresh = cached is not None and cached['fetched_at'] + playlist_cache_ttl > time.time()
+    if fresh and not request.args.get('refresh'):
+        playlist_list = cached['playlists']
+    elif 'spotify_token' in session:
+        playlist_list = get_playlists(session['spotify_token'])
+    else:
+        return redirect(url_for('.index'))
+    return render_template('playlist_selection.html', playlists=playlist_list or [])
 
-@app.route('/playlist_selection/add', methods=['POST'])
+@views.route('/playlist_selection/add', methods=['POST'])
 def add():
     """
     Adds selected playlists to the session for migration.
     """
     playlists = request.form.getlist('selected_playlists')
     session['playlists'] = playlists
-    return redirect(url_for('migrate'))
+    session['sync'] = request.form.get('sync') == 'on'
+    return redirect(url_for('.migrate'))
 
-@app.route('/playlist_selection/migrate')
+@views.route('/playlist_selection/migrate')
 def migrate():
     """
-    Initiates the playlist migration process.
+    Queues the playlist migration (or incremental sync) as a background job and returns its id right away.
+    Progress can be polled from /jobs/<job_id> or streamed from /jobs/<job_id>/events.
+    Submitting a selection that is already being migrated returns the running job instead of starting another
     """
-    playlists = bundle_playlists()
-    insert_playlists(playlists)
-    session.pop('spotify_token')
-    session.pop('youtube_token')
-    return render_template('index.html')
+    channel_id = session.get('youtube_channel_id')
+    args = (session['spotify_token'], session['youtube_token'], session['playlists'], channel_id)
+    if session.get('sync'):
+        kind, target = 'sync', run_sync
+    elif quota_scheduling == 'on':
+        kind, target = 'migration', run_scheduled_migration
+        args += ({'spotify': session.get('spotify_refresh_token'), 'youtube': session.get('youtube_refresh_token')},
+                 oauth_credentials())
+    elif migration_backend == 'queue':
+        kind, target = 'migration', run_queued_migration
+    else:
+        kind, target = 'migration', run_migration
+    key = f'{kind}:{migration_key(channel_id, session["playlists"])}' if channel_id else None
+    job = jobs.submit(kind, target, *args, key=key)
+    for token in ('spotify_token', 'youtube_token', 'spotify_refresh_token', 'youtube_refresh_token'):
+        session.pop(token, None)
+    return job_accepted(job)
+
+@views.route('/playlist_selection/estimate', methods=['POST'])
+def estimate():
+    """
+    Dry run of migrating the selected playlists: the youtube quota it would cost, counting songs
+    that are already cached or repeated across playlists, and how much of today's quota is left
+    """
+    if 'spotify_token' not in session:
+        return jsonify(error='log in to spotify first'), 401
+    playlist_ids = request.form.getlist('selected_playlists')
+    cost = estimate_migration(session['spotify_token'], playlist_ids, session.get('youtube_channel_id'))
+    if cost['unreadable']:
+        return jsonify(error='spotify could not return every track of some playlists, try again later',
+                       unreadable=cost['unreadable']), 502
+    remaining, resets_at = quota_budget.remaining()
+    return jsonify(dict(cost, remaining_today=remaining, quota_resets_at=resets_at))
+
+def job_accepted(job):
+    """
+    202 response pointing at a queued job's status and progress stream
+    """
+    return jsonify(job_id=job.id, status_url=url_for('.job_status', job_id=job.id),
+                   events_url=url_for('.job_events', job_id=job.id)), 202
+
+@views.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Reports the status and per-playlist progress of a background job
+    """
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify(error='unknown job'), 404
+    return jsonify(job.to_dict())
+
+@views.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """
+    Server-sent events with the live progress of a job: every resolved, inserted and failed track.
+    A reconnecting browser resumes after its Last-Event-ID
+    """
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify(error='unknown job'), 404
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    return Response(sse.job_stream(job, last_event_id, sse_heartbeat), content_type='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@views.route('/jobs/<job_id>/trace')
+def job_trace(job_id):
+    """
+    Span timeline of a finished, traced job in the Chrome trace format, for chrome://tracing or Perfetto.
+    Jobs are traced at the trace_sample_rate
+    """
+    job = jobs.get_job(job_id)
+    if job is None or job.trace is None:
+        return jsonify(error='no trace for this job'), 404
+    if job.finished_at is None:
+        return jsonify(error='job is still running'), 409
+    return jsonify(job.trace.to_chrome())
+
+@views.route('/metrics')
+def metrics_endpoint():
+    """
+    Latency, status, retry, concurrency and youtube quota metrics in the Prometheus text format
+    """
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
-@app.route('/reset', methods=['POST'])
+@views.route('/reset', methods=['POST'])
 def reset():
     """
-    Deletes all playlists
+    Queues a background job deleting all of the user's youtube playlists and returns its id right away.
+    Progress can be polled from /jobs/<job_id> or streamed from /jobs/<job_id>/events
     """
-    playlist_ids = []
-    response = requests.get('https://www.googleapis.com/youtube/v3/playlists?part=snippet%2Cstatus&key={youtube_api_key}&mine=true&maxResults=50',
-                            headers = {'Authorization': f'Bearer {session["youtube_token"]}',
-                                       'Accept': 'application/json'}
-                            )
-    
-    playlists = response.json()
-    for p in playlists['items']:
-        playlist_ids.append(p['id'])
-        response = requests.delete(f'https://www.googleapis.com/youtube/v3/playlists?id={p["id"]}&key={youtube_api_key}',
-                                 headers = {'Authorization': f'Bearer {session["youtube_token"]}',
-                                       'Accept': 'application/json'}
-                            )
-        print(response.status_code)
+    channel_id = session.get('youtube_channel_id')
+    job = jobs.submit('reset', run_reset, session['youtube_token'], key=f'reset:{channel_id}' if channel_id else None)
     session.pop('spotify_token')
     session.pop('youtube_token')
-    return redirect(url_for('index'))
-    
+    return job_accepted(job)
+
 
 
+def spotify_client(access_token):
+    """
+    Spotify API client for a user, sharing the pooled session
+    """
+    return clients.SpotifyClient(access_token, http_session, spotify_api_base, response_cache, spotify_concurrency)
+
+def youtube_client(access_token):
+    """
+    YouTube API client for a user, sharing the pooled session, rate limiter and concurrency limiter
+    """
+    return clients.YouTubeClient(access_token, http_session, youtube_limiter, youtube_api_key, youtube_api_base,
+                                 response_cache, youtube_concurrency)
+
 def get_playlists(access_token):
     """
-    Get current user's list of playlists
+    Get current user's list of playlists as compact records (id, name, track count, snapshot id).
+    Every page is read, the ones after the first concurrently, and the listing is cached in the session
     """
-    response = requests.get('https://api.spotify.com/v1/me/playlists',
-                            headers = {'Authorization': f'Bearer {access_token}'})
+    client = spotify_client(access_token)
+    response = client.get('me/playlists', params={'limit': SPOTIFY_PLAYLISTS_PAGE_SIZE, 'offset': 0})
     if response.status_code == 200:
-        playlists = response.json()
-        session['playlist_info'] = playlists['items']
-        return playlists['items']
+        pages = fetch_pages(client, 'me/playlists', SPOTIFY_PLAYLISTS_PAGE_SIZE, first_page=response.json())
+        try:
+            # keep only what the selection page needs in the session
+            playlists = [{'id': p['id'], 'name': p['name'], 'total': p['tracks']['total'],
+                          'snapshot_id': p.get('snapshot_id')}
+                         for p in pages if p]
+        except clients.PageFailedError:
+            # never cache a listing with playlists missing
+            return None
+        session['playlist_info'] = {'fetched_at': time.time(), 'playlists': playlists}
+        return playlists
     else:
         # Output an error message if something went wrong
         print(f"Error: {response.status_code}")
         print(f"Message: {response.text}")
 
-def get_title(access_token, playlist_id):
+def map_ahead(submit, items, window, cancel=True):
     """
-    Get title of a spotify playlist given spotify playlist id
+    Like executor.map, but yields results in order while keeping only window calls in flight
+    ahead of the consumer, so lazy inputs are never read far ahead.
+    submit schedules one item and returns its future; pending futures are cancelled on close
+    unless they are shared with other consumers
     """
-    response = requests.get(f'https://api.spotify.com/v1/playlists/{playlist_id}',
-                            headers = {'Authorization': f'Bearer {access_token}'})
-    if response.status_code == 200:
-        playlist = response.json()
-        return playlist['name']
-    else:
-        # Output an error message if something went wrong
-        print(f"Error: {response.status_code}")
-        print(f"Message: {response.text}")
+    items = iter(items)
+    pending = collections.deque(submit(item) for item in itertools.islice(items, window))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            for item in itertools.islice(items, 1):
+                pending.append(submit(item))
+            yield result
+    finally:
+        if cancel:
+            for future in pending:
+                future.cancel()
 
-def get_songs(access_token, playlist_id):
+def fetch_pages(client, path, limit, params=None, first_page=None):
     """
-    Gets songs from a playlist given a spotify playlist id
+    Yields the items of a Spotify paging object in order.
+    Reads the first page (unless the caller already has it) to learn the total, then fetches
+    the remaining offsets in parallel, keeping at most a few pages ahead of the consumer in memory.
+    Raises clients.PageFailedError for a page that still fails once the client gave up retrying it
     """
-    response = requests.get(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks',
-                            headers = {'Authorization': f'Bearer {access_token}'})
-    track_list = []
-    if response.status_code == 200:
-        tracks = response.json().get('items', [])
-        for t in tracks:
-            track_name = t['track']['name']
-            track_list.append(track_name)
-            # print(track_name)
-    else:
+    params = dict(params or {}, limit=limit)
+    if first_page is None:
+        response = client.get(path, params=dict(params, offset=0))
+        if response.status_code != 200:
+            # Output an error message if something went wrong
+            print(f"Error: {response.status_code}")
+            print(f"Message: {response.text}")
+            raise clients.PageFailedError(f'spotify answered {response.status_code} for {path} at offset 0')
+        first_page = response.json()
+    first_items = first_page.get('items', [])
+    yield from first_items
+
+    def get_page(offset):
+        return client.get(path, params=dict(params, offset=offset))
+
+    offsets = range(len(first_items), first_page.get('total', 0), limit)
+    with tracing.ContextExecutor(max_workers=spotify_page_workers) as executor:
+        pages = map_ahead(functools.partial(executor.submit, get_page), offsets, spotify_page_workers * 2)
+        for offset, response in zip(offsets, pages):
+            if response.status_code != 200:
+                print(f"Error: {response.status_code}")
+                print(f"Message: {response.text}")
+                # skipping the page would migrate the playlist with tracks missing and then drop its journal
+                raise clients.PageFailedError(f'spotify answered {response.status_code} for {path} at offset {offset}')
+            yield from response.json().get('items', [])
+
+def get_songs(access_token, playlist_id, first_page=None):
+    """
+    Gets songs from a playlist given a spotify playlist id.
+    Yields track records (name, artists, duration, ISRC) in playlist order while the remaining pages
+    are still being fetched
+    """
+    client = spotify_client(access_token)
+    pages = fetch_pages(client, f'playlists/{playlist_id}/tracks', SPOTIFY_TRACKS_PAGE_SIZE,
+                        params={'fields': clients.SPOTIFY_TRACK_FIELDS}, first_page=first_page)
+    for t in pages:
+        # local files and removed tracks come back with a null track
+        if t.get('track'):
+            yield matching.from_spotify(t['track'])
+
+def get_playlist_snapshot(access_token, playlist_id):
+    """
+    Gets a spotify playlist's name, snapshot id and track count in one call, projected to just those fields.
+    Its songs stream from the first page of tracks embedded in that response, then the remaining pages
+    """
+    with tracing.span('read playlist', playlist_id=playlist_id):
+        response = spotify_client(access_token).get(f'playlists/{playlist_id}',
+                                                    params={'fields': clients.SPOTIFY_PLAYLIST_FIELDS})
+    if response.status_code != 200:
         # Output an error message if something went wrong
         print(f"Error: {response.status_code}")
         print(f"Message: {response.text}")
-    return track_list
+        return None
+    playlist = response.json()
+    return {
+        'id': playlist_id,
+        'name': playlist['name'],
+        'snapshot_id': playlist['snapshot_id'],
+        'total': playlist['tracks']['total'],
+        'songs': get_songs(access_token, playlist_id, first_page=playlist['tracks']),
+    }
 
-def bundle_playlists():
+def bundle_playlists(access_token, playlist_ids):
     """
-    Create a dictionary with playlist titles as keys and songs as the paired values.
-    Makes network calls to spotify, applies multithreading to make multiple calls at once
+    Create the migration plan of the selected playlists, in selection order.
+    Makes one network call to spotify per playlist, applies multithreading to make multiple calls at once.
+    Songs stream in from spotify as the plan is consumed
     """
-    migrate_list = {}
-    futures = []
+    migration_plan = Plan()
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-        for p in session['playlists']:
-            title_future = executor.submit(get_title, session['spotify_token'], p)
-            songs_future = executor.submit(get_songs, session['spotify_token'], p)
-            futures.append((title_future, songs_future))
+    with tracing.span('read playlists'), tracing.ContextExecutor(max_workers=spotify_max_workers) as executor:
+        futures = [executor.submit(get_playlist_snapshot, access_token, p) for p in playlist_ids]
 
-    for title_future, songs_future in futures:
+    for future in futures:
         try:
-            title = title_future.result()  # Wait for the future result
-            songs = songs_future.result()
-            migrate_list[title] = songs
+            snapshot = future.result()  # Wait for the future result
+            if snapshot is not None:
+                migration_plan.add(snapshot['id'], snapshot['name'], snapshot['snapshot_id'], snapshot['total'],
+                                   snapshot['songs'])
         except Exception as e:
             print(f"Error occurred: {e}")
-    return migrate_list
+    return migration_plan
+
+def get_channel_id(access_token):
+    """
+    Gets the id of the current user's youtube channel
+    """
+    response = youtube_client(access_token).call('channels.list', 'GET', 'channels',
+                                                 params={'part': 'id', 'mine': 'true', 'fields': 'items(id)'})
+    if response.status_code == 200:
+        items = response.json().get('items', [])
+        return items[0]['id'] if items else None
+    else:
+        # Output an error message if something went wrong
+        print(f"Error: {response.status_code}")
+        print(f"Message: {response.text}")
 
 def create_playlist(access_token, playlist_name):
     """
     creates a youtube playlist with a given title in current user's account
     """
-    url = f'https://www.googleapis.com/youtube/v3/playlists?part=snippet%2Cstatus&key={youtube_api_key}'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
     data = {
         'snippet': {
             'title': f'{playlist_name}',
@@ -267,57 +564,59 @@ def create_playlist(access_token, playlist_name):
             'privacyStatus': 'private'
         }
     }
-    response = requests.post(url, headers= headers, json = data)
-    
-    if response.status_code:
+    response = youtube_client(access_token).call('playlists.insert', 'POST', 'playlists',
+                                                 params={'part': 'snippet,status', 'fields': 'id'}, json=data)
+
+    if response.status_code == 200:
         playlist = response.json()
         return playlist['id']
     else:
         # Output an error message if something went wrong
         print(f"Error: {response.status_code}")
         print(f"Message: {response.text}")
-        print("boogabooga")
 
-def get_song(access_token, song_name):
+def get_song(access_token, song):
     """
-    gets first video in a search result given the name of a song
+    gets the best matching video for a song, given a track record or just the name of a song.
+    A search fetches a few candidates and one videos.list call scores them all on title, artist and duration.
+    Songs resolved before are answered from the song cache without calling youtube
     """
-    url = 'https://www.googleapis.com/youtube/v3/search'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
-    params = {
-        'part': 'snippet',
-        'q': song_name,
-        'type': 'video',
-        'maxResults': 1,
-        'key': access_token
-    }
-    response = requests.get(url, headers = headers, params=params)
+    track = matching.as_track(song)
+    with tracing.span('resolve', track=track['name']):
+        key = matching.track_key(track)
+        video_id = song_cache.get(key)
+        if video_id is not None:
+            return video_id
 
-    
-    if response.status_code:
-        song = response.json()['items'][0]['id']['videoId']
-        return song
-    else:
-        # Output an error message if something went wrong
-        print(f"Error: {response.status_code}")
-        print(f"Message: {response.text}")
-    return response.json()
-    
+        youtube = youtube_client(access_token)
+        response = youtube.call('search.list', 'GET', 'search', params=matching.search_params(track, match_candidates))
+        if response.status_code != 200:
+            # Output an error message if something went wrong
+            print(f"Error: {response.status_code}")
+            print(f"Message: {response.text}")
+            return None
+        candidates = [item['id']['videoId'] for item in response.json().get('items', [])]
+        if not candidates:
+            print(f"No video found for {track['name']}")
+            return None
 
-def insert_song(access_token, playlist_id, video_id):
+        video_id = candidates[0]
+        # nothing to choose between for a single candidate, skip the scoring call
+        if len(candidates) > 1:
+            response = youtube.call('videos.list', 'GET', 'videos', params=matching.videos_params(candidates))
+            if response.status_code == 200:
+                video_id = matching.best_match(track, response.json().get('items', [])) or video_id
+            else:
+                print(f"Error: {response.status_code}")
+                print(f"Message: {response.text}")
+        song_cache.set(key, video_id)
+        return video_id
+
+def insert_song(access_token, playlist_id, video_id, position=None):
     """
-    inserts a video into a youtube playlist given a youtube playlist id and video id
+    inserts a video into a youtube playlist given a youtube playlist id and video id,
+    optionally at an explicit position
     """
-    url = f'https://youtube.googleapis.com/youtube/v3/playlistItems?part=snippet&key={youtube_api_key}'
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
     data = {
         'snippet': {
             'playlistId': playlist_id,
@@ -327,9 +626,12 @@ def insert_song(access_token, playlist_id, video_id):
             }
         }
     }
-    response = requests.post(url, headers=headers, json=data)
-    
-    if response.status_code:
+    if position is not None:
+        data['snippet']['position'] = position
+    response = youtube_client(access_token).call('playlistItems.insert', 'POST', 'playlistItems',
+                                                 params={'part': 'snippet', 'fields': 'id'}, json=data)
+
+    if response.status_code == 200:
         song = response.json()
         return song
     else:
@@ -337,19 +639,438 @@ def insert_song(access_token, playlist_id, video_id):
         print(f"Error: {response.status_code}")
         print(f"Message: {response.text}")
 
-def insert_playlists(spotify_playlists):
+def list_playlists(access_token):
+    """
+    Yields the ids of all of the current user's youtube playlists, following every page.
+    Raises clients.PageFailedError for a page that fails, a partial listing must not pass for the whole one
+    """
+    youtube = youtube_client(access_token)
+    params = {'part': 'id', 'mine': 'true', 'maxResults': 50, 'fields': 'nextPageToken,items(id)'}
+    while True:
+        response = youtube.call('playlists.list', 'GET', 'playlists', params=params)
+        if response.status_code != 200:
+            # Output an error message if something went wrong
+            print(f"Error: {response.status_code}")
+            print(f"Message: {response.text}")
+            raise clients.PageFailedError(f'youtube answered {response.status_code} for playlists.list')
+        page = response.json()
+        for p in page.get('items', []):
+            yield p['id']
+        if not page.get('nextPageToken'):
+            return
+        params['pageToken'] = page['nextPageToken']
+
+def delete_playlist(access_token, playlist_id):
+    """
+    deletes a youtube playlist, returns whether it is gone
+    """
+    response = youtube_client(access_token).call('playlists.delete', 'DELETE', 'playlists',
+                                                 params={'id': playlist_id})
+    if response.status_code in (204, 404):
+        return True
+    # Output an error message if something went wrong
+    print(f"Error: {response.status_code}")
+    print(f"Message: {response.text}")
+    return False
+
+def delete_playlist_item(access_token, item_id):
+    """
+    removes an item from a youtube playlist, returns whether it is gone
+    """
+    response = youtube_client(access_token).call('playlistItems.delete', 'DELETE', 'playlistItems',
+                                                 params={'id': item_id})
+    if response.status_code in (204, 404):
+        return True
+    # Output an error message if something went wrong
+    print(f"Error: {response.status_code}")
+    print(f"Message: {response.text}")
+    return False
+
+def resolve_song(access_token, journal, song):
+    """
+    get_song that answers from the migration's journal first and journals new resolutions
+    """
+    key = matching.track_key(song)
+    video_id = journal.resolved.get(key)
+    if video_id is None:
+        video_id = get_song(access_token, song)
+        if video_id is not None:
+            journal.record_resolved(key, video_id)
+    return video_id
+
+def migrate_playlist(access_token, playlist, executor, resolver, job, journal):
+    """
+    Recreates one planned playlist on youtube, resuming after the last track its journal committed.
+    Playlist creation and song searches run on the shared executor while this thread
+    inserts the resolved songs one at a time, in playlist order.
+    Songs go through the migration wide resolver so each distinct song is only searched once
+    """
+    title = playlist.title
+    with tracing.span('migrate playlist', playlist=title):
+        start, position = journal.resume_point(playlist.key)
+        job.start_playlist(title, done=start)
+        playlist_id = journal.playlists.get(playlist.key)
+        created = executor.submit(create_playlist, access_token, playlist.name) if playlist_id is None else None
+        searches = map_ahead(resolver.submit, itertools.islice(playlist, start, None), youtube_search_window,
+                             cancel=False)
+        with contextlib.closing(searches):
+            if created is not None:
+                playlist_id = created.result()
+                if playlist_id is None:
+                    job.finish_playlist(title, status='failed')
+                    return None
+                journal.record_playlist(playlist.key, playlist_id)
+            for index, video_id in enumerate(searches, start):
+                track = playlist.tracks[index]
+                track.resolve(video_id)
+                job.track_resolved(title, index, video_id)
+                with tracing.span('insert', track=index):
+                    inserted = (video_id is not None
+                                and insert_song(access_token, playlist_id, video_id, position) is not None)
+                if video_id is not None:
+                    track.state = INSERTED if inserted else FAILED
+                position += inserted
+                journal.record_track(playlist.key, index, inserted)
+                job.track_done(title, ok=inserted, index=index)
+        job.finish_playlist(title, playlist_id)
+        return playlist_id
+
+def insert_playlists(access_token, spotify_playlists, job=None, journal=None):
+    """
+    given a migration plan (or a dictionary with playlist titles as keys and songs as values),
+    create playlists in youtube with the given titles and insert the corresponding songs into the playlists.
+    Playlists are migrated concurrently, inserts are only serialised within a playlist.
+    Returns a dictionary of playlist titles to the created youtube playlist ids
+    """
+    migration_plan = as_plan(spotify_playlists)
+    job = job or jobs.Job('migration')
+    journal = journal or Journal()
+    migrate_list = {}
+    with tracing.ContextExecutor(max_workers=youtube_max_workers) as executor, \
+            tracing.ContextExecutor(max_workers=playlist_workers) as playlist_executor:
+        resolver = SharedResolver(executor, functools.partial(resolve_song, access_token, journal))
+        futures = {p.title: playlist_executor.submit(migrate_playlist, access_token, p, executor, resolver, job,
+                                                     journal)
+                   for p in migration_plan}
+        for p, future in futures.items():
+            try:
+                migrate_list[p] = future.result()
+            except (QuotaExceededError, RateLimitedError):
+                # youtube will refuse the other playlists too, stop instead of burning more calls
+                for pending in futures.values():
+                    pending.cancel()
+                resolver.cancel_all()
+                raise
+            except Exception as e:
+                print(f"Error occurred: {e}")
+                job.finish_playlist(p, status='failed')
+                migrate_list[p] = None
+    print(f"Resolved {resolver.unique} distinct songs for {resolver.requested} tracks")
+    return migrate_list
+
+def run_migration(job, spotify_token, youtube_token, playlist_ids, youtube_channel_id=None, migration_plan=None):
+    """
+    Background job body: reads the selected playlists from spotify and recreates them on youtube,
+    on the engine picked by migration_engine. A plan already read from spotify is used instead of reading it again.
+    Progress is journaled so rerunning the same selection after a failure resumes it
+    """
+    journal = Journal.open(journal_dir, migration_key(youtube_channel_id, playlist_ids))
+    try:
+        if migration_engine == 'asyncio':
+            # only loaded when selected so the threaded deployment never imports aiohttp
+            import async_engine
+            migrate_list = asyncio.run(async_engine.migrate(
+                job, spotify_token, youtube_token, playlist_ids, song_cache, youtube_limiter, youtube_api_key,
+                spotify_concurrency=spotify_concurrency, youtube_concurrency=youtube_concurrency,
+                page_size=SPOTIFY_TRACKS_PAGE_SIZE, journal=journal, match_candidates=match_candidates,
+                spotify_base_url=spotify_api_base, youtube_base_url=youtube_api_base, response_cache=response_cache,
+                migration_plan=migration_plan))
+        else:
+            playlists = migration_plan or bundle_playlists(spotify_token, playlist_ids)
+            migrate_list = insert_playlists(youtube_token, playlists, job, journal)
+    finally:
+        journal.close()
+    # keep the journal while anything is left to retry
+    if len(migrate_list) == len(playlist_ids) and None not in migrate_list.values():
+        journal.complete()
+    return migrate_list
+
+def drop_unreadable(migration_plan):
+    """
+    Reads every track of the plan, removing and returning the playlists a spotify page failed for
+    """
+    unreadable = []
+    for playlist in list(migration_plan):
+        try:
+            playlist.load()
+        except clients.PageFailedError as e:
+            print(f"Error occurred: {e}")
+            migration_plan.remove(playlist)
+            unreadable.append(playlist)
+    return unreadable
+
+def estimate_migration(spotify_token, playlist_ids, youtube_channel_id=None, migration_plan=None):
+    """
+    Youtube quota units a migration of the given playlists would spend, reading spotify (unless given the plan)
+    but never calling youtube. A journal left by an earlier attempt at the same selection is taken into account.
+    Playlists spotify could not read in full are left out and listed by id under unreadable
+    """
+    migration_plan = migration_plan or bundle_playlists(spotify_token, playlist_ids)
+    unreadable = [p.spotify_id for p in drop_unreadable(migration_plan)]
+    path = os.path.join(journal_dir, f'{migration_key(youtube_channel_id, playlist_ids)}.jsonl')
+    # only read an existing journal, a dry run must not leave one behind
+    journal = Journal(path) if os.path.exists(path) else None
+    try:
+        cost = quota.estimate(migration_plan, song_cache, journal, match_candidates, youtube_daily_quota)
+    finally:
+        if journal is not None:
+            journal.close()
+    return dict(cost, unreadable=unreadable)
+
+def oauth_credentials():
+    """
+    (client id, client secret) per API as the current app is configured, for jobs refreshing tokens outside a request
+    """
+    config = current_app.config
+    return {
+        'spotify': (config['SPOTIFY_CLIENT_ID'], config['SPOTIFY_CLIENT_SECRET']),
+        'youtube': (config['YOUTUBE_CLIENT_ID'], config['YOUTUBE_CLIENT_SECRET']),
+    }
+
+def refresh_access_token(api, refresh_token, credentials=None):
+    """
+    Fresh access token for a job that outlived the one it started with, None if the API refused.
+    credentials are the app's oauth_credentials(), the environment's client ids and secrets by default
+    """
+    url, client_id, client_secret = {
+        'spotify': (SPOTIFY_TOKEN_URL, spotify_client_id, spotify_client_secret),
+        'youtube': (YOUTUBE_TOKEN_URL, youtube_client_id, youtube_client_secret),
+    }[api]
+    if credentials and credentials.get(api):
+        client_id, client_secret = credentials[api]
+    response = http_session.post(url, data={'grant_type': 'refresh_token', 'refresh_token': refresh_token,
+                                            'client_id': client_id, 'client_secret': client_secret})
+    if response.status_code != 200:
+        # Output an error message if something went wrong
+        print(f"Error: {response.status_code}")
+        print(f"Message: {response.text}")
+        return None
+    return response.json()['access_token']
+
+def run_scheduled_migration(job, spotify_token, youtube_token, playlist_ids, youtube_channel_id=None,
+                            refresh_tokens=None, credentials=None, resumed=False):
+    """
+    Background job body with quota_scheduling=on: run_migration held to the daily youtube quota.
+    The job is postponed to the next quota window when its estimated cost does not fit this one,
+    and when youtube runs out of quota anyway it is postponed to the reset and resumes from its journal.
+    Access tokens expire within hours, so waiting needs the logins' refresh tokens; without them
+    the migration runs right away and stops where the quota runs out, like with quota_scheduling=off
     """
-    given a dictionary with playlist titles as keys and songs as values,
-    create playlists in youtube with the given titles and insert the corresponding songs into the playlists
+    refresh_tokens = refresh_tokens or {}
+    can_wait = bool(refresh_tokens.get('spotify') and refresh_tokens.get('youtube'))
+    if resumed:
+        spotify_token = refresh_access_token('spotify', refresh_tokens['spotify'], credentials) or spotify_token
+        youtube_token = refresh_access_token('youtube', refresh_tokens['youtube'], credentials) or youtube_token
+    args = (spotify_token, youtube_token, playlist_ids, youtube_channel_id, refresh_tokens, credentials, True)
+    # the plan read for the estimate is the one migrated, spotify is only read once
+    migration_plan = bundle_playlists(spotify_token, playlist_ids)
+    for playlist in drop_unreadable(migration_plan):
+        # the other playlists still migrate, the journal stays behind for a retry of this one
+        job.finish_playlist(playlist.title, status='failed')
+    cost = estimate_migration(spotify_token, playlist_ids, youtube_channel_id, migration_plan)
+    print(f"Migration {job.id} needs about {cost['units']} youtube quota units")
+    resume_at = quota_budget.admit(job.id, cost['units'])
+    if resume_at is not None and can_wait:
+        raise jobs.Postponed(resume_at, 'youtube quota', args)
+    try:
+        with quota_budget.charging(job.id):
+            if migration_backend == 'queue':
+                # the workers read their playlist from spotify again and spend quota in their own processes;
+                # one running out of quota fails its task instead of postponing the job, a rerun resumes it
+                readable = [p.spotify_id for p in migration_plan]
+                return run_queued_migration(job, spotify_token, youtube_token, readable, youtube_channel_id)
+            return run_migration(job, spotify_token, youtube_token, playlist_ids, youtube_channel_id,
+                                 migration_plan)
+    except QuotaExceededError:
+        resume_at = quota_budget.exhaust()
+        if not can_wait:
+            raise
+        raise jobs.Postponed(resume_at, 'youtube quota', args)
+    finally:
+        # what the job spent stays counted, the rest of its estimate is free for other jobs again
+        quota_budget.release(job.id)
+
+def run_queued_migration(job, spotify_token, youtube_token, playlist_ids, youtube_channel_id=None):
     """
+    Background job body for migration_backend=queue: queues one task per playlist for the worker processes,
+    then mirrors their progress into the job until every task has finished or failed for good.
+    Fails when no worker picks up any of the tasks within queue_pickup_timeout seconds.
+    Returns a dictionary of spotify playlist ids to the created youtube playlist ids
+    """
+    work_queue.purge(jobs.job_ttl)
+    for playlist_id in playlist_ids:
+        work_queue.put(job.id, 'migrate_playlist', {
+            'spotify_token': spotify_token,
+            'youtube_token': youtube_token,
+            'playlist_id': playlist_id,
+            'youtube_channel_id': youtube_channel_id,
+        })
+    # each task reports its playlist under the bare name, same named playlists get their own titles in the job
+    titles, taken = {}, set()
+    deadline = time.monotonic() + queue_pickup_timeout
+    while True:
+        tasks = work_queue.tasks(job.id)
+        for task in tasks:
+            for name, progress in (task['progress'] or {}).items():
+                if task['id'] not in titles:
+                    titles[task['id']] = unique_title(name, taken)
+                job.update_playlist(titles[task['id']], progress)
+        if all(task['status'] in ('done', 'failed') for task in tasks):
+            break
+        if time.monotonic() > deadline and all(task['attempts'] == 0 for task in tasks):
+            work_queue.cancel(job.id, 'no worker picked the task up')
+            raise RuntimeError(f'no migration worker picked up the job within {queue_pickup_timeout:.0f}s, '
+                               'is worker.py running?')
+        time.sleep(queue_poll_interval)
+
     migrate_list = {}
-    for p in spotify_playlists:
-        playlist_id = create_playlist(session['youtube_token'], p)
-        for song in spotify_playlists[p]:   
-            video_id = get_song(session['youtube_token'], song)
-            insert_song(session['youtube_token'], playlist_id, video_id)
+    for playlist_id, task in zip(playlist_ids, tasks):
+        if task['status'] == 'done':
+            # one playlist per task, whatever name it was migrated under
+            migrate_list[playlist_id] = next(iter(task['result'].values()), None)
+            continue
+        print(f"Error occurred: {task['error']}")
+        title = titles.get(task['id']) or unique_title(playlist_id, taken)
+        if title not in job.playlists:
+            job.start_playlist(title)
+        job.finish_playlist(title, status='failed')
+        migrate_list[playlist_id] = None
     return migrate_list
 
+def run_reset(job, access_token):
+    """
+    Background job body for /reset: lists every page of the user's youtube playlists,
+    then deletes them concurrently under the shared rate limit
+    """
+    # list everything first, deleting while paging would shift later pages under the page tokens
+    playlist_ids = list(list_playlists(access_token))
+    job.start_playlist('youtube playlists', total=len(playlist_ids))
+    with tracing.ContextExecutor(max_workers=youtube_max_workers) as executor:
+        futures = [executor.submit(delete_playlist, access_token, p) for p in playlist_ids]
+        try:
+            for future in futures:
+                job.track_done('youtube playlists', ok=future.result())
+        except (QuotaExceededError, RateLimitedError):
+            for pending in futures:
+                pending.cancel()
+            raise
+    job.finish_playlist('youtube playlists')
+
+def sync_playlist(access_token, channel_id, snapshot, resolver, job, title=None):
+    """
+    Brings the youtube copy of a spotify playlist up to date with the playlist's current snapshot.
+    Unchanged playlists cost no youtube calls, changed ones only delete removed tracks and insert added ones,
+    playlists never synced before are copied in full. title is what its progress goes under, the name by default
+    """
+    title = title or snapshot['name']
+    with tracing.span('sync playlist', playlist=title):
+        state = sync_store.get(channel_id, snapshot['id'])
+        if state is not None and state[1] == snapshot['snapshot_id']:
+            job.start_playlist(title, done=snapshot['total'], total=snapshot['total'])
+            job.finish_playlist(title, state[0], status='unchanged')
+            return state[0]
+
+        job.start_playlist(title, total=snapshot['total'])
+        tracks = list(snapshot['songs'])
+        keys = [matching.track_key(t) for t in tracks]
+        kept_keys = collections.Counter(keys)
+        if state is None:
+            playlist_id = create_playlist(access_token, snapshot['name'])
+            if playlist_id is None:
+                job.finish_playlist(title, status='failed')
+                return None
+            sync_store.save_playlist(channel_id, snapshot['id'], playlist_id)
+            old_items = []
+        else:
+            playlist_id, _, old_items = state
+
+        # removed tracks: every synced item beyond how often its track is still in the playlist
+        kept = collections.defaultdict(collections.deque)
+        for key, item_id in old_items:
+            if kept_keys[key] > 0:
+                kept_keys[key] -= 1
+                kept[key].append(item_id)
+            elif not delete_playlist_item(access_token, item_id):
+                kept[key].append(item_id)
+        sync_store.replace_items(channel_id, snapshot['id'], [(k, i) for k in kept for i in kept[k]])
+
+        # added tracks: whatever is not covered by a kept item, inserted at its place in the new order
+        reused = collections.Counter({key: len(item_ids) for key, item_ids in kept.items()})
+        searches = {}
+        for index, (track, key) in enumerate(zip(tracks, keys)):
+            if reused[key] > 0:
+                reused[key] -= 1
+            else:
+                searches[index] = resolver.submit(track)
+        items = []
+        for index, key in enumerate(keys):
+            if index not in searches:
+                items.append((key, kept[key].popleft()))
+                continue
+            video_id = searches[index].result()
+            job.track_resolved(title, index, video_id)
+            item = video_id and insert_song(access_token, playlist_id, video_id, len(items))
+            if item:
+                items.append((key, item['id']))
+                sync_store.add_item(channel_id, snapshot['id'], key, item['id'])
+            job.track_done(title, ok=bool(item), index=index)
+        # items whose delete failed stay recorded so the next sync retries them
+        items.extend((key, item_id) for key in kept for item_id in kept[key])
+        sync_store.replace_items(channel_id, snapshot['id'], items)
+        sync_store.save_playlist(channel_id, snapshot['id'], playlist_id, snapshot['snapshot_id'])
+        job.finish_playlist(title, playlist_id)
+        return playlist_id
+
+def run_sync(job, spotify_token, youtube_token, playlist_ids, youtube_channel_id=None):
+    """
+    Background job body for incremental syncs: applies only what changed in each selected playlist
+    since it was last synced to the user's youtube channel
+    """
+    if youtube_channel_id is None:
+        raise ValueError('syncing needs the youtube channel id, log in to youtube again')
+    sync_list = {}
+    with tracing.ContextExecutor(max_workers=youtube_max_workers) as executor, \
+            tracing.ContextExecutor(max_workers=playlist_workers) as playlist_executor:
+        resolver = SharedResolver(executor, functools.partial(get_song, youtube_token))
+        snapshots = [executor.submit(get_playlist_snapshot, spotify_token, p) for p in playlist_ids]
+        futures = {}
+        # same named playlists are told apart in the job's progress like in a migration plan
+        titles, titles_by_id = set(), {}
+        for p, snapshot in zip(playlist_ids, snapshots):
+            snapshot = snapshot.result()
+            if snapshot is None:
+                sync_list[p] = None
+                continue
+            titles_by_id[p] = unique_title(snapshot['name'], titles)
+            futures[p] = playlist_executor.submit(sync_playlist, youtube_token, youtube_channel_id, snapshot,
+                                                  resolver, job, titles_by_id[p])
+        for p, future in futures.items():
+            try:
+                sync_list[p] = future.result()
+            except (QuotaExceededError, RateLimitedError):
+                for pending in futures.values():
+                    pending.cancel()
+                resolver.cancel_all()
+                raise
+            except Exception as e:
+                print(f"Error occurred: {e}")
+                job.finish_playlist(titles_by_id[p], status='failed')
+                sync_list[p] = None
+    return sync_list
+
+# WSGI entry point, e.g. gunicorn --preload app:app
+app = create_app()
+
 if __name__ == '__main__':
     app.run(port = 8888)
 
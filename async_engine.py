@@ -0,0 +1,385 @@
+"""
+asyncio migration engine, an alternative to the thread pools in app.py.
+Runs the whole read, search and insert flow on one event loop with an adaptive concurrency limit per API.
+Selected with migration_engine=asyncio.
+The SQLite caches and the journal block on disk and locks, so they are only used from worker threads (to_thread).
+"""
+import asyncio
+import json
+
+import aiohttp
+
+import clients
+import http_cache
+import matching
+import metrics
+import tracing
+from concurrency import AdaptiveLimiter
+from journal import Journal
+from plan import FAILED, INSERTED, Plan
+from rate_limit import QuotaExceededError, RateLimitedError, backoff_delay
+
+
+class Response:
+    """
+    Fully read aiohttp response with the parts of the requests.Response interface the app uses
+    """
+
+    def __init__(self, status_code, headers, body):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = body
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+async def send(http, concurrency, method, url, api, endpoint, **kwargs):
+    """
+    Sends a request within the API's adaptive concurrency limit and reads the whole body.
+    api and endpoint label its metrics, only time spent holding the slot is measured
+    """
+    async def request():
+        async with http.request(method, url, **kwargs) as response:
+            return Response(response.status, response.headers, await response.read())
+    with tracing.span(f'{api} {endpoint}', 'api', method=method):
+        observed = lambda: metrics.observe_call_async(api, endpoint, method, request)
+        return await concurrency.call_async(observed, endpoint)
+
+
+class AsyncSpotifyClient:
+    """
+    Spotify Web API calls on behalf of one user
+    """
+
+    def __init__(self, access_token, http, concurrency, base_url=clients.SPOTIFY_API, cache=None,
+                 max_retries=clients.SPOTIFY_MAX_RETRIES, base_delay=1.0, max_delay=60.0):
+        self.http = http
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.base_url = base_url
+        self.cache = cache
+        self.headers = {'Authorization': f'Bearer {access_token}'}
+
+    async def get(self, path, params=None):
+        url = f'{self.base_url}/{path}'
+        headers, entry = self.headers, None
+        if self.cache is not None:
+            scope = http_cache.token_scope(self.headers) if path.split('/')[0] == 'me' else None
+            key = http_cache.cache_key(url, params, scope)
+            headers, entry = await asyncio.to_thread(self.cache.prepare, key, self.headers)
+        endpoint = metrics.spotify_endpoint(path)
+        for attempt in range(self.max_retries + 1):
+            response = await send(self.http, self.concurrency, 'GET', url, 'spotify', endpoint,
+                                  headers=headers, params=params)
+            if not clients.throttled(response) or attempt == self.max_retries:
+                break
+            delay = backoff_delay(attempt, response, self.base_delay, self.max_delay)
+            metrics.API_RETRIES.inc(api='spotify', endpoint=endpoint, reason=response.status_code)
+            print(f"Spotify answered {response.status_code} on {endpoint}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        if self.cache is None:
+            return response
+        return await asyncio.to_thread(self.cache.resolve, 'spotify', key, entry, response)
+
+
+class AsyncYouTubeClient:
+    """
+    YouTube Data API calls on behalf of one user, paced by the shared rate limiter
+    """
+
+    def __init__(self, access_token, http, concurrency, limiter, api_key=None, base_url=clients.YOUTUBE_API,
+                 cache=None):
+        self.http = http
+        self.concurrency = concurrency
+        self.limiter = limiter
+        self.api_key = api_key
+        self.base_url = base_url
+        self.cache = cache
+        self.headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Accept': 'application/json',
+        }
+
+    async def call(self, endpoint, method, path, params=None, json=None):
+        params = dict(params or {})
+        if self.api_key:
+            params['key'] = self.api_key
+        url = f'{self.base_url}/{path}'
+        headers, entry = self.headers, None
+        cached = self.cache is not None and method == 'GET'
+        if cached:
+            scope = http_cache.token_scope(self.headers) if params.get('mine') else None
+            key = http_cache.cache_key(url, params, scope)
+            headers, entry = await asyncio.to_thread(self.cache.prepare, key, self.headers)
+        response = await self.limiter.call_async(endpoint, lambda: send(
+            self.http, self.concurrency, method, url, 'youtube', endpoint,
+            headers=headers, params=params, json=json))
+        if not cached:
+            return response
+        return await asyncio.to_thread(self.cache.resolve, 'youtube', key, entry, response)
+
+
+def report_error(response):
+    # Output an error message if something went wrong
+    print(f"Error: {response.status_code}")
+    print(f"Message: {response.text}")
+
+
+class Engine:
+    """
+    One migration run: the spotify and youtube clients, the shared cache and the run's journal
+    """
+
+    def __init__(self, spotify, youtube, song_cache, page_size, journal, match_candidates=5):
+        self.spotify = spotify
+        self.youtube = youtube
+        self.song_cache = song_cache
+        self.page_size = page_size
+        self.journal = journal
+        self.match_candidates = match_candidates
+        # one resolution task per distinct song, shared across playlists
+        self.resolutions = {}
+
+    async def get_songs(self, playlist_id, first_page):
+        """
+        Track records of a playlist, every page after the first is fetched concurrently.
+        Raises clients.PageFailedError when a page still fails after the client's retries
+        """
+        path = f'playlists/{playlist_id}/tracks'
+        pages = [first_page]
+        params = {'limit': self.page_size, 'fields': clients.SPOTIFY_TRACK_FIELDS}
+        offsets = range(len(first_page.get('items', [])), first_page.get('total', 0), self.page_size)
+        responses = await asyncio.gather(*(self.spotify.get(path, params=dict(params, offset=offset))
+                                           for offset in offsets))
+        for offset, response in zip(offsets, responses):
+            if response.status_code != 200:
+                report_error(response)
+                raise clients.PageFailedError(f'spotify answered {response.status_code} for {path} at offset {offset}')
+            pages.append(response.json())
+        return [matching.from_spotify(t['track']) for page in pages for t in page.get('items', []) if t.get('track')]
+
+    async def get_playlist_snapshot(self, playlist_id):
+        """
+        Name, snapshot id, track count and songs of a playlist, starting from one projected playlist call.
+        None when the playlist or one of its pages could not be read
+        """
+        with tracing.span('read playlist', playlist_id=playlist_id):
+            response = await self.spotify.get(f'playlists/{playlist_id}',
+                                              params={'fields': clients.SPOTIFY_PLAYLIST_FIELDS})
+        if response.status_code != 200:
+            report_error(response)
+            return None
+        playlist = response.json()
+        try:
+            songs = await self.get_songs(playlist_id, playlist['tracks'])
+        except clients.PageFailedError as e:
+            # left out of the plan like an unreadable playlist, so the run keeps its journal for a retry
+            print(f"Error occurred: {e}")
+            return None
+        return {
+            'id': playlist_id,
+            'name': playlist['name'],
+            'snapshot_id': playlist['snapshot_id'],
+            'total': playlist['tracks']['total'],
+            'songs': songs,
+        }
+
+    async def create_playlist(self, playlist_name):
+        data = {
+            'snippet': {
+                'title': f'{playlist_name}',
+                'tags': ['API call'],
+                'defaultLanguage': 'en'
+            },
+            'status': {
+                'privacyStatus': 'private'
+            }
+        }
+        response = await self.youtube.call('playlists.insert', 'POST', 'playlists',
+                                           params={'part': 'snippet,status', 'fields': 'id'}, json=data)
+        if response.status_code != 200:
+            report_error(response)
+            return None
+        return response.json()['id']
+
+    async def get_song(self, song):
+        """
+        Best matching video for a track, scored like app.get_song
+        """
+        track = matching.as_track(song)
+        with tracing.span('resolve', track=track['name']):
+            return await self._get_song(track)
+
+    async def _get_song(self, track):
+        key = matching.track_key(track)
+        video_id = await asyncio.to_thread(self.song_cache.get, key)
+        if video_id is not None:
+            return video_id
+        response = await self.youtube.call('search.list', 'GET', 'search',
+                                           params=matching.search_params(track, self.match_candidates))
+        if response.status_code != 200:
+            report_error(response)
+            return None
+        candidates = [item['id']['videoId'] for item in response.json().get('items', [])]
+        if not candidates:
+            print(f"No video found for {track['name']}")
+            return None
+        video_id = candidates[0]
+        if len(candidates) > 1:
+            response = await self.youtube.call('videos.list', 'GET', 'videos',
+                                               params=matching.videos_params(candidates))
+            if response.status_code == 200:
+                video_id = matching.best_match(track, response.json().get('items', [])) or video_id
+            else:
+                report_error(response)
+        await asyncio.to_thread(self.song_cache.set, key, video_id)
+        return video_id
+
+    async def insert_song(self, playlist_id, video_id, position):
+        data = {
+            'snippet': {
+                'playlistId': playlist_id,
+                'position': position,
+                'resourceId': {
+                    'kind': 'youtube#video',
+                    'videoId': video_id
+                }
+            }
+        }
+        response = await self.youtube.call('playlistItems.insert', 'POST', 'playlistItems',
+                                           params={'part': 'snippet', 'fields': 'id'}, json=data)
+        if response.status_code != 200:
+            report_error(response)
+            return None
+        return response.json()
+
+    async def resolve_song(self, song):
+        """
+        get_song that answers from the journal first and journals new resolutions
+        """
+        key = matching.track_key(song)
+        video_id = self.journal.resolved.get(key)
+        if video_id is None:
+            video_id = await self.get_song(song)
+            if video_id is not None:
+                await asyncio.to_thread(self.journal.record_resolved, key, video_id)
+        return video_id
+
+    def resolve_shared(self, song):
+        """
+        Task resolving a song, shared with every other playlist asking for the same song
+        """
+        key = matching.track_key(song)
+        task = self.resolutions.get(key)
+        if task is None:
+            task = self.resolutions[key] = asyncio.ensure_future(self.resolve_song(song))
+        return task
+
+    async def migrate_playlist(self, playlist, job):
+        """
+        Recreates one planned playlist on youtube, resuming after the last journaled track.
+        Searches for every remaining song start at once (once per distinct song across playlists),
+        inserts follow in playlist order
+        """
+        with tracing.span('migrate playlist', playlist=playlist.title):
+            return await self._migrate_playlist(playlist, job)
+
+    async def _migrate_playlist(self, playlist, job):
+        title = playlist.title
+        tracks = playlist.load().tracks
+        start, position = self.journal.resume_point(playlist.key)
+        job.start_playlist(title, done=start)
+        searches = [self.resolve_shared(track) for track in tracks[start:]]
+        youtube_playlist_id = self.journal.playlists.get(playlist.key)
+        if youtube_playlist_id is None:
+            youtube_playlist_id = await self.create_playlist(playlist.name)
+            if youtube_playlist_id is None:
+                job.finish_playlist(title, status='failed')
+                return title, None
+            await asyncio.to_thread(self.journal.record_playlist, playlist.key, youtube_playlist_id)
+        for index, search in enumerate(searches, start):
+            video_id = await search
+            tracks[index].resolve(video_id)
+            job.track_resolved(title, index, video_id)
+            with tracing.span('insert', track=index):
+                inserted = (video_id is not None
+                            and await self.insert_song(youtube_playlist_id, video_id, position) is not None)
+            if video_id is not None:
+                tracks[index].state = INSERTED if inserted else FAILED
+            position += inserted
+            await asyncio.to_thread(self.journal.record_track, playlist.key, index, inserted)
+            job.track_done(title, ok=inserted, index=index)
+        job.finish_playlist(title, youtube_playlist_id)
+        return title, youtube_playlist_id
+
+    async def read_plan(self, playlist_ids):
+        """
+        Migration plan of the selected playlists, read concurrently and added in selection order
+        so duplicate names get the same titles on every run. Also returns the ids that could not be read
+        """
+        snapshots = await asyncio.gather(*(self.get_playlist_snapshot(p) for p in playlist_ids))
+        migration_plan = Plan()
+        unreadable = []
+        for playlist_id, snapshot in zip(playlist_ids, snapshots):
+            if snapshot is None:
+                unreadable.append(playlist_id)
+                continue
+            migration_plan.add(playlist_id, snapshot['name'], snapshot['snapshot_id'], snapshot['total'],
+                               snapshot['songs'])
+        return migration_plan, unreadable
+
+    async def try_migrate_playlist(self, playlist, job):
+        """
+        migrate_playlist that only lets quota and rate limit exhaustion end the whole job
+        """
+        try:
+            return await self.migrate_playlist(playlist, job)
+        except (QuotaExceededError, RateLimitedError):
+            raise
+        except Exception as e:
+            print(f"Error occurred: {e}")
+            job.finish_playlist(playlist.title, status='failed')
+            return playlist.title, None
+
+
+async def migrate(job, spotify_token, youtube_token, playlist_ids, song_cache, limiter, api_key=None,
+                  spotify_concurrency=20, youtube_concurrency=16, page_size=100,
+                  spotify_base_url=clients.SPOTIFY_API, youtube_base_url=clients.YOUTUBE_API, journal=None,
+                  match_candidates=5, response_cache=None, migration_plan=None):
+    """
+    Migrates the given spotify playlists to youtube on the running event loop.
+    spotify_concurrency and youtube_concurrency are shared AdaptiveLimiters, or starting limits for ones of this run.
+    A plan already read from spotify is migrated instead of reading the playlists again.
+    Returns a dictionary of playlist titles to the created youtube playlist ids
+    """
+    if isinstance(spotify_concurrency, int):
+        spotify_concurrency = AdaptiveLimiter('spotify', spotify_concurrency)
+    if isinstance(youtube_concurrency, int):
+        youtube_concurrency = AdaptiveLimiter('youtube', youtube_concurrency)
+    connector = aiohttp.TCPConnector(limit=spotify_concurrency.maximum + youtube_concurrency.maximum)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        spotify = AsyncSpotifyClient(spotify_token, http, spotify_concurrency, base_url=spotify_base_url,
+                                     cache=response_cache)
+        youtube = AsyncYouTubeClient(youtube_token, http, youtube_concurrency, limiter, api_key,
+                                     base_url=youtube_base_url, cache=response_cache)
+        engine = Engine(spotify, youtube, song_cache, page_size, journal or Journal(), match_candidates)
+        try:
+            if migration_plan is None:
+                migration_plan, unreadable = await engine.read_plan(playlist_ids)
+            else:
+                planned = {p.spotify_id for p in migration_plan}
+                unreadable = [p for p in playlist_ids if p not in planned]
+            results = await asyncio.gather(*(engine.try_migrate_playlist(p, job) for p in migration_plan))
+        finally:
+            for task in engine.resolutions.values():
+                task.cancel()
+    migrate_list = {title: youtube_playlist_id for title, youtube_playlist_id in results}
+    migrate_list.update(dict.fromkeys(unreadable))
+    return migrate_list
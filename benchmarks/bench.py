@@ -0,0 +1,168 @@
+"""
+Offline throughput benchmark of the migration pipeline against local Spotify/YouTube stand-ins.
+
+    python -m benchmarks.bench --sizes 5x50 20x200 --latency-ms 20 --engine threads
+
+Each size is PLAYLISTSxTRACKS. The "routes" scenario drives the real Flask routes
+(selection page, add, migrate, job polling), the "pipeline" scenario calls
+bundle_playlists/insert_playlists directly. Reports tracks/sec, API calls per track,
+p50/p99 API latency, youtube quota used, how many tracks got the right video and
+where the adaptive concurrency limits ended up.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import app
+import clients
+from benchmarks.fake_apis import FakeSpotify, FakeYouTube, Library
+from concurrency import AdaptiveLimiter
+from rate_limit import RateLimiter
+from http_cache import ResponseCache
+from session_store import SqliteSessionInterface
+from song_cache import SongCache
+from sync_state import SyncStore
+
+
+def configure(spotify_base, youtube_base, workdir, engine='threads', youtube_rps=1000.0):
+    """
+    Points the app at the stand-ins with fresh stores under workdir
+    """
+    app.spotify_api_base = f'{spotify_base}/v1'
+    app.youtube_api_base = f'{youtube_base}/youtube/v3'
+    app.http_session = clients.pooled_session({
+        app.spotify_api_base: app.spotify_max_workers,
+        app.youtube_api_base: app.youtube_max_workers,
+    })
+    app.spotify_concurrency = AdaptiveLimiter('spotify', app.spotify_workers, maximum=app.spotify_max_workers)
+    app.youtube_concurrency = AdaptiveLimiter('youtube', app.youtube_workers, maximum=app.youtube_max_workers)
+    app.youtube_limiter = RateLimiter(youtube_rps, max(1, int(youtube_rps)), base_delay=0.05, max_delay=1.0)
+    app.song_cache = SongCache(os.path.join(workdir, 'song_cache.db'))
+    app.sync_store = SyncStore(os.path.join(workdir, 'sync_state.db'))
+    app.response_cache = ResponseCache(os.path.join(workdir, 'response_cache.db'))
+    app.journal_dir = os.path.join(workdir, 'journals')
+    app.app.session_interface = SqliteSessionInterface(os.path.join(workdir, 'sessions.db'))
+    app.migration_engine = engine
+
+def run_routes(playlist_ids, timeout):
+    """
+    Logs in, selects every playlist and migrates through the Flask routes, waiting for the job
+    """
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['spotify_token'] = 'spotify_token'
+        session['youtube_token'] = 'youtube_token'
+        session['youtube_channel_id'] = 'UCfake'
+    client.get('/playlist_selection')
+    response = client.post('/playlist_selection/add', data={'selected_playlists': playlist_ids},
+                           follow_redirects=True)
+    status_url = response.get_json()['status_url']
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(status_url).get_json()
+        if job['status'] in ('finished', 'failed'):
+            return job
+        time.sleep(0.02)
+    raise TimeoutError(f'migration still running after {timeout}s')
+
+def run_pipeline(playlist_ids):
+    playlists = app.bundle_playlists('spotify_token', playlist_ids)
+    app.insert_playlists('youtube_token', playlists)
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def run(playlists, tracks, scenario='routes', engine='threads', latency=0.0, error_rate=0.0,
+        rate_limit_rate=0.0, daily_quota=None, overlap=0.3, youtube_rps=1000.0, timeout=600):
+    """
+    One benchmark run, returns its measurements as a dict
+    """
+    library = Library(playlists, tracks, overlap=overlap)
+    spotify = FakeSpotify(library, latency=latency, error_rate=error_rate, rate_limit_rate=rate_limit_rate)
+    youtube = FakeYouTube(library, daily_quota=daily_quota, latency=latency, error_rate=error_rate,
+                          rate_limit_rate=rate_limit_rate)
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(spotify.start(), youtube.start(), workdir, engine, youtube_rps)
+        try:
+            started = time.perf_counter()
+            error = None
+            if scenario == 'routes':
+                job = run_routes(list(library.playlists), timeout)
+                error = job['error']
+            else:
+                run_pipeline(list(library.playlists))
+            elapsed = time.perf_counter() - started
+        finally:
+            spotify.stop()
+            youtube.stop()
+
+    migrated = [video for items in youtube.playlists.values() for _, video in items]
+    total = library.total_tracks
+    spotify_calls = sum(spotify.calls.values())
+    youtube_calls = sum(youtube.calls.values())
+    latencies = spotify.latencies + youtube.latencies
+    return {
+        'size': f'{playlists}x{tracks}',
+        'scenario': scenario,
+        'engine': engine,
+        'error': error,
+        'seconds': round(elapsed, 3),
+        'tracks_per_second': round(len(migrated) / elapsed, 1),
+        'migrated': len(migrated),
+        'tracks': total,
+        'matched': sum(video.endswith('~official') for video in migrated),
+        'spotify_calls': spotify_calls,
+        'youtube_calls': youtube_calls,
+        'calls_per_track': round((spotify_calls + youtube_calls) / max(total, 1), 3),
+        'youtube_calls_by_endpoint': dict(youtube.calls),
+        'youtube_quota': youtube.quota_used,
+        'not_modified': spotify.not_modified + youtube.not_modified,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        'concurrency_limits': {'spotify': app.spotify_concurrency.limit, 'youtube': app.youtube_concurrency.limit},
+    }
+
+def parse_size(size):
+    playlists, _, tracks = size.partition('x')
+    return int(playlists), int(tracks)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=['5x50', '20x200'], help='PLAYLISTSxTRACKS per run')
+    parser.add_argument('--scenario', choices=['routes', 'pipeline'], default='routes')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='added to every API response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls answered with 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction of calls answered with 429')
+    parser.add_argument('--daily-quota', type=int, default=None, help='youtube quota units before 403s')
+    parser.add_argument('--overlap', type=float, default=0.3, help='share of tracks repeated across playlists')
+    parser.add_argument('--youtube-rps', type=float, default=1000.0, help='rate limiter setting for the run')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        playlists, tracks = parse_size(size)
+        result = run(playlists, tracks, args.scenario, args.engine, args.latency_ms / 1000, args.error_rate,
+                     args.rate_limit_rate, args.daily_quota, args.overlap, args.youtube_rps)
+        results.append(result)
+        print(f"{result['size']:>10} {result['engine']:>8} {result['seconds']:>8.2f}s "
+              f"{result['tracks_per_second']:>8.1f} tracks/s {result['calls_per_track']:>6.2f} calls/track "
+              f"p50 {result['p50_ms']:>7.2f}ms p99 {result['p99_ms']:>7.2f}ms "
+              f"quota {result['youtube_quota']:>7} matched {result['matched']}/{result['tracks']}"
+              + (f" error: {result['error']}" if result['error'] else ''))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""
+Local stand-ins for the Spotify Web API and YouTube Data API, for benchmarking without network.
+Both serve a generated library with configurable latency, error rate, 429s and a daily youtube quota.
+"""
+import collections
+import hashlib
+import http.server
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+from rate_limit import QUOTA_COST
+
+
+def _digest(text):
+    return int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
+
+
+class Library:
+    """
+    Generated spotify library: playlists of tracks drawn from a shared pool, so playlists overlap
+    """
+
+    def __init__(self, playlists, tracks_per_playlist, overlap=0.3, seed=0):
+        rng = random.Random(seed)
+        pool_size = max(tracks_per_playlist, int(playlists * tracks_per_playlist * (1 - overlap)))
+        self.tracks = [self.track(i) for i in range(pool_size)]
+        self.playlists = {}
+        for p in range(playlists):
+            self.playlists[f'playlist{p}'] = {
+                'name': f'Playlist {p}',
+                'snapshot_id': f'snapshot{p}',
+                'tracks': rng.sample(range(pool_size), tracks_per_playlist),
+            }
+
+    @staticmethod
+    def track(i):
+        return {
+            'id': f'track{i}',
+            'name': f'Song {i}',
+            'artists': [{'name': f'Artist {i % 97}'}],
+            'duration_ms': 150000 + (i * 7919) % 150000,
+            'external_ids': {'isrc': f'QZ{i:010d}'},
+        }
+
+    @property
+    def total_tracks(self):
+        return sum(len(p['tracks']) for p in self.playlists.values())
+
+
+class FakeServer:
+    """
+    Threaded HTTP server answering through handle(), with injected latency, 500s and 429s.
+    GET responses carry an ETag and a matching If-None-Match gets an empty 304.
+    Records per-endpoint call counts and the latency of every request
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.calls = collections.Counter()
+        self.latencies = []
+        self.not_modified = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        """
+        Serves on an ephemeral localhost port in a background thread, returns the base url
+        """
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body go out in separate writes, don't let Nagle hold the body back
+            disable_nagle_algorithm = True
+
+            def _serve(self):
+                started = time.perf_counter()
+                url = urllib.parse.urlsplit(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                status, payload, headers = fake.dispatch(self.command, url.path, query, body)
+                data = b'' if payload is None else json.dumps(payload).encode()
+                if self.command == 'GET' and status == 200:
+                    headers = dict(headers, ETag=f'"{hashlib.md5(data).hexdigest()}"')
+                    if self.headers.get('If-None-Match') == headers['ETag']:
+                        status, data = 304, b''
+                        with fake._lock:
+                            fake.not_modified += 1
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                with fake._lock:
+                    fake.latencies.append(time.perf_counter() - started)
+
+            do_GET = do_POST = do_DELETE = _serve
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def dispatch(self, method, path, query, body):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.error_rate:
+            return 500, {'error': {'message': 'injected error'}}, {}
+        if roll < self.error_rate + self.rate_limit_rate:
+            return 429, {'error': {'errors': [{'reason': 'rateLimitExceeded'}]}}, {}
+        return self.handle(method, path, query, body)
+
+    def count(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] += 1
+
+
+class FakeSpotify(FakeServer):
+    """
+    Spotify playlists and playlist tracks, with offset/limit paging
+    """
+
+    def __init__(self, library, **kwargs):
+        super().__init__(**kwargs)
+        self.library = library
+
+    def page(self, items, query, default_limit):
+        offset = int(query.get('offset', 0))
+        limit = min(int(query.get('limit', default_limit)), 100)
+        return {'items': items[offset:offset + limit], 'total': len(items), 'offset': offset, 'limit': limit}
+
+    def track_items(self, playlist):
+        return [{'track': self.library.track(i)} for i in playlist['tracks']]
+
+    def handle(self, method, path, query, body):
+        parts = path.strip('/').split('/')
+        if parts[:3] == ['v1', 'me', 'playlists']:
+            self.count('me/playlists')
+            items = [{'id': pid, 'name': p['name'], 'snapshot_id': p['snapshot_id'],
+                      'tracks': {'total': len(p['tracks'])}}
+                     for pid, p in self.library.playlists.items()]
+            return 200, self.page(items, query, 20), {}
+        if parts[:2] == ['v1', 'playlists'] and len(parts) >= 3:
+            playlist = self.library.playlists.get(parts[2])
+            if playlist is None:
+                return 404, {'error': {'message': 'not found'}}, {}
+            if len(parts) == 4 and parts[3] == 'tracks':
+                self.count('playlists/tracks')
+                return 200, self.page(self.track_items(playlist), query, 100), {}
+            self.count('playlists')
+            return 200, {'name': playlist['name'], 'snapshot_id': playlist['snapshot_id'],
+                         'tracks': self.page(self.track_items(playlist), {}, 100)}, {}
+        return 404, {'error': {'message': 'unknown path'}}, {}
+
+
+class FakeYouTube(FakeServer):
+    """
+    YouTube search, videos, playlists and playlist items with quota accounting.
+    Search results for a track include a few decoys and the matching video, in a varying order
+    """
+
+    def __init__(self, library, daily_quota=None, **kwargs):
+        super().__init__(**kwargs)
+        self.durations = {t['name']: t['duration_ms'] // 1000 for t in library.tracks}
+        self.daily_quota = daily_quota
+        self.quota_used = 0
+        self.playlists = {}
+        self._ids = 0
+
+    def new_id(self, prefix):
+        with self._lock:
+            self._ids += 1
+            return f'{prefix}{self._ids}'
+
+    def charge(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] += 1
+            cost = QUOTA_COST.get(endpoint, 1)
+            if self.daily_quota is not None and self.quota_used + cost > self.daily_quota:
+                return False
+            self.quota_used += cost
+            return True
+
+    def video(self, video_id):
+        # video ids encode the search they came from and whether they are the real thing
+        query, _, kind = video_id.partition('~')
+        title = f'{query} (Official Audio)' if kind == 'official' else f'{query} ({kind.title()})'
+        match = re.match(r'Song \d+', query)
+        duration = self.durations.get(match and match.group(), 200) if kind == 'official' else 400
+        return {'id': video_id, 'snippet': {'title': title, 'channelTitle': 'Fake - Topic'},
+                'contentDetails': {'duration': f'PT{duration // 60}M{duration % 60}S'}}
+
+    def handle(self, method, path, query, body):
+        resource = path.strip('/').split('/')[-1]
+        endpoint = {'GET': 'list', 'POST': 'insert', 'DELETE': 'delete'}[method]
+        endpoint = f'{resource}.{endpoint}'
+        if not self.charge(endpoint):
+            return 403, {'error': {'errors': [{'reason': 'quotaExceeded'}]}}, {}
+
+        if endpoint == 'search.list':
+            kinds = ['karaoke', 'live cover', 'official', 'remix'][:max(1, int(query.get('maxResults', 5)))]
+            if 'official' not in kinds:
+                kinds[-1] = 'official'
+            kinds.sort(key=lambda kind: _digest(query['q'] + kind))
+            return 200, {'items': [{'id': {'videoId': f"{query['q']}~{kind}"}} for kind in kinds]}, {}
+        if endpoint == 'videos.list':
+            return 200, {'items': [self.video(v) for v in query['id'].split(',')]}, {}
+        if endpoint == 'channels.list':
+            return 200, {'items': [{'id': 'UCfake'}]}, {}
+        if endpoint == 'playlists.insert':
+            playlist_id = self.new_id('PL')
+            with self._lock:
+                self.playlists[playlist_id] = []
+            return 200, {'id': playlist_id}, {}
+        if endpoint == 'playlists.list':
+            ids = sorted(self.playlists)
+            start = int(query.get('pageToken', 0))
+            page = {'items': [{'id': p} for p in ids[start:start + 50]]}
+            if start + 50 < len(ids):
+                page['nextPageToken'] = str(start + 50)
+            return 200, page, {}
+        if endpoint == 'playlists.delete':
+            with self._lock:
+                found = self.playlists.pop(query['id'], None) is not None
+            return (204 if found else 404), None, {}
+        if endpoint == 'playlistItems.insert':
+            snippet = body['snippet']
+            item_id = self.new_id('PLI')
+            with self._lock:
+                items = self.playlists.get(snippet['playlistId'])
+                if items is None:
+                    return 404, {'error': {'errors': [{'reason': 'playlistNotFound'}]}}, {}
+                position = snippet.get('position', len(items))
+                items.insert(position, (item_id, snippet['resourceId']['videoId']))
+            return 200, {'id': item_id}, {}
+        if endpoint == 'playlistItems.delete':
+            with self._lock:
+                for items in self.playlists.values():
+                    for i, (item_id, _) in enumerate(items):
+                        if item_id == query['id']:
+                            del items[i]
+                            return 204, None, {}
+            return 404, None, {}
+        return 404, {'error': {'message': 'unknown path'}}, {}
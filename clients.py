@@ -0,0 +1,137 @@
+"""
+Thin Spotify and YouTube API clients over one pooled, keep-alive requests session.
+"""
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import http_cache
+import metrics
+import tracing
+from rate_limit import backoff_delay
+
+SPOTIFY_API = 'https://api.spotify.com/v1'
+YOUTUBE_API = 'https://www.googleapis.com/youtube/v3'
+
+# fields= projections so spotify only sends what a migration reads,
+# including the artist, duration and ISRC used to match tracks on youtube
+SPOTIFY_TRACK_FIELDS = 'total,items(track(id,name,duration_ms,artists(name),external_ids(isrc)))'
+SPOTIFY_PLAYLIST_FIELDS = f'name,snapshot_id,tracks({SPOTIFY_TRACK_FIELDS})'
+
+# times a spotify call answered with a 429 or a 5xx is retried before its response is handed back
+SPOTIFY_MAX_RETRIES = 5
+
+
+class PageFailedError(Exception):
+    """
+    Raised when a page of a spotify or youtube listing still failed after every retry, the listing would be incomplete
+    """
+
+
+def pooled_session(pool_sizes):
+    """
+    Builds a session keeping up to pool_sizes[base_url] idle connections per host,
+    so threads working against the same API reuse TLS connections instead of opening new ones
+    """
+    session = requests.Session()
+    for base_url, size in pool_sizes.items():
+        session.mount(base_url, HTTPAdapter(pool_connections=1, pool_maxsize=size))
+    return session
+
+
+def throttled(response):
+    """
+    Whether a spotify response asks to try again later
+    """
+    return response.status_code == 429 or response.status_code >= 500
+
+def observe(api, endpoint, method, send, concurrency=None):
+    """
+    Sends one API request with its metrics and, in a traced job, its span.
+    With an adaptive concurrency limiter the request waits for a slot first, which the span includes
+    """
+    call = lambda: metrics.observe_call(api, endpoint, method, send)
+    with tracing.span(f'{api} {endpoint}', 'api', method=method):
+        return call() if concurrency is None else concurrency.call(call, endpoint)
+
+
+class SpotifyClient:
+    """
+    Spotify Web API calls on behalf of one user
+    """
+
+    def __init__(self, access_token, session, base_url=SPOTIFY_API, cache=None, concurrency=None,
+                 max_retries=SPOTIFY_MAX_RETRIES, base_delay=1.0, max_delay=60.0):
+        self.session = session
+        self.base_url = base_url
+        self.cache = cache
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.headers = {'Authorization': f'Bearer {access_token}'}
+
+    def get(self, path, params=None):
+        """
+        GET a path relative to the API root, revalidating a cached copy with its ETag when there is one.
+        429s and 5xx are retried after their Retry-After or a jittered backoff
+        """
+        url = f'{self.base_url}/{path}'
+        headers, entry = self.headers, None
+        if self.cache is not None:
+            # me/ paths are relative to the user, everything else reads the same for everyone allowed to see it
+            scope = http_cache.token_scope(self.headers) if path.split('/')[0] == 'me' else None
+            key = http_cache.cache_key(url, params, scope)
+            headers, entry = self.cache.prepare(key, self.headers)
+        send = lambda: self.session.request('GET', url, headers=headers, params=params)
+        endpoint = metrics.spotify_endpoint(path)
+        for attempt in range(self.max_retries + 1):
+            response = observe('spotify', endpoint, 'GET', send, self.concurrency)
+            if not throttled(response) or attempt == self.max_retries:
+                break
+            delay = backoff_delay(attempt, response, self.base_delay, self.max_delay)
+            metrics.API_RETRIES.inc(api='spotify', endpoint=endpoint, reason=response.status_code)
+            print(f"Spotify answered {response.status_code} on {endpoint}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+        return response if self.cache is None else self.cache.resolve('spotify', key, entry, response)
+
+
+class YouTubeClient:
+    """
+    YouTube Data API calls on behalf of one user, paced by a shared rate limiter
+    """
+
+    def __init__(self, access_token, session, limiter, api_key=None, base_url=YOUTUBE_API, cache=None,
+                 concurrency=None):
+        self.session = session
+        self.limiter = limiter
+        self.api_key = api_key
+        self.base_url = base_url
+        self.cache = cache
+        self.concurrency = concurrency
+        self.headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Accept': 'application/json',
+        }
+
+    def call(self, endpoint, method, path, params=None, json=None):
+        """
+        Sends a request through the rate limiter.
+        endpoint names the API method (e.g. 'search.list') for quota accounting.
+        GETs revalidate a cached copy with its ETag when there is one
+        """
+        params = dict(params or {})
+        if self.api_key:
+            params['key'] = self.api_key
+        url = f'{self.base_url}/{path}'
+        headers, entry = self.headers, None
+        cached = self.cache is not None and method == 'GET'
+        if cached:
+            # mine=true lists are relative to the user, other reads look the same for everyone
+            scope = http_cache.token_scope(self.headers) if params.get('mine') else None
+            key = http_cache.cache_key(url, params, scope)
+            headers, entry = self.cache.prepare(key, self.headers)
+        send = lambda: self.session.request(method, url, headers=headers, params=params, json=json)
+        response = self.limiter.call(endpoint, lambda: observe('youtube', endpoint, method, send, self.concurrency))
+        return self.cache.resolve('youtube', key, entry, response) if cached else response
@@ -0,0 +1,151 @@
+"""
+Adaptive limits on outbound API calls in flight, one per API (additive increase, multiplicative decrease).
+The limit grows by one for every limit's worth of healthy responses and is cut by backoff on a 429,
+a rate limit 403, a 5xx, a failed connection or a response much slower than the API's usual latency.
+A Retry-After also holds every new call to that API back for as long as it asks.
+Usual latency is tracked per endpoint, a slow search is not a congested video lookup.
+"""
+import asyncio
+import threading
+import time
+
+import metrics
+from rate_limit import RATE_LIMIT_REASONS, error_reason, retry_after
+
+
+def congested(response):
+    """
+    Whether a response (None when no response came back) says the API wants fewer calls
+    """
+    if response is None:
+        return True
+    return response.status_code == 429 or response.status_code >= 500 or error_reason(response) in RATE_LIMIT_REASONS
+
+
+class AdaptiveLimiter:
+    """
+    Limit on the calls in flight to one API, shared by threads and asyncio tasks.
+    latency_tolerance is how many times slower than its endpoint's typical latency a response may be
+    before it counts as congestion, though responses within slow_after seconds never do;
+    smoothing is how quickly that typical latency follows slower responses
+    """
+
+    def __init__(self, api, initial, minimum=1, maximum=None, backoff=0.5, latency_tolerance=3.0, slow_after=0.25,
+                 smoothing=0.05):
+        self.api = api
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.slow_after = slow_after
+        self.smoothing = smoothing
+        self.in_flight = 0
+        # typical latency of each endpoint
+        self.baselines = {}
+        self._limit = float(max(minimum, min(initial, self.maximum)))
+        self._last_cut = 0.0
+        self._paused_until = 0.0
+        self._changed = threading.Condition()
+        # (loop, future) of asyncio tasks waiting for a slot
+        self._waiters = []
+        metrics.API_CONCURRENCY_LIMIT.set(self.limit, api=api)
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def _wait_time(self):
+        """
+        0 if a call may start now, None to wait for a call to finish, otherwise seconds to wait
+        """
+        paused = self._paused_until - time.monotonic()
+        if paused > 0:
+            return paused
+        return 0 if self.in_flight < self.limit else None
+
+    def acquire(self):
+        """
+        Blocks until a call may start, returns its start time
+        """
+        with self._changed:
+            wait = self._wait_time()
+            while wait != 0:
+                self._changed.wait(wait)
+                wait = self._wait_time()
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def acquire_async(self):
+        """
+        Same as acquire without blocking the event loop
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._changed:
+                wait = self._wait_time()
+                if wait == 0:
+                    self.in_flight += 1
+                    return time.monotonic()
+                if wait is None:
+                    slot = loop.create_future()
+                    self._waiters.append((loop, slot))
+            if wait is None:
+                await slot
+            else:
+                await asyncio.sleep(wait)
+
+    def release(self, started, response, endpoint=None):
+        """
+        Ends a call to endpoint that started at started, adjusting the limit to how it went
+        """
+        now = time.monotonic()
+        latency = now - started
+        with self._changed:
+            self.in_flight -= 1
+            baseline = self.baselines.get(endpoint)
+            slow = baseline is not None and latency > max(self.slow_after, baseline * self.latency_tolerance)
+            if response is not None and response.status_code < 400:
+                if baseline is None or latency < baseline:
+                    self.baselines[endpoint] = latency
+                else:
+                    self.baselines[endpoint] = baseline + (latency - baseline) * self.smoothing
+            if congested(response) or slow:
+                # calls already in flight when the limit was cut saw the old limit, only cut once for them
+                if started >= self._last_cut:
+                    self._limit = max(self.minimum, self._limit * self.backoff)
+                    self._last_cut = now
+            else:
+                self._limit = min(self.maximum, self._limit + 1 / self._limit)
+            delay = retry_after(response) if response is not None else None
+            if delay:
+                self._paused_until = max(self._paused_until, now + delay)
+            self._changed.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for loop, slot in waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(lambda slot=slot: slot.done() or slot.set_result(None))
+        metrics.API_CONCURRENCY_LIMIT.set(self.limit, api=self.api)
+
+    def call(self, send, endpoint=None):
+        """
+        Sends a request to endpoint within the limit, send is a zero argument callable returning the response
+        """
+        started = self.acquire()
+        response = None
+        try:
+            response = send()
+            return response
+        finally:
+            self.release(started, response, endpoint)
+
+    async def call_async(self, send, endpoint=None):
+        """
+        Same as call for the asyncio engine, send is a zero argument coroutine function
+        """
+        started = await self.acquire_async()
+        response = None
+        try:
+            response = await send()
+            return response
+        finally:
+            self.release(started, response, endpoint)
@@ -0,0 +1,53 @@
+import app
+import pytest
+from http_cache import ResponseCache
+from quota import QuotaBudget
+from session_store import SqliteSessionInterface
+from song_cache import SongCache
+from sync_state import SyncStore
+from work_queue import WorkQueue
+
+
+@pytest.fixture(autouse=True)
+def song_cache(tmp_path, monkeypatch):
+    # keep tests from reading or writing the real resolution cache
+    cache = SongCache(str(tmp_path / 'song_cache.db'))
+    monkeypatch.setattr(app, 'song_cache', cache)
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def session_store(tmp_path, monkeypatch):
+    interface = SqliteSessionInterface(str(tmp_path / 'sessions.db'))
+    monkeypatch.setattr(app.app, 'session_interface', interface)
+    return interface.store
+
+
+@pytest.fixture(autouse=True)
+def sync_store(tmp_path, monkeypatch):
+    store = SyncStore(str(tmp_path / 'sync_state.db'))
+    monkeypatch.setattr(app, 'sync_store', store)
+    return store
+
+
+@pytest.fixture(autouse=True)
+def response_cache(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / 'response_cache.db'))
+    monkeypatch.setattr(app, 'response_cache', cache)
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def work_queue(tmp_path, monkeypatch):
+    queue = WorkQueue(str(tmp_path / 'work_queue.db'))
+    monkeypatch.setattr(app, 'work_queue', queue)
+    return queue
+
+
+@pytest.fixture(autouse=True)
+def quota_budget(monkeypatch):
+    # youtube calls of earlier tests must not use up the quota of later ones
+    budget = QuotaBudget(app.youtube_daily_quota)
+    monkeypatch.setattr(app, 'quota_budget', budget)
+    monkeypatch.setattr(app.youtube_limiter, 'budget', budget)
+    return budget
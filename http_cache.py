@@ -0,0 +1,150 @@
+"""
+Conditional GET cache for Spotify and YouTube reads.
+Responses that carry an ETag are kept, the next identical request sends If-None-Match,
+and a 304 is answered with the stored body instead of downloading it again.
+A byte-bounded in-process LRU sits in front of a SQLite store of compressed bodies.
+"""
+import collections
+import hashlib
+import json
+import threading
+import time
+import urllib.parse
+import zlib
+
+import metrics
+from storage import SqliteStore
+
+# counting rows is a table scan, so the size bound is only enforced every this many writes
+TRIM_EVERY = 64
+
+
+def cache_key(url, params=None, scope=None):
+    """
+    Cache key of a GET request. scope separates users for resources that are relative to the caller,
+    such as spotify's me/ endpoints, and is None for resources that look the same to everyone
+    """
+    query = urllib.parse.urlencode(sorted((params or {}).items()))
+    return hashlib.sha256(f'{scope}\n{url}?{query}'.encode()).hexdigest()
+
+def token_scope(headers):
+    """
+    Scope of a user-relative request, derived from its bearer token without storing it
+    """
+    return hashlib.sha256(headers.get('Authorization', '').encode()).hexdigest()[:32]
+
+
+class CachedResponse:
+    """
+    A stored body served in place of a 304, with the parts of the requests.Response interface the app uses
+    """
+    status_code = 200
+
+    def __init__(self, body, etag):
+        self.content = body
+        self.headers = {'ETag': etag}
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ResponseCache(SqliteStore):
+    """
+    Two tier store of ETags and response bodies.
+    The memory tier holds up to memory_bytes of bodies, the SQLite tier is trimmed to max_entries
+    least recently used keys, checked every TRIM_EVERY writes
+    """
+    schema = '''
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            etag TEXT NOT NULL,
+            body BLOB NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+    '''
+
+    def __init__(self, path, max_entries=20000, memory_bytes=32 * 1024 * 1024):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.memory_bytes = memory_bytes
+        self._memory = collections.OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _remember(self, key, etag, body):
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_used -= len(old[1])
+            if len(body) > self.memory_bytes:
+                return
+            self._memory[key] = (etag, body)
+            self._memory_used += len(body)
+            while self._memory_used > self.memory_bytes:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_used -= len(evicted)
+
+    def get(self, key):
+        """
+        (etag, body) stored for a request, or None
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+        conn = self.connect()
+        row = conn.execute('SELECT etag, body FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        etag, body = row[0], zlib.decompress(row[1])
+        conn.execute('UPDATE responses SET last_used = ? WHERE key = ?', (time.time(), key))
+        self._remember(key, etag, body)
+        return etag, body
+
+    def set(self, key, etag, body):
+        """
+        Stores a response body under its ETag, evicting the least recently used keys past max_entries
+        """
+        self._remember(key, etag, body)
+        conn = self.connect()
+        conn.execute('INSERT OR REPLACE INTO responses (key, etag, body, last_used) VALUES (?, ?, ?, ?)',
+                     (key, etag, zlib.compress(body), time.time()))
+        with self._lock:
+            self._writes += 1
+            if self._writes % TRIM_EVERY:
+                return
+        excess = conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute('DELETE FROM responses WHERE key IN '
+                         '(SELECT key FROM responses ORDER BY last_used LIMIT ?)', (excess,))
+
+    def prepare(self, key, headers):
+        """
+        Headers for a GET, with If-None-Match when a copy is stored, and the stored (etag, body) or None
+        """
+        entry = self.get(key)
+        if entry is None:
+            return headers, None
+        return dict(headers, **{'If-None-Match': entry[0]}), entry
+
+    def resolve(self, api, key, entry, response):
+        """
+        The response to hand back for a conditional GET: the stored copy on a 304,
+        otherwise the response itself, stored when it carries an ETag
+        """
+        if response.status_code == 304 and entry is not None:
+            metrics.API_CACHE.inc(api=api, result='revalidated')
+            return CachedResponse(entry[1], entry[0])
+        if response.status_code == 200:
+            etag = response.headers.get('ETag')
+            if isinstance(etag, str) and isinstance(response.content, bytes):
+                self.set(key, etag, response.content)
+            metrics.API_CACHE.inc(api=api, result='downloaded')
+        return response
@@ -0,0 +1,235 @@
+"""
+Background jobs for long running work such as playlist migrations.
+Jobs run on a shared worker pool so the web workers stay free to serve requests.
+Jobs are only known to the process that started them, so the web server runs a single worker process.
+"""
+import collections
+import concurrent.futures
+import os
+import threading
+import time
+import uuid
+
+import tracing
+
+migration_workers = int(os.environ.get("migration_workers", 4))
+# finished jobs are forgotten after this many seconds
+job_ttl = int(os.environ.get("job_ttl", 3600))
+# share of jobs traced span by span, between 0 (none) and 1 (all)
+trace_sample_rate = float(os.environ.get("trace_sample_rate", 0))
+# progress events kept per job for streams that reconnect, older ones are summed up in the job's state
+event_buffer = int(os.environ.get("event_buffer", 2048))
+
+_executor = None
+_executor_lock = threading.Lock()
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class Postponed(Exception):
+    """
+    Raised by a job's target to hand its worker thread back and run again with args at resume_at
+    """
+
+    def __init__(self, resume_at, reason, args):
+        super().__init__(f'postponed until {resume_at} for {reason}')
+        self.resume_at = resume_at
+        self.reason = reason
+        self.target_args = args
+
+
+class Job:
+    """
+    State and per-playlist progress of a background job.
+    Every change is also published as a numbered progress event for live streams
+    """
+
+    def __init__(self, kind, key=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.status = 'queued'
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # epoch seconds a waiting job expects to carry on at
+        self.resume_at = None
+        self.playlists = {}
+        # tracing.Tracer of the job's spans when it was sampled for tracing
+        self.trace = None
+        self.events = collections.deque(maxlen=event_buffer)
+        self.last_event_id = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def _publish(self, event, **data):
+        # callers hold self._lock
+        self.last_event_id += 1
+        self.events.append((self.last_event_id, event, data))
+        self._changed.notify_all()
+
+    def publish(self, event, **data):
+        """
+        Adds a progress event, waking every stream waiting on this job
+        """
+        with self._lock:
+            self._publish(event, **data)
+
+    def start_playlist(self, name, done=0, total=None):
+        """
+        Marks a playlist as in progress, done counts tracks an earlier run already migrated
+        and total is the number of tracks when it is known up front
+        """
+        with self._lock:
+            self.playlists[name] = {'status': 'running', 'done': done, 'failed': 0, 'total': total,
+                                    'youtube_playlist_id': None}
+            self._publish('playlist', playlist=name, **self.playlists[name])
+
+    def track_resolved(self, name, index, video_id):
+        """
+        Reports the video found for a playlist's track, None if nothing matched
+        """
+        self.publish('resolved', playlist=name, index=index, video_id=video_id)
+
+    def track_done(self, name, ok=True, index=None):
+        """
+        Counts a finished track for a playlist
+        """
+        with self._lock:
+            progress = self.playlists[name]
+            progress['done' if ok else 'failed'] += 1
+            self._publish('inserted' if ok else 'failed', playlist=name, index=index,
+                          done=progress['done'], failed=progress['failed'], total=progress['total'])
+
+    def finish_playlist(self, name, youtube_playlist_id=None, status='finished'):
+        """
+        Marks a playlist as finished (or failed), recording the youtube playlist it was migrated to.
+        A playlist that never started, e.g. one spotify could not read, is added as it is
+        """
+        with self._lock:
+            self.playlists.setdefault(name, {'done': 0, 'failed': 0, 'total': None})
+            self.playlists[name]['status'] = status
+            self.playlists[name]['youtube_playlist_id'] = youtube_playlist_id
+            self._publish('playlist', playlist=name, **self.playlists[name])
+
+    def update_playlist(self, name, progress):
+        """
+        Replaces a playlist's progress with a copy reported by another process
+        """
+        with self._lock:
+            if self.playlists.get(name) != progress:
+                self.playlists[name] = dict(progress)
+                self._publish('playlist', playlist=name, **progress)
+
+    def wait_until(self, resume_at, reason):
+        """
+        Moves the job to waiting until resume_at (epoch seconds), e.g. for the youtube quota to reset
+        """
+        with self._lock:
+            self.status = 'waiting'
+            self.resume_at = resume_at
+            self._publish('status', status='waiting', error=None, reason=reason, resume_at=resume_at)
+
+    def set_status(self, status, error=None):
+        """
+        Moves the job to running, finished or failed
+        """
+        with self._lock:
+            self.status = status
+            self.error = error
+            self.resume_at = None
+            if status in ('finished', 'failed'):
+                self.finished_at = time.time()
+            self._publish('status', status=status, error=error)
+
+    def events_after(self, event_id, timeout=None):
+        """
+        Progress events numbered after event_id, waiting up to timeout seconds for one if there are none yet.
+        Returns None instead when events after event_id have already dropped out of the buffer
+        """
+        with self._lock:
+            if event_id >= self.last_event_id and self.finished_at is None:
+                self._changed.wait(timeout)
+            if self.events and self.events[0][0] > event_id + 1:
+                return None
+            return [e for e in self.events if e[0] > event_id]
+
+    def to_dict(self):
+        """
+        JSON friendly snapshot of the job
+        """
+        with self._lock:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'resume_at': self.resume_at,
+                'playlists': {name: dict(progress) for name, progress in self.playlists.items()},
+                'traced': self.trace is not None,
+                'last_event_id': self.last_event_id,
+            }
+
+
+def _get_executor():
+    # created on first use so no threads exist before gunicorn forks its workers
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=migration_workers,
+                                                              thread_name_prefix='job')
+        return _executor
+
+def _run(job, target, args):
+    if job.started_at is None:
+        job.started_at = time.time()
+        if tracing.sampled(trace_sample_rate):
+            job.trace = tracing.Tracer()
+    job.set_status('running')
+    try:
+        with tracing.trace(job.trace), tracing.span(job.kind, 'job'):
+            target(job, *args)
+        job.set_status('finished')
+    except Postponed as e:
+        # waiting must not hold one of the few pool threads, a timer queues the job again when it is due
+        job.wait_until(e.resume_at, e.reason)
+        timer = threading.Timer(max(0, e.resume_at - time.time()), _get_executor().submit,
+                                (_run, job, target, e.target_args))
+        timer.daemon = True
+        timer.start()
+    except Exception as e:
+        print(f"Error occurred in job {job.id}: {e}")
+        job.set_status('failed', str(e))
+
+def _prune():
+    cutoff = time.time() - job_ttl
+    for job_id, job in list(_jobs.items()):
+        if job.finished_at is not None and job.finished_at < cutoff:
+            del _jobs[job_id]
+
+def submit(kind, target, *args, key=None):
+    """
+    Queues target(job, *args) on the worker pool and returns the job right away.
+    While a job with the same key is queued or running it is returned instead of starting a duplicate
+    """
+    with _jobs_lock:
+        _prune()
+        if key is not None:
+            for job in _jobs.values():
+                if job.key == key and job.finished_at is None:
+                    return job
+        job = Job(kind, key)
+        _jobs[job.id] = job
+    _get_executor().submit(_run, job, target, args)
+    return job
+
+def get_job(job_id):
+    """
+    Looks up a job by id, returns None if it is unknown or expired
+    """
+    with _jobs_lock:
+        return _jobs.get(job_id)
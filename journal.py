@@ -0,0 +1,101 @@
+"""
+Append-only checkpoint journal of a migration, so a retried migration resumes where the last one stopped
+instead of re-searching every song and creating duplicate youtube playlists.
+"""
+import hashlib
+import json
+import os
+import threading
+
+
+def migration_key(youtube_channel_id, playlist_ids):
+    """
+    Identifies a migration by its destination account and its source playlists
+    """
+    source = '\n'.join([str(youtube_channel_id)] + sorted(playlist_ids))
+    return hashlib.sha256(source.encode()).hexdigest()[:32]
+
+
+class Journal:
+    """
+    JSON lines journal of created playlists, resolved songs and finished tracks.
+    Every record is flushed as it is written; existing records are replayed when the journal is opened.
+    A journal without a path only keeps state in memory
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.playlists = {}
+        self.resolved = {}
+        # per playlist: index of the next track to migrate and the next insert position
+        self.progress = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if path is not None:
+            self._replay()
+            self._file = open(path, 'a', encoding='utf-8')
+
+    @classmethod
+    def open(cls, directory, key):
+        """
+        Opens (or starts) the journal of a migration
+        """
+        os.makedirs(directory, exist_ok=True)
+        return cls(os.path.join(directory, f'{key}.jsonl'))
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    self._apply(json.loads(line))
+                except ValueError:
+                    # a torn last line from a crash mid-write, everything before it is committed
+                    break
+
+    def _apply(self, record):
+        kind = record['type']
+        if kind == 'playlist':
+            self.playlists[record['playlist']] = record['youtube_playlist_id']
+        elif kind == 'resolved':
+            self.resolved[record['song']] = record['video_id']
+        elif kind == 'track':
+            index, position = self.progress.get(record['playlist'], (0, 0))
+            self.progress[record['playlist']] = (record['index'] + 1, position + record['inserted'])
+
+    def _append(self, record):
+        with self._lock:
+            self._apply(record)
+            if self._file is not None:
+                self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+                self._file.flush()
+
+    def record_playlist(self, playlist, youtube_playlist_id):
+        self._append({'type': 'playlist', 'playlist': playlist, 'youtube_playlist_id': youtube_playlist_id})
+
+    def record_resolved(self, song, video_id):
+        self._append({'type': 'resolved', 'song': song, 'video_id': video_id})
+
+    def record_track(self, playlist, index, inserted):
+        self._append({'type': 'track', 'playlist': playlist, 'index': index, 'inserted': int(inserted)})
+
+    def resume_point(self, playlist):
+        """
+        (index of the next track to migrate, next insert position) for a playlist
+        """
+        with self._lock:
+            return self.progress.get(playlist, (0, 0))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def complete(self):
+        """
+        Removes the journal of a finished migration, a later run of the same selection starts fresh
+        """
+        self.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
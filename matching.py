@@ -0,0 +1,120 @@
+"""
+Matching spotify tracks to youtube videos.
+A search returns a few candidates, one batched videos.list call fetches their titles, channels and
+durations, and each candidate is scored against the track's name, artists and duration.
+"""
+import re
+
+from song_cache import normalize
+
+# versions of a song that are rarely what the user had in their spotify playlist
+UNWANTED_VERSIONS = {'live', 'cover', 'karaoke', 'remix', 'instrumental', 'reaction', 'acoustic',
+                     'slowed', 'sped', 'nightcore', '8d', 'lyrics'}
+
+# videos.list takes at most 50 ids per call
+MAX_CANDIDATES = 50
+
+_DURATION = re.compile(r'P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?')
+_WORD = re.compile(r'\w+')
+
+
+def from_spotify(track):
+    """
+    Compact track record from a spotify track object
+    """
+    return {
+        'id': track.get('id'),
+        'name': track['name'],
+        'artists': [a['name'] for a in track.get('artists') or []],
+        'duration_ms': track.get('duration_ms'),
+        'isrc': (track.get('external_ids') or {}).get('isrc'),
+    }
+
+def as_track(song):
+    """
+    Accepts a bare song name wherever a track record is expected
+    """
+    return {'name': song} if isinstance(song, str) else song
+
+def track_key(song):
+    """
+    Resolution cache key of a track: its ISRC when spotify knows it, otherwise its name and main artist
+    """
+    track = as_track(song)
+    if track.get('isrc'):
+        return f"isrc:{track['isrc'].upper()}"
+    return normalize(search_query(track))
+
+def search_query(track):
+    """
+    Youtube search terms for a track
+    """
+    return ' '.join([track['name'], *track.get('artists', [])[:1]])
+
+def search_params(track, candidates):
+    """
+    search.list parameters fetching the ids of up to candidates videos for a track
+    """
+    return {
+        'part': 'id',
+        'q': search_query(track),
+        'type': 'video',
+        'maxResults': min(candidates, MAX_CANDIDATES),
+        'fields': 'items(id(videoId))'
+    }
+
+def videos_params(video_ids):
+    """
+    videos.list parameters fetching what scoring needs for up to 50 videos in one call
+    """
+    return {
+        'part': 'snippet,contentDetails',
+        'id': ','.join(video_ids[:MAX_CANDIDATES]),
+        'fields': 'items(id,snippet(title,channelTitle),contentDetails(duration))'
+    }
+
+def parse_duration(duration):
+    """
+    Seconds in an ISO 8601 duration such as PT3M21S, None if it cannot be parsed
+    """
+    match = _DURATION.fullmatch(duration or '')
+    if not match or not any(match.groups()):
+        return None
+    days, hours, minutes, seconds = (int(g or 0) for g in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+def _words(text):
+    return set(_WORD.findall(text.lower()))
+
+def score(track, video):
+    """
+    How well a videos.list item matches a track, higher is better
+    """
+    snippet = video.get('snippet', {})
+    title = _words(snippet.get('title', ''))
+    channel = snippet.get('channelTitle', '')
+    name = _words(track['name'])
+
+    points = 3 * len(name & title) / max(len(name), 1)
+    for artist in track.get('artists', [])[:1]:
+        artist_words = _words(artist)
+        if artist_words and (artist_words <= title or artist_words <= _words(channel)):
+            points += 2
+        # "Artist - Topic" channels carry the official audio
+        if channel.lower() == f'{artist.lower()} - topic':
+            points += 1
+    points -= 2 * len((title - name) & UNWANTED_VERSIONS)
+
+    seconds = parse_duration(video.get('contentDetails', {}).get('duration'))
+    if seconds is not None and track.get('duration_ms'):
+        difference = abs(seconds - track['duration_ms'] / 1000)
+        points += 3 * max(0.0, 1 - difference / 30)
+    return points
+
+def best_match(track, videos):
+    """
+    Id of the best scoring video, or None if there are no candidates
+    """
+    if not videos:
+        return None
+    return max(videos, key=lambda video: score(track, video))['id']
@@ -0,0 +1,231 @@
+"""
+In-process metrics in the Prometheus text format, served on /metrics.
+Every outbound spotify/youtube call and every Flask request is timed and counted here.
+Each gunicorn worker keeps its own numbers, so scrape the workers individually.
+"""
+import bisect
+import re
+import threading
+import time
+
+from flask import g, request
+
+# seconds, the same defaults as the official prometheus client
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# spotify ids in request paths, replaced so every playlist shares one endpoint label
+_SPOTIFY_ID = re.compile(r'(?<=playlists/)[^/]+')
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    A named family of values, one per combination of label values
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name} takes labels {self.labels}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def samples(self):
+        """
+        (name suffix, label string, value) of every sample, in label order
+        """
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield '', self._labels(key), value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{self.name}{suffix}{labels} {_format(value)}' for suffix, labels, value in self.samples()]
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """
+    Counts of observations per upper bound, with their sum and count
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def value(self, **labels):
+        """
+        Number of observations with these labels
+        """
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[2] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '_bucket', self._labels(key, [('le', _format(bound))]), cumulative
+            yield '_sum', self._labels(key), total
+            yield '_count', self._labels(key), count
+
+
+def render():
+    """
+    Every metric in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+API_SECONDS = Histogram('api_request_duration_seconds', 'Latency of outbound API calls, per attempt',
+                        ('api', 'endpoint', 'method'))
+API_RESPONSES = Counter('api_responses_total', 'Outbound API responses by status code, "error" when none came back',
+                        ('api', 'endpoint', 'status'))
+API_RETRIES = Counter('api_retries_total', 'Outbound API calls retried after a rate limit response',
+                      ('api', 'endpoint', 'reason'))
+API_IN_FLIGHT = Gauge('api_in_flight_requests', 'Outbound API calls waiting on a response', ('api',))
+API_CONCURRENCY_LIMIT = Gauge('api_concurrency_limit', 'Current adaptive limit on outbound API calls in flight',
+                              ('api',))
+API_CACHE = Counter('api_cache_responses_total',
+                    'Cacheable GETs by whether the body was downloaded or revalidated from the local copy',
+                    ('api', 'result'))
+YOUTUBE_QUOTA = Counter('youtube_quota_units_total', 'YouTube Data API quota units spent', ('endpoint',))
+HTTP_SECONDS = Histogram('http_request_duration_seconds', 'Latency of requests to the app', ('route', 'method'))
+HTTP_RESPONSES = Counter('http_responses_total', 'Responses of the app by status code', ('route', 'method', 'status'))
+HTTP_IN_FLIGHT = Gauge('http_in_flight_requests', 'Requests to the app being handled')
+
+
+def spotify_endpoint(path):
+    """
+    Endpoint label of a spotify API path, e.g. playlists/{id}/tracks
+    """
+    return _SPOTIFY_ID.sub('{id}', path.split('?', 1)[0])
+
+def _finish_call(api, endpoint, method, started, response):
+    API_IN_FLIGHT.dec(api=api)
+    API_SECONDS.observe(time.perf_counter() - started, api=api, endpoint=endpoint, method=method)
+    status = response.status_code if response is not None else 'error'
+    API_RESPONSES.inc(api=api, endpoint=endpoint, status=status)
+
+def observe_call(api, endpoint, method, send):
+    """
+    Times and counts one outbound call, send is a zero argument callable returning the response
+    """
+    API_IN_FLIGHT.inc(api=api)
+    started = time.perf_counter()
+    response = None
+    try:
+        response = send()
+        return response
+    finally:
+        _finish_call(api, endpoint, method, started, response)
+
+async def observe_call_async(api, endpoint, method, send):
+    """
+    Same as observe_call for the asyncio engine, send is a zero argument coroutine function
+    """
+    API_IN_FLIGHT.inc(api=api)
+    started = time.perf_counter()
+    response = None
+    try:
+        response = await send()
+        return response
+    finally:
+        _finish_call(api, endpoint, method, started, response)
+
+def instrument(app):
+    """
+    Times and counts every request to a Flask app, labelled by its route rule
+    """
+    @app.before_request
+    def start_timer():
+        HTTP_IN_FLIGHT.inc()
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        HTTP_IN_FLIGHT.dec()
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method)
+        HTTP_RESPONSES.inc(route=route, method=request.method, status=g.pop('metrics_status', 500))
@@ -0,0 +1,193 @@
+"""
+Migration plan: the selected spotify playlists and their tracks, with each track's resolution state.
+Records use __slots__ so a plan of tens of thousands of tracks stays small, tracks stream in from
+spotify as the plan is consumed, and a plan round-trips through JSON lines for storage or hand-off.
+"""
+import json
+
+# resolution states of a planned track
+PENDING = 'pending'
+RESOLVED = 'resolved'
+UNMATCHED = 'unmatched'
+INSERTED = 'inserted'
+FAILED = 'failed'
+
+
+class PlannedTrack:
+    """
+    One track of a playlist. Reads like a matching track record (track['name'], track.get('isrc'))
+    so it can go straight to the matching and cache functions
+    """
+    __slots__ = ('id', 'name', 'artists', 'duration_ms', 'isrc', 'video_id', 'state')
+
+    def __init__(self, name, id=None, artists=(), duration_ms=None, isrc=None, video_id=None, state=PENDING):
+        self.id = id
+        self.name = name
+        self.artists = tuple(artists)
+        self.duration_ms = duration_ms
+        self.isrc = isrc
+        self.video_id = video_id
+        self.state = state
+
+    @classmethod
+    def from_song(cls, song):
+        """
+        Track from a matching track record, or a bare song name
+        """
+        if isinstance(song, cls):
+            return song
+        if isinstance(song, str):
+            return cls(song)
+        return cls(song['name'], song.get('id'), song.get('artists') or (), song.get('duration_ms'),
+                   song.get('isrc'))
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except (AttributeError, TypeError):
+            raise KeyError(field) from None
+
+    def get(self, field, default=None):
+        value = getattr(self, field, None) if isinstance(field, str) else None
+        return default if value is None else value
+
+    def resolve(self, video_id):
+        self.video_id = video_id
+        self.state = RESOLVED if video_id is not None else UNMATCHED
+
+    def to_row(self):
+        return [self.id, self.name, list(self.artists), self.duration_ms, self.isrc, self.video_id, self.state]
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row[1], row[0], *row[2:])
+
+
+def unique_title(name, taken):
+    """
+    name, or "name (2)", "name (3)", ... when taken already has it. The title is added to taken
+    """
+    title, copy = name, 1
+    while title in taken:
+        copy += 1
+        title = f'{name} ({copy})'
+    taken.add(title)
+    return title
+
+
+class PlannedPlaylist:
+    """
+    One spotify playlist of the plan. title is its name made unique within the plan, the key its
+    progress and result go under; name is what the youtube playlist is called.
+    Journal records go under its spotify id, which unlike the title does not depend on selection order.
+    Iterating yields the tracks read so far, then keeps pulling the rest from spotify
+    """
+    __slots__ = ('spotify_id', 'name', 'title', 'snapshot_id', 'total', 'tracks', '_source')
+
+    def __init__(self, spotify_id, name, title=None, snapshot_id=None, total=None, songs=()):
+        self.spotify_id = spotify_id
+        self.name = name
+        self.title = title or name
+        self.snapshot_id = snapshot_id
+        self.total = total
+        self.tracks = []
+        self._source = iter(songs)
+
+    @property
+    def key(self):
+        """
+        What the journal records of the playlist go under: its spotify id, or its title for plans built without ids
+        """
+        return self.spotify_id or self.title
+
+    def __iter__(self):
+        index = 0
+        while True:
+            if index == len(self.tracks):
+                song = next(self._source, None)
+                if song is None:
+                    return
+                self.tracks.append(PlannedTrack.from_song(song))
+            yield self.tracks[index]
+            index += 1
+
+    def load(self):
+        """
+        Reads every remaining track from spotify, returns the playlist
+        """
+        for _ in self:
+            pass
+        return self
+
+
+class Plan:
+    """
+    Playlists in selection order
+    """
+
+    def __init__(self):
+        self.playlists = []
+        self._titles = set()
+
+    def add(self, spotify_id, name, snapshot_id=None, total=None, songs=()):
+        """
+        Adds a playlist, titled "name (2)", "name (3)", ... when the plan already has one called name
+        """
+        title = unique_title(name, self._titles)
+        playlist = PlannedPlaylist(spotify_id, name, title, snapshot_id, total, songs)
+        self.playlists.append(playlist)
+        return playlist
+
+    def remove(self, playlist):
+        """
+        Drops a playlist, its title stays taken so the other playlists keep theirs
+        """
+        self.playlists.remove(playlist)
+
+    def __iter__(self):
+        return iter(self.playlists)
+
+    def __len__(self):
+        return len(self.playlists)
+
+    def titles(self):
+        return [p.title for p in self.playlists]
+
+    def dump(self, f):
+        """
+        Writes the plan as JSON lines: a header line per playlist followed by one compact row per track
+        """
+        for playlist in self.playlists:
+            header = {'spotify_id': playlist.spotify_id, 'name': playlist.name, 'title': playlist.title,
+                      'snapshot_id': playlist.snapshot_id, 'total': playlist.total}
+            f.write(json.dumps(header, separators=(',', ':')) + '\n')
+            for track in playlist:
+                f.write(json.dumps(track.to_row(), separators=(',', ':')) + '\n')
+
+    @classmethod
+    def load(cls, f):
+        """
+        Reads a plan written by dump, one line at a time
+        """
+        plan = cls()
+        playlist = None
+        for line in f:
+            record = json.loads(line)
+            if isinstance(record, dict):
+                playlist = plan.add(record['spotify_id'], record['name'], record['snapshot_id'], record['total'])
+                playlist.title = record['title']
+            else:
+                playlist.tracks.append(PlannedTrack.from_row(record))
+        return plan
+
+
+def as_plan(playlists):
+    """
+    Accepts a dictionary of playlist titles to songs wherever a plan is expected
+    """
+    if isinstance(playlists, Plan):
+        return playlists
+    plan = Plan()
+    for title, songs in playlists.items():
+        plan.add(None, title, songs=songs)
+    return plan
@@ -0,0 +1,182 @@
+"""
+Youtube quota planning: what a migration will cost before it runs, and a daily budget that holds
+migrations back until the quota resets instead of letting them run out part way.
+Youtube resets every project's quota at midnight Pacific time.
+"""
+import collections
+import contextlib
+import contextvars
+import datetime
+import math
+import threading
+import time
+import zoneinfo
+
+import matching
+from rate_limit import QUOTA_COST
+
+RESET_TIMEZONE = zoneinfo.ZoneInfo('America/Los_Angeles')
+
+# budget job the youtube calls of the running code are charged to
+_charged_job = contextvars.ContextVar('quota_job', default=None)
+
+
+def next_reset(now=None):
+    """
+    Epoch seconds of the next youtube quota reset after now
+    """
+    today = datetime.datetime.fromtimestamp(time.time() if now is None else now, RESET_TIMEZONE)
+    midnight = datetime.datetime.combine(today.date() + datetime.timedelta(days=1), datetime.time(),
+                                         tzinfo=RESET_TIMEZONE)
+    return midnight.timestamp()
+
+def estimate(migration_plan, song_cache, journal=None, match_candidates=5, daily_quota=None):
+    """
+    Youtube quota a migration would spend, worked out from its plan without calling youtube.
+    Tracks and playlists its journal already finished, songs the journal or the song cache already resolved
+    and repeats of a song across the selection cost nothing, the same as in a real run.
+    Every remaining track is counted as inserted, so songs youtube has no match for make the real cost lower
+    """
+    calls = collections.Counter()
+    counts = collections.Counter()
+    seen = set()
+    for playlist in migration_plan:
+        counts['playlists'] += 1
+        start = 0
+        if journal is not None:
+            start, _ = journal.resume_point(playlist.key)
+        if journal is None or playlist.key not in journal.playlists:
+            calls['playlists.insert'] += 1
+        for index, track in enumerate(playlist):
+            counts['tracks'] += 1
+            if index < start:
+                counts['already_migrated'] += 1
+                continue
+            calls['playlistItems.insert'] += 1
+            key = matching.track_key(track)
+            if key in seen:
+                counts['duplicates'] += 1
+            elif (journal is not None and key in journal.resolved) or song_cache.get(key) is not None:
+                counts['cache_hits'] += 1
+            else:
+                calls['search.list'] += 1
+                # a single candidate skips the scoring call, so this is an upper bound too
+                if match_candidates > 1:
+                    calls['videos.list'] += 1
+            seen.add(key)
+    units = {endpoint: count * QUOTA_COST[endpoint] for endpoint, count in calls.items()}
+    total = sum(units.values())
+    result = {
+        'units': total,
+        'units_by_endpoint': units,
+        'calls': dict(calls),
+        'playlists': counts['playlists'],
+        'tracks': counts['tracks'],
+        'already_migrated': counts['already_migrated'],
+        'cache_hits': counts['cache_hits'],
+        'duplicates': counts['duplicates'],
+    }
+    if daily_quota:
+        result['daily_quota'] = daily_quota
+        result['days'] = math.ceil(total / daily_quota)
+    return result
+
+
+class QuotaBudget:
+    """
+    The daily youtube quota as this process sees it: units spent in the current window, by any youtube call,
+    plus what admitted migrations were promised and have not spent yet.
+    A migration is held back to a window with room for its estimate; one bigger than a whole day's quota
+    starts on an untouched window and carries on in the next ones. Its promise is released when it ends.
+    Windows end at the youtube reset, or early once youtube reports the quota gone.
+    Only this process's calls are counted: the web process and every worker.py get a whole daily_quota each,
+    so give each of them its share when more than one spends the quota
+    """
+
+    def __init__(self, daily_quota):
+        self.daily_quota = daily_quota
+        self._window_ends = None
+        self._spent = 0
+        self._promised = {}
+        self._spent_by = {}
+        self._exhausted = False
+        self._lock = threading.Lock()
+
+    def _roll(self, now):
+        # callers hold self._lock
+        if self._window_ends is None or now >= self._window_ends:
+            self._window_ends = next_reset(now)
+            self._spent = 0
+            self._promised = {}
+            self._spent_by = {}
+            self._exhausted = False
+
+    def _committed(self, excluding=None):
+        # callers hold self._lock
+        outstanding = sum(max(0, units - self._spent_by[job_id])
+                          for job_id, units in self._promised.items() if job_id != excluding)
+        return self._spent + outstanding
+
+    def remaining(self):
+        """
+        (units neither spent nor promised in the current window, epoch seconds when the window ends)
+        """
+        with self._lock:
+            self._roll(time.time())
+            if self._exhausted:
+                return 0, self._window_ends
+            return max(0, self.daily_quota - self._committed()), self._window_ends
+
+    def admit(self, job_id, units):
+        """
+        Promises units of the current window to job_id, replacing what it was promised before.
+        Returns None when they fit, otherwise the epoch seconds of the next window to try again in
+        """
+        with self._lock:
+            self._roll(time.time())
+            committed = self._committed(excluding=job_id)
+            fits = committed + units <= self.daily_quota or committed == 0
+            if units == 0 or (fits and not self._exhausted):
+                self._promised[job_id] = min(units, self.daily_quota - committed)
+                self._spent_by[job_id] = 0
+                return None
+            return self._window_ends
+
+    @contextlib.contextmanager
+    def charging(self, job_id):
+        """
+        Charges the youtube calls of the enclosed block, and of the threads and tasks it starts, to job_id
+        """
+        token = _charged_job.set(job_id)
+        try:
+            yield
+        finally:
+            _charged_job.reset(token)
+
+    def spend(self, units):
+        """
+        Records units youtube charged for a call
+        """
+        job_id = _charged_job.get()
+        with self._lock:
+            self._roll(time.time())
+            self._spent += units
+            if job_id in self._spent_by:
+                self._spent_by[job_id] += units
+
+    def release(self, job_id):
+        """
+        Drops what is left of a finished or postponed job's promise, what it spent stays counted
+        """
+        with self._lock:
+            self._promised.pop(job_id, None)
+            self._spent_by.pop(job_id, None)
+
+    def exhaust(self):
+        """
+        Closes the current window after youtube reported the quota gone, returns when the next one starts
+        """
+        with self._lock:
+            self._roll(time.time())
+            self._exhausted = True
+            return self._window_ends
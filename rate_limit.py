@@ -0,0 +1,175 @@
+"""
+Pacing and quota accounting for YouTube Data API calls.
+All youtube requests share one token bucket, and rate limit responses are retried with jittered backoff.
+"""
+import asyncio
+import random
+import threading
+import time
+
+import metrics
+
+# YouTube Data API quota units charged per call
+QUOTA_COST = {
+    'search.list': 100,
+    'channels.list': 1,
+    'videos.list': 1,
+    'playlists.list': 1,
+    'playlists.insert': 50,
+    'playlists.delete': 50,
+    'playlistItems.list': 1,
+    'playlistItems.insert': 50,
+    'playlistItems.delete': 50,
+}
+
+# 403 reasons that mean "slow down" rather than "stop for today"
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+QUOTA_REASONS = {'quotaExceeded', 'dailyLimitExceeded'}
+
+
+class QuotaExceededError(Exception):
+    """
+    Raised when youtube reports the daily quota is used up, retrying before the reset is pointless
+    """
+
+
+class RateLimitedError(Exception):
+    """
+    Raised when a call is still rate limited after every retry
+    """
+
+
+def error_reason(response):
+    """
+    Returns the google API error reason of a failed response, or None
+    """
+    if response.status_code not in (403, 429):
+        return None
+    try:
+        errors = response.json()['error']['errors']
+        return errors[0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+def retry_after(response):
+    """
+    Seconds asked for by a Retry-After header, or None
+    """
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, response, base_delay=1.0, max_delay=60.0):
+    """
+    Delay before retrying a throttled response: its Retry-After, otherwise full jitter exponential backoff
+    """
+    delay = retry_after(response)
+    if delay is None:
+        delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+    return delay
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate tokens per second, holding at most capacity tokens
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """
+        Takes tokens from the bucket and returns how long the caller must wait before using them
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens=1):
+        """
+        Blocks until tokens are available
+        """
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+
+
+class RateLimiter:
+    """
+    Paces calls through a token bucket, charges the quota units of every call to budget (e.g. a quota.QuotaBudget)
+    and retries rate limited responses with full jitter backoff
+    """
+
+    def __init__(self, rate, burst=None, max_retries=5, base_delay=1.0, max_delay=60.0, budget=None):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    def backoff(self, attempt, response):
+        """
+        Delay before retrying a rate limited response
+        """
+        return backoff_delay(attempt, response, self.base_delay, self.max_delay)
+
+    def check(self, endpoint, response):
+        """
+        Records the quota cost of a response and classifies it.
+        Returns True if the call should be retried, raises if the daily quota is gone
+        """
+        cost = QUOTA_COST.get(endpoint, 1)
+        if self.budget is not None:
+            self.budget.spend(cost)
+        metrics.YOUTUBE_QUOTA.inc(cost, endpoint=endpoint)
+        reason = error_reason(response)
+        if reason in QUOTA_REASONS:
+            raise QuotaExceededError(f'youtube quota exceeded calling {endpoint}')
+        return response.status_code == 429 or reason in RATE_LIMIT_REASONS
+
+    def call(self, endpoint, send):
+        """
+        Sends a request through the limiter, send is a zero argument callable returning the response
+        """
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            response = send()
+            if not self.check(endpoint, response):
+                return response
+            if attempt < self.max_retries:
+                delay = self.backoff(attempt, response)
+                metrics.API_RETRIES.inc(api='youtube', endpoint=endpoint,
+                                        reason=error_reason(response) or response.status_code)
+                print(f"Rate limited on {endpoint}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+        raise RateLimitedError(f'youtube kept rate limiting {endpoint}')
+
+    async def call_async(self, endpoint, send):
+        """
+        Same as call for the asyncio engine, send is a zero argument coroutine function
+        """
+        for attempt in range(self.max_retries + 1):
+            delay = self.bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            response = await send()
+            if not self.check(endpoint, response):
+                return response
+            if attempt < self.max_retries:
+                delay = self.backoff(attempt, response)
+                metrics.API_RETRIES.inc(api='youtube', endpoint=endpoint,
+                                        reason=error_reason(response) or response.status_code)
+                print(f"Rate limited on {endpoint}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        raise RateLimitedError(f'youtube kept rate limiting {endpoint}')
@@ -0,0 +1,48 @@
+"""
+Cross-playlist deduplication of song resolution.
+A song that appears in several selected playlists is searched for once and the result fans back out.
+"""
+import threading
+
+import matching
+
+
+class SharedResolver:
+    """
+    Hands out one future per distinct song for the whole migration
+    """
+
+    def __init__(self, executor, resolve):
+        self.executor = executor
+        self.resolve = resolve
+        self.requested = 0
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, song):
+        """
+        Future of the song's video id, shared with every other playlist asking for the same song
+        """
+        key = matching.track_key(song)
+        with self._lock:
+            self.requested += 1
+            future = self._futures.get(key)
+            if future is None:
+                future = self._futures[key] = self.executor.submit(self.resolve, song)
+            return future
+
+    @property
+    def unique(self):
+        """
+        Number of distinct songs resolved so far
+        """
+        with self._lock:
+            return len(self._futures)
+
+    def cancel_all(self):
+        """
+        Drops every resolution that has not started yet
+        """
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
@@ -0,0 +1,111 @@
+"""
+Server-side Flask sessions kept in SQLite.
+The cookie only carries a signed session id, the session data stays on the server.
+"""
+import json
+import time
+import uuid
+
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+from storage import SqliteStore
+
+# expired rows are purged every this many writes
+PURGE_EVERY = 256
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """
+    Session dict that remembers its id and whether it changed
+    """
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class SessionStore(SqliteStore):
+    """
+    Session records with an expiry time
+    """
+    schema = '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            sid TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+    '''
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._writes = 0
+
+    def load(self, sid):
+        """
+        Returns the session data for sid, or None if it is missing or expired
+        """
+        row = self.connect().execute('SELECT data FROM sessions WHERE sid = ? AND expires_at > ?',
+                                     (sid, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, sid, data, ttl):
+        conn = self.connect()
+        now = time.time()
+        conn.execute('INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)',
+                     (sid, json.dumps(data, separators=(',', ':')), now + ttl))
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,))
+
+    def delete(self, sid):
+        self.connect().execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+
+class SqliteSessionInterface(SessionInterface):
+    """
+    Flask session interface storing sessions server-side for ttl seconds after their last change
+    """
+
+    def __init__(self, path, ttl=24 * 3600):
+        self.store = SessionStore(path)
+        self.ttl = ttl
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='session-id')
+
+    def open_session(self, app, request):
+        signed_sid = request.cookies.get(self.get_cookie_name(app))
+        if signed_sid:
+            try:
+                sid = self._signer(app).unsign(signed_sid).decode()
+            except BadSignature:
+                sid = None
+            data = sid and self.store.load(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=uuid.uuid4().hex, new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+        self.store.save(session.sid, dict(session), self.ttl)
+        response.set_cookie(name, self._signer(app).sign(session.sid).decode(),
+                            max_age=self.ttl,
+                            httponly=self.get_cookie_httponly(app),
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app),
+                            domain=domain, path=path)
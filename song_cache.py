@@ -0,0 +1,97 @@
+"""
+Song name -> youtube videoId resolution cache.
+An in-process LRU sits in front of a SQLite store so repeat lookups skip the youtube search entirely.
+"""
+import collections
+import threading
+import time
+
+from storage import SqliteStore
+
+# counting rows is a table scan, so the size bound is only enforced every this many writes
+TRIM_EVERY = 64
+
+
+def normalize(song_name):
+    """
+    Cache key for a song name, ignoring case and spacing differences
+    """
+    return ' '.join(song_name.lower().split())
+
+
+class SongCache(SqliteStore):
+    """
+    Two tier cache of resolved video ids with a TTL.
+    The memory tier holds memory_entries keys, the SQLite tier is trimmed to max_entries
+    least recently used keys, checked every TRIM_EVERY writes
+    """
+    schema = '''
+        CREATE TABLE IF NOT EXISTS songs (
+            key TEXT PRIMARY KEY,
+            video_id TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS songs_last_used ON songs (last_used);
+    '''
+
+    def __init__(self, path, ttl=30 * 24 * 3600, max_entries=100000, memory_entries=10000):
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _remember(self, key, video_id, expires_at):
+        with self._lock:
+            self._memory[key] = (video_id, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, song_name):
+        """
+        Returns the cached video id for a song, or None if it is missing or expired
+        """
+        key = normalize(song_name)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    return entry[0]
+                del self._memory[key]
+
+        conn = self.connect()
+        row = conn.execute('SELECT video_id, created_at FROM songs WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        video_id, created_at = row
+        if created_at + self.ttl <= now:
+            conn.execute('DELETE FROM songs WHERE key = ?', (key,))
+            return None
+        conn.execute('UPDATE songs SET last_used = ? WHERE key = ?', (now, key))
+        self._remember(key, video_id, created_at + self.ttl)
+        return video_id
+
+    def set(self, song_name, video_id):
+        """
+        Stores a resolved video id, evicting the least recently used keys past max_entries
+        """
+        key = normalize(song_name)
+        now = time.time()
+        self._remember(key, video_id, now + self.ttl)
+        conn = self.connect()
+        conn.execute('INSERT OR REPLACE INTO songs (key, video_id, created_at, last_used) VALUES (?, ?, ?, ?)',
+                     (key, video_id, now, now))
+        with self._lock:
+            self._writes += 1
+            if self._writes % TRIM_EVERY:
+                return
+        excess = conn.execute('SELECT COUNT(*) FROM songs').fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute('DELETE FROM songs WHERE key IN (SELECT key FROM songs ORDER BY last_used LIMIT ?)',
+                         (excess,))
@@ -0,0 +1,43 @@
+"""
+Server-sent event streams of job progress.
+A stream blocks on the job's condition between events, so an idle stream costs one sleeping thread
+and a keep-alive comment every heartbeat seconds. Open streams are capped by the web worker's thread count.
+"""
+import json
+
+
+def format_event(event, data, event_id=None):
+    """
+    One event in the text/event-stream format
+    """
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+def job_stream(job, last_event_id=None, heartbeat=15):
+    """
+    Yields a job's progress events after last_event_id until the job ends.
+    New streams, and streams that fell further behind than the job's event buffer,
+    first get a "progress" event with the whole job state
+    """
+    if last_event_id is None:
+        snapshot = job.to_dict()
+        last_event_id = snapshot['last_event_id']
+        yield format_event('progress', snapshot, last_event_id)
+    while True:
+        events = job.events_after(last_event_id, heartbeat)
+        if events is None:
+            snapshot = job.to_dict()
+            last_event_id = snapshot['last_event_id']
+            yield format_event('progress', snapshot, last_event_id)
+            continue
+        if not events:
+            if job.finished_at is not None:
+                return
+            yield ': keep-alive\n\n'
+            continue
+        for event_id, event, data in events:
+            yield format_event(event, data, event_id)
+        last_event_id = events[-1][0]
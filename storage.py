@@ -0,0 +1,46 @@
+"""
+Shared plumbing for the small SQLite backed stores used by the app.
+"""
+import os
+import sqlite3
+import threading
+
+
+class SqliteStore:
+    """
+    Base for SQLite backed stores.
+    Each thread and process gets its own connection, opened lazily on first use
+    so nothing is shared across gunicorn worker forks
+    """
+    schema = ''
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._setup_lock = threading.Lock()
+        self._setup_pid = None
+
+    def _setup(self):
+        # schema and WAL mode persist in the file, so only the first connection of a process sets them up;
+        # doing it on every thread's connection makes threads queue on the schema lock
+        with self._setup_lock:
+            if self._setup_pid == os.getpid():
+                return
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(self.schema)
+            conn.close()
+            self._setup_pid = os.getpid()
+
+    def connect(self):
+        """
+        Returns this thread's connection, creating it and the schema if needed
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            self._setup()
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
@@ -0,0 +1,69 @@
+"""
+State of incremental syncs: per source playlist, the youtube playlist it is synced to,
+the spotify snapshot_id last synced and the youtube playlist item of each synced track.
+"""
+import time
+
+from storage import SqliteStore
+
+
+class SyncStore(SqliteStore):
+    """
+    Sync state keyed by youtube channel and spotify playlist id
+    """
+    schema = '''
+        CREATE TABLE IF NOT EXISTS synced_playlists (
+            channel_id TEXT NOT NULL,
+            spotify_playlist_id TEXT NOT NULL,
+            youtube_playlist_id TEXT NOT NULL,
+            snapshot_id TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (channel_id, spotify_playlist_id)
+        );
+        CREATE TABLE IF NOT EXISTS synced_items (
+            channel_id TEXT NOT NULL,
+            spotify_playlist_id TEXT NOT NULL,
+            track_key TEXT NOT NULL,
+            item_id TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS synced_items_playlist ON synced_items (channel_id, spotify_playlist_id);
+    '''
+
+    def get(self, channel_id, spotify_playlist_id):
+        """
+        (youtube playlist id, snapshot id, [(track key, item id), ...]) of a synced playlist, or None
+        """
+        conn = self.connect()
+        row = conn.execute('SELECT youtube_playlist_id, snapshot_id FROM synced_playlists '
+                           'WHERE channel_id = ? AND spotify_playlist_id = ?',
+                           (channel_id, spotify_playlist_id)).fetchone()
+        if row is None:
+            return None
+        items = conn.execute('SELECT track_key, item_id FROM synced_items '
+                             'WHERE channel_id = ? AND spotify_playlist_id = ? ORDER BY rowid',
+                             (channel_id, spotify_playlist_id)).fetchall()
+        return row[0], row[1], items
+
+    def save_playlist(self, channel_id, spotify_playlist_id, youtube_playlist_id, snapshot_id=None):
+        """
+        Records the youtube playlist of a source playlist.
+        A None snapshot id marks a sync in progress, so the next run diffs again
+        """
+        self.connect().execute('INSERT OR REPLACE INTO synced_playlists VALUES (?, ?, ?, ?, ?)',
+                               (channel_id, spotify_playlist_id, youtube_playlist_id, snapshot_id, time.time()))
+
+    def add_item(self, channel_id, spotify_playlist_id, track_key, item_id):
+        self.connect().execute('INSERT INTO synced_items VALUES (?, ?, ?, ?)',
+                               (channel_id, spotify_playlist_id, track_key, item_id))
+
+    def replace_items(self, channel_id, spotify_playlist_id, items):
+        """
+        Replaces the synced items of a playlist with [(track key, item id), ...] in playlist order
+        """
+        conn = self.connect()
+        with conn:
+            conn.execute('BEGIN')
+            conn.execute('DELETE FROM synced_items WHERE channel_id = ? AND spotify_playlist_id = ?',
+                         (channel_id, spotify_playlist_id))
+            conn.executemany('INSERT INTO synced_items VALUES (?, ?, ?, ?)',
+                             [(channel_id, spotify_playlist_id, key, item_id) for key, item_id in items])
@@ -2,9 +2,9 @@ import app
 import pytest
 
 def test_create_playlist(mocker):
-    # Mock the response of the requests.post method
+    # Mock the response of the pooled session
     mock_response = mocker.Mock(status_code=200, json=lambda: {'id': '12345'})
-    mocker.patch('app.requests.post', return_value=mock_response)
+    mocker.patch.object(app.http_session, 'request', return_value=mock_response)
 
     # Call the function
     result = app.create_playlist('dummy_access_token', 'Test Playlist')
@@ -14,7 +14,7 @@ def test_create_playlist(mocker):
 
 def test_get_song(mocker):
     mock_response = mocker.Mock(status_code=200, json=lambda: {'items': [{'id': {'videoId': 'abcd1234'}}]})
-    mocker.patch('app.requests.get', return_value=mock_response)
+    mocker.patch.object(app.http_session, 'request', return_value=mock_response)
 
     result = app.get_song('dummy_access_token', 'Test Song')
 
@@ -22,9 +22,498 @@ def test_get_song(mocker):
 
 def test_insert_song(mocker):
     mock_response = mocker.Mock(status_code=200, json=lambda: {'id': 'song123'})
-    mocker.patch('app.requests.post', return_value=mock_response)
+    mocker.patch.object(app.http_session, 'request', return_value=mock_response)
 
     result = app.insert_song('dummy_access_token', 'playlist123', 'video123')
 
     # Depending on what insert_song returns, assert the expected result
-    assert result == {'id': 'song123'}
\ No newline at end of file
+    assert result == {'id': 'song123'}
+
+def test_get_songs_follows_every_page(mocker):
+    def fake_request(method, url, headers=None, params=None, json=None):
+        offset = params['offset']
+        items = [{'track': {'name': f'song{i}'}} for i in range(offset, min(offset + params['limit'], 250))]
+        if offset == 0:
+            items[0] = {'track': None}
+        return mocker.Mock(status_code=200, json=lambda: {'items': items, 'total': 250})
+    mocker.patch.object(app.http_session, 'request', side_effect=fake_request)
+
+    result = [track['name'] for track in app.get_songs('dummy_access_token', 'playlist123')]
+
+    assert result == [f'song{i}' for i in range(1, 250)]
+
+
+def test_migrate_queues_background_job(mocker):
+    submit = mocker.patch('app.jobs.submit', return_value=mocker.Mock(id='job123'))
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'spotify_token'
+        sess['youtube_token'] = 'youtube_token'
+        sess['playlists'] = ['playlist123']
+        sess['youtube_channel_id'] = 'channel123'
+
+    response = client.get('/playlist_selection/migrate')
+
+    assert response.status_code == 202
+    assert response.get_json()['job_id'] == 'job123'
+    assert response.get_json()['events_url'] == '/jobs/job123/events'
+    submit.assert_called_once_with('migration', app.run_scheduled_migration, 'spotify_token', 'youtube_token',
+                                   ['playlist123'], 'channel123', {'spotify': None, 'youtube': None},
+                                   {'spotify': (None, None), 'youtube': (None, None)},
+                                   key=f"migration:{app.migration_key('channel123', ['playlist123'])}")
+
+
+def test_get_song_uses_cache(mocker):
+    mock_response = mocker.Mock(status_code=200, json=lambda: {'items': [{'id': {'videoId': 'abcd1234'}}]})
+    get = mocker.patch.object(app.http_session, 'request', return_value=mock_response)
+
+    app.get_song('dummy_access_token', 'Test Song')
+    result = app.get_song('dummy_access_token', 'test  song')
+
+    assert result == 'abcd1234'
+    assert get.call_count == 1
+
+
+def test_get_song_without_results_returns_none(mocker):
+    mock_response = mocker.Mock(status_code=200, json=lambda: {'items': []})
+    mocker.patch.object(app.http_session, 'request', return_value=mock_response)
+
+    assert app.get_song('dummy_access_token', 'Unknown Song') is None
+
+
+def test_insert_playlists_keeps_track_order(mocker):
+    mocker.patch('app.create_playlist', side_effect=lambda token, title: f'yt-{title}')
+    mocker.patch('app.get_song',
+                 side_effect=lambda token, song: None if song['name'] == 'missing' else f"video-{song['name']}")
+    insert_song = mocker.patch('app.insert_song', return_value={'id': 'item'})
+    job = app.jobs.Job('migration')
+
+    result = app.insert_playlists('dummy_access_token',
+                                  {'a': iter(['a1', 'missing', 'a2']), 'b': iter(['b1', 'b2'])}, job)
+
+    assert result == {'a': 'yt-a', 'b': 'yt-b'}
+    calls = [c.args for c in insert_song.call_args_list if c.args[1] == 'yt-a']
+    assert calls == [('dummy_access_token', 'yt-a', 'video-a1', 0), ('dummy_access_token', 'yt-a', 'video-a2', 1)]
+    assert job.playlists['a']['failed'] == 1
+    assert job.playlists['b']['done'] == 2
+
+
+def test_insert_playlists_stops_when_quota_is_gone(mocker):
+    mocker.patch('app.create_playlist', return_value='yt123')
+    mocker.patch('app.get_song', side_effect=app.QuotaExceededError('quota'))
+
+    with pytest.raises(app.QuotaExceededError):
+        app.insert_playlists('dummy_access_token', {'a': ['a1']})
+
+
+def test_youtube_calls_share_pooled_session(mocker):
+    mock_response = mocker.Mock(status_code=200, json=lambda: {'id': 'song123'})
+    request = mocker.patch.object(app.http_session, 'request', return_value=mock_response)
+    mocker.patch('app.youtube_api_key', 'api_key')
+
+    app.insert_song('dummy_access_token', 'playlist123', 'video123', position=3)
+
+    method, url = request.call_args.args
+    kwargs = request.call_args.kwargs
+    assert (method, url) == ('POST', 'https://www.googleapis.com/youtube/v3/playlistItems')
+    assert kwargs['headers']['Authorization'] == 'Bearer dummy_access_token'
+    assert kwargs['params'] == {'part': 'snippet', 'fields': 'id', 'key': 'api_key'}
+    assert kwargs['json']['snippet']['position'] == 3
+
+
+def test_bundle_playlists_makes_one_call_per_small_playlist(mocker):
+    playlist = {'name': 'Test Playlist', 'snapshot_id': 'snap1',
+                'tracks': {'total': 2, 'items': [{'track': {'name': 'song1'}}, {'track': {'name': 'song2'}}]}}
+    request = mocker.patch.object(app.http_session, 'request',
+                                  return_value=mocker.Mock(status_code=200, json=lambda: playlist))
+
+    result = app.bundle_playlists('dummy_access_token', ['playlist123'])
+
+    [playlist] = result
+    assert (playlist.spotify_id, playlist.title, playlist.snapshot_id) == ('playlist123', 'Test Playlist', 'snap1')
+    assert [track.name for track in playlist] == ['song1', 'song2']
+    assert request.call_count == 1
+    assert request.call_args.kwargs['params'] == {'fields': app.clients.SPOTIFY_PLAYLIST_FIELDS}
+
+
+def test_rerun_resumes_from_journal(mocker, tmp_path):
+    mocker.patch('app.journal_dir', str(tmp_path))
+    mocker.patch('app.bundle_playlists', side_effect=lambda token, ids: {'a': iter(['a1', 'a2', 'a3'])})
+    create_playlist = mocker.patch('app.create_playlist', return_value='yt-a')
+    get_song = mocker.patch('app.get_song', side_effect=lambda token, song: f"video-{song['name']}")
+    insert_song = mocker.patch('app.insert_song', side_effect=[{'id': 'item'}, app.QuotaExceededError('quota')])
+
+    with pytest.raises(app.QuotaExceededError):
+        app.run_migration(app.jobs.Job('migration'), 'spotify_token', 'youtube_token', ['playlist123'], 'channel')
+
+    insert_song.side_effect = None
+    insert_song.return_value = {'id': 'item'}
+    insert_song.reset_mock()
+    result = app.run_migration(app.jobs.Job('migration'), 'spotify_token', 'youtube_token', ['playlist123'], 'channel')
+
+    assert result == {'a': 'yt-a'}
+    assert create_playlist.call_count == 1
+    assert [c.args[2:] for c in insert_song.call_args_list] == [('video-a2', 1), ('video-a3', 2)]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_page_fails_the_playlist_and_keeps_the_journal(mocker, tmp_path):
+    journal_dir = tmp_path / 'journals'
+    mocker.patch('app.journal_dir', str(journal_dir))
+    mocker.patch('app.spotify_concurrency', None)
+    sleep = mocker.patch('clients.time.sleep')
+    playlist = {'name': 'Test Playlist', 'snapshot_id': 'snap1',
+                'tracks': {'total': 150, 'items': [{'track': {'name': f'song{i}'}} for i in range(100)]}}
+    def fake_request(method, url, headers=None, params=None, json=None):
+        if url.endswith('/tracks'):
+            return mocker.Mock(status_code=500, headers={}, text='server error')
+        return mocker.Mock(status_code=200, headers={}, json=lambda: playlist)
+    mocker.patch.object(app.http_session, 'request', side_effect=fake_request)
+    mocker.patch('app.create_playlist', return_value='yt-a')
+    mocker.patch('app.get_song', side_effect=lambda token, song: f"video-{song['name']}")
+    mocker.patch('app.insert_song', return_value={'id': 'item'})
+    job = app.jobs.Job('migration')
+
+    result = app.run_migration(job, 'spotify_token', 'youtube_token', ['playlist123'], 'channel')
+
+    assert result == {'Test Playlist': None}
+    assert job.playlists['Test Playlist']['status'] == 'failed'
+    assert sleep.call_count == app.clients.SPOTIFY_MAX_RETRIES
+    assert len(list(journal_dir.iterdir())) == 1
+
+
+def test_rerun_resumes_same_named_playlists_by_spotify_id(mocker):
+    # the last run migrated p2 first, this time the listing puts p1 first and so titles it "Mix"
+    journal = app.Journal()
+    journal.record_playlist('p2', 'yt-p2')
+    journal.record_track('p2', 0, True)
+    plan = app.Plan()
+    plan.add('p1', 'Mix', songs=['a1', 'a2'])
+    plan.add('p2', 'Mix', songs=['b1', 'b2'])
+    create_playlist = mocker.patch('app.create_playlist', return_value='yt-p1')
+    mocker.patch('app.get_song', side_effect=lambda token, song: f"video-{song['name']}")
+    insert_song = mocker.patch('app.insert_song', return_value={'id': 'item'})
+
+    result = app.insert_playlists('dummy_access_token', plan, journal=journal)
+
+    assert result == {'Mix': 'yt-p1', 'Mix (2)': 'yt-p2'}
+    create_playlist.assert_called_once_with('dummy_access_token', 'Mix')
+    assert sorted(c.args[1:] for c in insert_song.call_args_list) == [
+        ('yt-p1', 'video-a1', 0), ('yt-p1', 'video-a2', 1), ('yt-p2', 'video-b2', 1)]
+
+
+def test_shared_songs_are_resolved_once(mocker):
+    mocker.patch('app.create_playlist', side_effect=lambda token, title: f'yt-{title}')
+    get_song = mocker.patch('app.get_song', side_effect=lambda token, song: f"video-{song['name'].lower()}")
+    insert_song = mocker.patch('app.insert_song', return_value={'id': 'item'})
+
+    app.insert_playlists('dummy_access_token', {'a': ['Hit', 'a1'], 'b': ['Hit', 'b1'], 'c': ['Hit']})
+
+    assert sorted(c.args[1]['name'] for c in get_song.call_args_list) == ['Hit', 'a1', 'b1']
+    assert insert_song.call_count == 5
+
+
+def test_get_song_scores_candidates(mocker):
+    search = {'items': [{'id': {'videoId': 'cover'}}, {'id': {'videoId': 'official'}}]}
+    videos = {'items': [
+        {'id': 'cover', 'snippet': {'title': 'Test Song (Live Cover)', 'channelTitle': 'Someone'},
+         'contentDetails': {'duration': 'PT4M50S'}},
+        {'id': 'official', 'snippet': {'title': 'Test Song', 'channelTitle': 'Test Artist - Topic'},
+         'contentDetails': {'duration': 'PT3M21S'}},
+    ]}
+    request = mocker.patch.object(app.http_session, 'request', side_effect=[
+        mocker.Mock(status_code=200, json=lambda: search),
+        mocker.Mock(status_code=200, json=lambda: videos),
+    ])
+    track = {'name': 'Test Song', 'artists': ['Test Artist'], 'duration_ms': 201000, 'isrc': 'USABC1234567'}
+
+    assert app.get_song('dummy_access_token', track) == 'official'
+    assert request.call_args.kwargs['params']['id'] == 'cover,official'
+    assert app.song_cache.get('isrc:USABC1234567') == 'official'
+
+
+def test_sync_keeps_same_named_playlists_apart(mocker):
+    snapshots = {p: {'id': p, 'name': 'Mix', 'snapshot_id': 'snap1', 'total': 1, 'songs': iter([f'{p}1'])}
+                 for p in ('a', 'b')}
+    mocker.patch('app.get_playlist_snapshot', side_effect=lambda token, p: snapshots[p])
+    create_playlist = mocker.patch('app.create_playlist', side_effect=['yt-a', 'yt-b'])
+    mocker.patch('app.get_song', side_effect=lambda token, song: f'video-{song}')
+    mocker.patch('app.insert_song', return_value={'id': 'item'})
+    job = app.jobs.Job('sync')
+
+    app.run_sync(job, 'spotify_token', 'youtube_token', ['a', 'b'], 'channel')
+
+    assert sorted(job.playlists) == ['Mix', 'Mix (2)']
+    assert all(progress['status'] == 'finished' for progress in job.playlists.values())
+    assert [c.args[1] for c in create_playlist.call_args_list] == ['Mix', 'Mix']
+
+
+def test_sync_reports_unreadable_playlist_as_failed(mocker):
+    fake_spotify_with_unreadable_playlist(mocker)
+    mocker.patch('app.create_playlist', return_value='yt-good')
+    mocker.patch('app.get_song', side_effect=lambda token, song: f"video-{song['name']}")
+    mocker.patch('app.insert_song', return_value={'id': 'item'})
+    job = app.jobs.Job('sync')
+
+    result = app.run_sync(job, 'spotify_token', 'youtube_token', ['good', 'bad'], 'channel')
+
+    assert result == {'good': 'yt-good', 'bad': None}
+    assert job.playlists['Good']['status'] == 'finished'
+    assert job.playlists['Bad']['status'] == 'failed'
+
+
+def test_sync_only_applies_changes(mocker):
+    snapshots = {}
+    mocker.patch('app.get_playlist_snapshot', side_effect=lambda token, p: dict(snapshots[p], songs=iter(snapshots[p]['songs'])))
+    create_playlist = mocker.patch('app.create_playlist', return_value='yt-a')
+    get_song = mocker.patch('app.get_song', side_effect=lambda token, song: f'video-{song}')
+    items = iter(range(100))
+    insert_song = mocker.patch('app.insert_song', side_effect=lambda *args: {'id': f'item{next(items)}'})
+    delete_item = mocker.patch('app.delete_playlist_item', return_value=True)
+
+    def sync(snapshot_id, songs):
+        snapshots['a'] = {'id': 'a', 'name': 'A', 'snapshot_id': snapshot_id, 'total': len(songs), 'songs': songs}
+        insert_song.reset_mock()
+        get_song.reset_mock()
+        return app.run_sync(app.jobs.Job('sync'), 'spotify_token', 'youtube_token', ['a'], 'channel')
+
+    assert sync('snap1', ['s1', 's2', 's3']) == {'a': 'yt-a'}
+    assert insert_song.call_count == 3
+
+    sync('snap1', ['s1', 's2', 's3'])
+    assert insert_song.call_count == 0 and get_song.call_count == 0
+
+    sync('snap2', ['s1', 's4', 's3'])
+    delete_item.assert_called_once_with('youtube_token', 'item1')
+    assert [c.args[2:] for c in insert_song.call_args_list] == [('video-s4', 1)]
+    assert create_playlist.call_count == 1
+    assert app.sync_store.get('channel', 'a') == ('yt-a', 'snap2', [('s1', 'item0'), ('s4', 'item3'), ('s3', 'item2')])
+
+
+def test_reset_deletes_every_page(mocker):
+    pages = {None: {'items': [{'id': 'p1'}, {'id': 'p2'}], 'nextPageToken': 'next'},
+             'next': {'items': [{'id': 'p3'}]}}
+
+    def fake_request(method, url, headers=None, params=None, json=None):
+        if method == 'GET':
+            return mocker.Mock(status_code=200, json=lambda: pages[params.get('pageToken')])
+        return mocker.Mock(status_code=404 if params['id'] == 'p3' else 204)
+    request = mocker.patch.object(app.http_session, 'request', side_effect=fake_request)
+    job = app.jobs.Job('reset')
+
+    app.run_reset(job, 'youtube_token')
+
+    deleted = sorted(c.kwargs['params']['id'] for c in request.call_args_list if c.args[0] == 'DELETE')
+    assert deleted == ['p1', 'p2', 'p3']
+    assert job.playlists['youtube playlists']['done'] == 3
+    assert job.playlists['youtube playlists']['total'] == 3
+
+
+def test_reset_fails_when_a_page_cannot_be_listed(mocker):
+    def fake_request(method, url, headers=None, params=None, json=None):
+        if params.get('pageToken'):
+            return mocker.Mock(status_code=500, headers={}, text='backend error', json=lambda: {})
+        return mocker.Mock(status_code=200, json=lambda: {'items': [{'id': 'p1'}], 'nextPageToken': 'next'})
+    request = mocker.patch.object(app.http_session, 'request', side_effect=fake_request)
+
+    with pytest.raises(app.clients.PageFailedError):
+        app.run_reset(app.jobs.Job('reset'), 'youtube_token')
+    assert all(c.args[0] == 'GET' for c in request.call_args_list)
+
+
+def test_create_app_registers_oauth_clients_on_first_login(tmp_path):
+    flask_app = app.create_app({'SPOTIFY_CLIENT_ID': 'client123', 'SESSION_STORE_PATH': str(tmp_path / 's.db')})
+    assert 'oauth' not in flask_app.extensions
+
+    response = flask_app.test_client().get('/spotify_login')
+
+    assert response.status_code == 302
+    assert response.location.startswith('https://accounts.spotify.com/authorize')
+    assert 'client_id=client123' in response.location
+    assert 'oauth' in flask_app.extensions
+
+
+def test_playlist_selection_lists_every_page_once_then_renders_from_cache(mocker):
+    def playlist(i):
+        return {'id': f'p{i}', 'name': f'Playlist {i}', 'snapshot_id': f's{i}', 'tracks': {'total': i}}
+
+    def get(method, url, headers=None, params=None):
+        offset = params['offset']
+        page = {'total': 120, 'items': [playlist(i) for i in range(offset, min(offset + params['limit'], 120))]}
+        return mocker.Mock(status_code=200, json=lambda: page)
+    request = mocker.patch.object(app.http_session, 'request', side_effect=get)
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'spotify_token'
+
+    first = client.get('/playlist_selection').get_data(as_text=True)
+    second = client.get('/playlist_selection').get_data(as_text=True)
+
+    assert 'Playlist 0 (0 tracks)' in first and 'Playlist 119 (119 tracks)' in first
+    assert second == first
+    assert sorted(call.kwargs['params']['offset'] for call in request.call_args_list) == [0, 50, 100]
+    with client.session_transaction() as sess:
+        assert sess['playlist_info']['playlists'][5] == {'id': 'p5', 'name': 'Playlist 5', 'total': 5,
+                                                         'snapshot_id': 's5'}
+
+
+def test_playlists_with_the_same_name_are_both_migrated(mocker):
+    playlist = {'name': 'Mix', 'snapshot_id': 'snap1', 'tracks': {'total': 1, 'items': [{'track': {'name': 'song'}}]}}
+    mocker.patch.object(app.http_session, 'request', return_value=mocker.Mock(status_code=200, json=lambda: playlist))
+    create_playlist = mocker.patch('app.create_playlist', side_effect=['yt-1', 'yt-2'])
+    mocker.patch('app.get_song', return_value='video')
+    mocker.patch('app.insert_song', return_value={'id': 'item'})
+
+    result = app.insert_playlists('youtube_token', app.bundle_playlists('spotify_token', ['p1', 'p2']))
+
+    assert sorted(result) == ['Mix', 'Mix (2)']
+    assert sorted(result.values()) == ['yt-1', 'yt-2']
+    assert [c.args[1] for c in create_playlist.call_args_list] == ['Mix', 'Mix']
+
+
+def test_scheduled_migration_resumes_after_quota_reset(mocker):
+    mocker.patch('app.quota_budget', app.quota.QuotaBudget(10000))
+    mocker.patch.object(app.quota_budget, 'exhaust', return_value=12345.0)
+    bundle = mocker.patch('app.bundle_playlists', return_value=app.Plan())
+    mocker.patch('app.estimate_migration', return_value={'units': 300})
+    refresh = mocker.patch('app.refresh_access_token', side_effect=lambda api, token, credentials: f'fresh-{api}')
+    run_migration = mocker.patch('app.run_migration', side_effect=[app.QuotaExceededError('quota'), {'a': 'yt-a'}])
+    job = app.jobs.Job('migration')
+    refresh_tokens = {'spotify': 'sp-refresh', 'youtube': 'yt-refresh'}
+    credentials = {'spotify': ('sp-id', 'sp-secret'), 'youtube': ('yt-id', 'yt-secret')}
+
+    with pytest.raises(app.jobs.Postponed) as postponed:
+        app.run_scheduled_migration(job, 'spotify_token', 'youtube_token', ['p1'], 'channel', refresh_tokens,
+                                    credentials)
+    assert postponed.value.resume_at == 12345.0
+    assert refresh.call_count == 0
+
+    result = app.run_scheduled_migration(job, *postponed.value.target_args)
+
+    assert result == {'a': 'yt-a'}
+    assert [c.args for c in refresh.call_args_list] == [('spotify', 'sp-refresh', credentials),
+                                                        ('youtube', 'yt-refresh', credentials)]
+    assert run_migration.call_args.args[1:3] == ('fresh-spotify', 'fresh-youtube')
+    # the plan read for the estimate is the one migrated
+    assert run_migration.call_args.args[5] is bundle.return_value
+    assert bundle.call_count == 2
+
+
+def test_refresh_uses_the_configured_client_credentials(mocker, tmp_path):
+    post = mocker.patch.object(app.http_session, 'post',
+                               return_value=mocker.Mock(status_code=200, json=lambda: {'access_token': 'fresh'}))
+    flask_app = app.create_app({'YOUTUBE_CLIENT_ID': 'config-id', 'YOUTUBE_CLIENT_SECRET': 'config-secret',
+                                'SESSION_STORE_PATH': str(tmp_path / 's.db')})
+    with flask_app.app_context():
+        credentials = app.oauth_credentials()
+
+    assert app.refresh_access_token('youtube', 'yt-refresh', credentials) == 'fresh'
+    data = post.call_args.kwargs['data']
+    assert (data['client_id'], data['client_secret']) == ('config-id', 'config-secret')
+
+
+def test_queue_backend_is_held_to_the_quota_budget(mocker):
+    mocker.patch('app.migration_backend', 'queue')
+    mocker.patch('app.quota_budget', app.quota.QuotaBudget(10000))
+    plan = app.Plan()
+    plan.add('p1', 'A', songs=['a1'])
+    mocker.patch('app.bundle_playlists', return_value=plan)
+    mocker.patch('app.estimate_migration', return_value={'units': 300})
+    admit = mocker.patch.object(app.quota_budget, 'admit', return_value=None)
+    run_queued = mocker.patch('app.run_queued_migration', return_value={'p1': 'yt-a'})
+    job = app.jobs.Job('migration')
+
+    assert app.run_scheduled_migration(job, 'spotify_token', 'youtube_token', ['p1', 'p2'], 'channel') == {'p1': 'yt-a'}
+    admit.assert_called_once_with(job.id, 300)
+    # only the playlists spotify could read are queued
+    assert run_queued.call_args.args[1:] == ('spotify_token', 'youtube_token', ['p1'], 'channel')
+
+
+def test_scheduled_migration_releases_its_estimate_when_done(mocker, quota_budget):
+    mocker.patch('app.bundle_playlists', return_value=app.Plan())
+    mocker.patch('app.estimate_migration', return_value={'units': 3000})
+    def run_migration(job, *args):
+        # what the job spends is charged to it while it runs
+        app.youtube_limiter.check('playlistItems.insert', mocker.Mock(status_code=200, json=lambda: {}))
+        assert quota_budget.remaining()[0] == 10000 - 3000
+        return {}
+    mocker.patch('app.run_migration', side_effect=run_migration)
+
+    app.run_scheduled_migration(app.jobs.Job('migration'), 'spotify_token', 'youtube_token', ['p1'], 'channel')
+
+    assert quota_budget.remaining()[0] == 10000 - 50
+
+
+def test_scheduled_migration_without_refresh_tokens_runs_right_away(mocker):
+    mocker.patch('app.quota_budget', app.quota.QuotaBudget(100))
+    mocker.patch('app.bundle_playlists', return_value=app.Plan())
+    mocker.patch('app.estimate_migration', return_value={'units': 300})
+    mocker.patch.object(app.quota_budget, 'admit', return_value=12345.0)
+    run_migration = mocker.patch('app.run_migration', side_effect=app.QuotaExceededError('quota'))
+
+    with pytest.raises(app.QuotaExceededError):
+        app.run_scheduled_migration(app.jobs.Job('migration'), 'spotify_token', 'youtube_token', ['p1'], 'channel',
+                                    {'spotify': 'sp-refresh', 'youtube': None})
+    run_migration.assert_called_once()
+
+
+def fake_spotify_with_unreadable_playlist(mocker):
+    # playlist "good" reads in one call, every second page of playlist "bad" fails
+    playlists = {
+        'good': {'name': 'Good', 'snapshot_id': 'snap1', 'tracks': {'total': 1, 'items': [{'track': {'name': 'g'}}]}},
+        'bad': {'name': 'Bad', 'snapshot_id': 'snap2',
+                'tracks': {'total': 150, 'items': [{'track': {'name': f'b{i}'}} for i in range(100)]}},
+    }
+    def fake_request(method, url, headers=None, params=None, json=None):
+        if url.endswith('/tracks'):
+            return mocker.Mock(status_code=500, headers={}, text='server error')
+        return mocker.Mock(status_code=200, headers={}, json=lambda: playlists[url.rsplit('/', 1)[1]])
+    mocker.patch('app.spotify_concurrency', None)
+    mocker.patch('clients.time.sleep')
+    return mocker.patch.object(app.http_session, 'request', side_effect=fake_request)
+
+
+def test_scheduled_migration_fails_only_the_unreadable_playlist(mocker, tmp_path):
+    journal_dir = tmp_path / 'journals'
+    mocker.patch('app.journal_dir', str(journal_dir))
+    mocker.patch('app.quota_budget', app.quota.QuotaBudget(10000))
+    fake_spotify_with_unreadable_playlist(mocker)
+    mocker.patch('app.create_playlist', return_value='yt-good')
+    mocker.patch('app.get_song', side_effect=lambda token, song: f"video-{song['name']}")
+    mocker.patch('app.insert_song', return_value={'id': 'item'})
+    job = app.jobs.Job('migration')
+
+    result = app.run_scheduled_migration(job, 'spotify_token', 'youtube_token', ['good', 'bad'], 'channel')
+
+    assert result == {'Good': 'yt-good'}
+    assert job.playlists['Good']['status'] == 'finished'
+    assert job.playlists['Bad']['status'] == 'failed'
+    assert len(list(journal_dir.iterdir())) == 1
+
+
+def test_estimate_reports_unreadable_playlists_as_json(mocker, song_cache):
+    fake_spotify_with_unreadable_playlist(mocker)
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'spotify_token'
+
+    response = client.post('/playlist_selection/estimate', data={'selected_playlists': ['good', 'bad']})
+
+    assert response.status_code == 502
+    assert response.get_json()['unreadable'] == ['bad']
+
+
+def test_estimate_is_a_dry_run(mocker, song_cache):
+    playlist = {'name': 'Mix', 'snapshot_id': 'snap1',
+                'tracks': {'total': 2, 'items': [{'track': {'name': 'a'}}, {'track': {'name': 'a'}}]}}
+    request = mocker.patch.object(app.http_session, 'request',
+                                  return_value=mocker.Mock(status_code=200, json=lambda: playlist))
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['spotify_token'] = 'spotify_token'
+
+    response = client.post('/playlist_selection/estimate', data={'selected_playlists': ['p1']})
+
+    cost = response.get_json()
+    assert (cost['units'], cost['duplicates'], cost['remaining_today']) == (50 + 2 * 50 + 101, 1, 10000)
+    assert all('googleapis' not in c.args[1] for c in request.call_args_list)
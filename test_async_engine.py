@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+from aiohttp import web
+
+import async_engine
+import jobs
+from rate_limit import RateLimiter
+
+
+def fake_api(tracks_total):
+    inserted = []
+
+    def page(offset, limit):
+        items = [{'track': {'name': f'song{i}'}} for i in range(offset, min(offset + limit, tracks_total))]
+        return {'items': items, 'total': tracks_total}
+
+    async def playlist(request):
+        return web.json_response({'name': 'Test Playlist', 'snapshot_id': 'snap1', 'tracks': page(0, 2)})
+
+    async def tracks(request):
+        return web.json_response(page(int(request.query['offset']), int(request.query['limit'])))
+
+    async def create_playlist(request):
+        return web.json_response({'id': 'yt123'})
+
+    async def search(request):
+        await asyncio.sleep(0.01)
+        return web.json_response({'items': [{'id': {'videoId': f"video-{request.query['q']}"}}]})
+
+    async def insert(request):
+        body = await request.json()
+        inserted.append((body['snippet']['position'], body['snippet']['resourceId']['videoId']))
+        return web.json_response({'id': 'item'})
+
+    api = web.Application()
+    api.router.add_get('/spotify/playlists/{id}', playlist)
+    api.router.add_get('/spotify/playlists/{id}/tracks', tracks)
+    api.router.add_post('/youtube/playlists', create_playlist)
+    api.router.add_get('/youtube/search', search)
+    api.router.add_post('/youtube/playlistItems', insert)
+    return api, inserted
+
+
+def test_migrate_over_one_event_loop(song_cache):
+    async def run():
+        api, inserted = fake_api(tracks_total=5)
+        runner = web.AppRunner(api)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        job = jobs.Job('migration')
+        try:
+            result = await async_engine.migrate(
+                job, 'spotify_token', 'youtube_token', ['playlist123'], song_cache, RateLimiter(1000, 1000),
+                page_size=2,
+                spotify_base_url=f'http://127.0.0.1:{port}/spotify',
+                youtube_base_url=f'http://127.0.0.1:{port}/youtube')
+        finally:
+            await runner.cleanup()
+        return result, inserted, job
+
+    result, inserted, job = asyncio.run(run())
+
+    assert result == {'Test Playlist': 'yt123'}
+    assert inserted == [(i, f'video-song{i}') for i in range(5)]
+    assert job.playlists['Test Playlist']['done'] == 5
+
+
+def test_blocked_song_cache_does_not_stall_the_loop():
+    class SlowCache:
+        def get(self, key):
+            # e.g. waiting on another process's SQLite write lock
+            time.sleep(0.2)
+            return 'video-cached'
+
+    engine = async_engine.Engine(None, None, SlowCache(), 100, None)
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        ticker = asyncio.ensure_future(tick())
+        try:
+            return await engine._get_song({'name': 'song'})
+        finally:
+            ticker.cancel()
+
+    assert asyncio.run(run()) == 'video-cached'
+    assert len(ticks) > 5
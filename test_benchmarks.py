@@ -0,0 +1,10 @@
+from benchmarks import bench
+
+
+def test_benchmark_migrates_every_track_against_the_stand_ins():
+    result = bench.run(2, 10, scenario='routes', overlap=0.5)
+
+    assert result['error'] is None
+    assert result['migrated'] == result['tracks'] == 20
+    assert result['matched'] == 20
+    assert result['youtube_quota'] > 0
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+
+import metrics
+from concurrency import AdaptiveLimiter
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return {}
+
+
+def test_limit_grows_while_healthy_and_halves_on_rate_limits():
+    limiter = AdaptiveLimiter('test', 4, maximum=8)
+    for _ in range(8):
+        limiter.call(lambda: Response(200))
+    assert limiter.limit == 5
+    limiter.call(lambda: Response(429))
+    assert limiter.limit == 2
+    assert metrics.API_CONCURRENCY_LIMIT.value(api='test') == 2
+    for _ in range(100):
+        limiter.call(lambda: Response(200))
+    assert limiter.limit == 8
+
+
+def test_calls_in_flight_at_a_cut_only_cut_once():
+    limiter = AdaptiveLimiter('test', 8, maximum=8)
+    started = [limiter.acquire() for _ in range(4)]
+    for start in started:
+        limiter.release(start, Response(503))
+    assert limiter.limit == 4
+    limiter.release(limiter.acquire(), None)
+    assert limiter.limit == 2
+    assert limiter.in_flight == 0
+
+
+def test_calls_wait_for_a_free_slot():
+    limiter = AdaptiveLimiter('test', 1)
+    release = threading.Event()
+    first = threading.Thread(target=limiter.call, args=(lambda: release.wait() and Response(200),))
+    first.start()
+    while limiter.in_flight == 0:
+        pass
+    second = threading.Thread(target=limiter.call, args=(lambda: Response(200),))
+    second.start()
+    second.join(0.05)
+    assert second.is_alive()
+    release.set()
+    first.join()
+    second.join(1)
+    assert not second.is_alive()
+
+
+def test_retry_after_holds_new_calls_back(mocker):
+    clock = mocker.patch('concurrency.time.monotonic', return_value=100.0)
+    limiter = AdaptiveLimiter('test', 4)
+    limiter.call(lambda: Response(429, {'Retry-After': '2'}))
+    assert limiter._wait_time() == 2
+    clock.return_value = 102.0
+    assert limiter._wait_time() == 0
+
+
+def test_async_calls_share_the_limit():
+    limiter = AdaptiveLimiter('test', 2, maximum=2)
+    peak = 0
+
+    async def request():
+        nonlocal peak
+        peak = max(peak, limiter.in_flight)
+        await asyncio.sleep(0.001)
+        return Response(200)
+
+    async def run():
+        await asyncio.gather(*(limiter.call_async(request) for _ in range(10)))
+
+    asyncio.run(run())
+    assert peak == 2
+    assert limiter.in_flight == 0
+
+
+def test_slow_responses_cut_the_limit(mocker):
+    clock = mocker.patch('concurrency.time.monotonic', return_value=0.0)
+    limiter = AdaptiveLimiter('test', 8)
+    started = limiter.acquire()
+    clock.return_value = 0.1
+    limiter.release(started, Response(200))
+    assert (limiter.limit, limiter.baselines[None]) == (8, 0.1)
+    started = limiter.acquire()
+    clock.return_value = 1.0
+    limiter.release(started, Response(200))
+    assert limiter.limit == 4
+
+
+def test_endpoints_with_different_latencies_keep_the_limit(mocker):
+    clock = mocker.patch('concurrency.time.monotonic', return_value=0.0)
+    limiter = AdaptiveLimiter('youtube', 16)
+    latencies = {'videos.list': (0.06, 0.1), 'search.list': (0.35, 0.5), 'playlistItems.insert': (0.3, 0.45)}
+    for i in range(2000):
+        endpoint = list(latencies)[i % 3]
+        fast, slow = latencies[endpoint]
+        started = limiter.acquire()
+        clock.return_value += fast if i % 2 else slow
+        limiter.release(started, Response(200), endpoint)
+    assert limiter.limit == 16
+    assert limiter.baselines['videos.list'] < 0.1 < limiter.baselines['search.list']
@@ -0,0 +1,50 @@
+import clients
+import http_cache
+from http_cache import ResponseCache
+
+
+def response(mocker, status_code, body=b'', etag=None):
+    return mocker.Mock(status_code=status_code, content=body, headers={'ETag': etag} if etag else {})
+
+
+def test_not_modified_response_is_served_from_the_stored_copy(mocker, tmp_path):
+    session = mocker.Mock()
+    session.request.side_effect = [response(mocker, 200, b'{"name": "Test Playlist"}', '"v1"'),
+                                   response(mocker, 304)]
+    client = clients.SpotifyClient('token', session, cache=ResponseCache(str(tmp_path / 'responses.db')))
+
+    client.get('playlists/abc', params={'fields': 'name'})
+    cached = client.get('playlists/abc', params={'fields': 'name'})
+
+    assert cached.status_code == 200
+    assert cached.json() == {'name': 'Test Playlist'}
+    assert session.request.call_args.kwargs['headers']['If-None-Match'] == '"v1"'
+
+
+def test_user_relative_reads_are_not_shared_between_tokens(mocker, tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses.db'))
+    session = mocker.Mock()
+    session.request.return_value = response(mocker, 200, b'{"items": []}', '"v1"')
+
+    clients.SpotifyClient('token1', session, cache=cache).get('me/playlists')
+    clients.SpotifyClient('token2', session, cache=cache).get('me/playlists')
+    clients.SpotifyClient('token2', session, cache=cache).get('playlists/abc')
+    clients.SpotifyClient('token1', session, cache=cache).get('playlists/abc')
+
+    sent = [call.kwargs['headers'].get('If-None-Match') for call in session.request.call_args_list]
+    assert sent == [None, None, None, '"v1"']
+
+
+def test_disk_tier_survives_new_process_and_memory_tier_is_bounded(tmp_path):
+    path = str(tmp_path / 'responses.db')
+    cache = ResponseCache(path, memory_bytes=10)
+    cache.set('a', '"a"', b'12345678')
+    cache.set('b', '"b"', b'12345678')
+
+    assert list(cache._memory) == ['b']
+    assert ResponseCache(path).get('a') == ('"a"', b'12345678')
+
+
+def test_cache_key_ignores_parameter_order():
+    assert http_cache.cache_key('u', {'a': 1, 'b': 2}) == http_cache.cache_key('u', {'b': 2, 'a': 1})
+    assert http_cache.cache_key('u', {'a': 1}) != http_cache.cache_key('u', {'a': 1}, scope='user')
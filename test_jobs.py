@@ -0,0 +1,84 @@
+import threading
+
+import jobs
+import pytest
+
+
+def wait_for(job, timeout=5):
+    deadline = jobs.time.time() + timeout
+    while job.finished_at is None and jobs.time.time() < deadline:
+        jobs.time.sleep(0.01)
+
+
+def test_submit_runs_job_in_background():
+    def target(job, name):
+        job.start_playlist(name)
+        job.track_done(name)
+        job.track_done(name, ok=False)
+        job.finish_playlist(name, 'yt123')
+
+    job = jobs.submit('migration', target, 'Test Playlist')
+    wait_for(job)
+
+    assert jobs.get_job(job.id) is job
+    result = job.to_dict()
+    assert result['status'] == 'finished'
+    assert result['playlists'] == {'Test Playlist': {'status': 'finished', 'done': 1, 'failed': 1, 'total': None,
+                                                     'youtube_playlist_id': 'yt123'}}
+
+
+def test_failed_job_records_error():
+    def target(job):
+        raise RuntimeError('boom')
+
+    job = jobs.submit('migration', target)
+    wait_for(job)
+
+    assert job.status == 'failed'
+    assert job.error == 'boom'
+
+
+def test_resubmitting_a_running_job_returns_it():
+    release = threading.Event()
+    first = jobs.submit('migration', lambda job: release.wait(5), key='migration:abc')
+    second = jobs.submit('migration', lambda job: None, key='migration:abc')
+    release.set()
+    wait_for(first)
+
+    assert second is first
+    assert jobs.submit('migration', lambda job: None, key='migration:abc') is not first
+
+
+def test_progress_events_resume_after_the_last_seen_id():
+    job = jobs.Job('migration')
+    job.start_playlist('Test Playlist', total=2)
+    job.track_resolved('Test Playlist', 0, 'video1')
+    job.track_done('Test Playlist', index=0)
+    seen = job.last_event_id
+    job.track_done('Test Playlist', ok=False, index=1)
+
+    events = job.events_after(seen, timeout=0)
+
+    assert [(event, data['index'], data['failed']) for _, event, data in events] == [('failed', 1, 1)]
+    assert [event for _, event, _ in job.events_after(0, timeout=0)] == ['playlist', 'resolved', 'inserted', 'failed']
+
+
+def test_postponed_job_waits_without_a_worker_thread():
+    runs = []
+
+    def target(job, attempt):
+        runs.append(attempt)
+        if attempt == 1:
+            raise jobs.Postponed(jobs.time.time() + 0.05, 'youtube quota', (2,))
+
+    job = jobs.submit('migration', target, 1)
+    deadline = jobs.time.time() + 5
+    while job.status != 'waiting' and jobs.time.time() < deadline:
+        jobs.time.sleep(0.001)
+    assert job.to_dict()['resume_at'] is not None
+    wait_for(job)
+
+    assert runs == [1, 2]
+    assert job.status == 'finished'
+    statuses = [data['status'] for _, event, data in job.events if event == 'status']
+    assert statuses == ['running', 'waiting', 'running', 'finished']
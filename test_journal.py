@@ -0,0 +1,24 @@
+from journal import Journal, migration_key
+
+
+def test_replay_restores_progress(tmp_path):
+    journal = Journal.open(str(tmp_path), 'key')
+    journal.record_playlist('Test Playlist', 'yt123')
+    journal.record_resolved('song1', 'video1')
+    journal.record_track('Test Playlist', 0, True)
+    journal.record_track('Test Playlist', 1, False)
+    journal.close()
+    with open(journal.path, 'a') as f:
+        f.write('{"type": "track", "play')
+
+    resumed = Journal.open(str(tmp_path), 'key')
+
+    assert resumed.playlists == {'Test Playlist': 'yt123'}
+    assert resumed.resolved == {'song1': 'video1'}
+    assert resumed.resume_point('Test Playlist') == (2, 1)
+    assert resumed.resume_point('Other Playlist') == (0, 0)
+
+
+def test_migration_key_ignores_selection_order():
+    assert migration_key('channel', ['a', 'b']) == migration_key('channel', ['b', 'a'])
+    assert migration_key('channel', ['a']) != migration_key('other channel', ['a'])
@@ -0,0 +1,25 @@
+import matching
+
+
+def test_parse_duration():
+    assert matching.parse_duration('PT3M21S') == 201
+    assert matching.parse_duration('PT1H2S') == 3602
+    assert matching.parse_duration('P0D') == 0
+    assert matching.parse_duration('garbage') is None
+
+
+def test_track_key_prefers_isrc():
+    assert matching.track_key({'name': 'Song', 'artists': ['Artist'], 'isrc': 'US1'}) == 'isrc:US1'
+    assert matching.track_key({'name': 'Song', 'artists': ['Artist', 'Feature']}) == 'song artist'
+    assert matching.track_key('Song') == 'song'
+
+
+def test_score_penalises_other_versions_and_wrong_length():
+    track = {'name': 'Song', 'artists': ['Artist'], 'duration_ms': 200000}
+
+    def video(title, duration):
+        return {'snippet': {'title': title, 'channelTitle': 'Artist'}, 'contentDetails': {'duration': duration}}
+
+    assert matching.score(track, video('Artist - Song', 'PT3M20S')) > \
+        matching.score(track, video('Artist - Song (Karaoke)', 'PT3M20S')) > \
+        matching.score(track, video('Artist - Song (Karaoke)', 'PT9M'))
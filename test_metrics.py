@@ -0,0 +1,66 @@
+import app
+import metrics
+from rate_limit import RateLimiter
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram('test_seconds', 'Test latency', ('endpoint',), buckets=(0.1, 1.0))
+    histogram.observe(0.05, endpoint='search.list')
+    histogram.observe(0.5, endpoint='search.list')
+    histogram.observe(5, endpoint='search.list')
+
+    lines = histogram.render()
+
+    assert 'test_seconds_bucket{endpoint="search.list",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{endpoint="search.list",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{endpoint="search.list",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{endpoint="search.list"} 3' in lines
+
+
+def test_youtube_calls_record_latency_status_retries_and_quota(mocker):
+    mocker.patch('rate_limit.time.sleep')
+    rate_limited = mocker.Mock(status_code=429, headers={}, json=lambda: {})
+    ok = mocker.Mock(status_code=200, json=lambda: {'id': 'item123'})
+    mocker.patch.object(app.http_session, 'request', side_effect=[rate_limited, ok])
+    mocker.patch('app.youtube_limiter', RateLimiter(rate=1000))
+    labels = dict(api='youtube', endpoint='playlistItems.insert', method='POST')
+    calls = metrics.API_SECONDS.value(**labels)
+    retries = metrics.API_RETRIES.value(api='youtube', endpoint='playlistItems.insert', reason=429)
+    quota = metrics.YOUTUBE_QUOTA.value(endpoint='playlistItems.insert')
+
+    app.insert_song('dummy_access_token', 'playlist123', 'video123')
+
+    assert metrics.API_SECONDS.value(**labels) == calls + 2
+    assert metrics.API_RETRIES.value(api='youtube', endpoint='playlistItems.insert', reason=429) == retries + 1
+    assert metrics.YOUTUBE_QUOTA.value(endpoint='playlistItems.insert') == quota + 100
+    assert metrics.API_IN_FLIGHT.value(api='youtube') == 0
+
+
+def test_throttled_spotify_calls_are_retried_after_retry_after(mocker):
+    sleep = mocker.patch('clients.time.sleep')
+    throttled = mocker.Mock(status_code=429, headers={'Retry-After': '2'}, json=lambda: {})
+    ok = mocker.Mock(status_code=200, headers={}, json=lambda: {'id': 'user123'})
+    mocker.patch.object(app.http_session, 'request', side_effect=[throttled, ok])
+    mocker.patch('app.response_cache', None)
+    # the limiter would hold the retry back for the same Retry-After in real time
+    mocker.patch('app.spotify_concurrency', None)
+    retries = metrics.API_RETRIES.value(api='spotify', endpoint='me', reason=429)
+
+    response = app.spotify_client('dummy_access_token').get('me')
+
+    assert response is ok
+    sleep.assert_called_once_with(2.0)
+    assert metrics.API_RETRIES.value(api='spotify', endpoint='me', reason=429) == retries + 1
+
+
+def test_metrics_endpoint_reports_routes_by_rule():
+    client = app.app.test_client()
+    client.get('/jobs/missing')
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    body = response.get_data(as_text=True)
+    assert 'http_responses_total{route="/jobs/<job_id>",method="GET",status="404"}' in body
+    assert 'api_request_duration_seconds' in body
@@ -0,0 +1,57 @@
+import io
+
+import matching
+from plan import INSERTED, PENDING, Plan, PlannedTrack, as_plan
+
+
+def test_duplicate_names_get_unique_titles():
+    plan = Plan()
+    plan.add('p1', 'Mix')
+    plan.add('p2', 'Mix')
+    plan.add('p3', 'Mix (2)')
+    assert plan.titles() == ['Mix', 'Mix (2)', 'Mix (2) (2)']
+    assert [p.name for p in plan] == ['Mix', 'Mix', 'Mix (2)']
+
+
+def test_tracks_stream_and_are_kept():
+    pulled = []
+
+    def songs():
+        for name in ['a', 'b', 'c']:
+            pulled.append(name)
+            yield {'name': name, 'artists': ['Artist'], 'isrc': f'isrc-{name}'}
+
+    playlist = Plan().add('p1', 'Mix', songs=songs())
+    tracks = iter(playlist)
+    assert next(tracks).name == 'a'
+    assert pulled == ['a']
+    assert [t.name for t in playlist] == ['a', 'b', 'c']
+    assert [t.name for t in playlist] == ['a', 'b', 'c']
+    assert pulled == ['a', 'b', 'c']
+
+
+def test_tracks_read_like_track_records():
+    track = PlannedTrack.from_song({'id': 't1', 'name': 'Song', 'artists': ['Artist'], 'duration_ms': 1000,
+                                    'isrc': 'usabc'})
+    assert matching.track_key(track) == 'isrc:USABC'
+    assert matching.search_query(PlannedTrack('Song', artists=['Artist'])) == 'Song Artist'
+    assert matching.track_key(PlannedTrack.from_song('Song')) == matching.track_key('Song')
+
+
+def test_plan_round_trips_through_json_lines():
+    plan = as_plan({'Mix': ['a', {'name': 'b', 'artists': ['B'], 'duration_ms': 2000}]})
+    plan.add('p2', 'Mix', 'snap', 1, ['c'])
+    first = plan.playlists[0].load()
+    first.tracks[0].resolve('video-a')
+    first.tracks[0].state = INSERTED
+
+    f = io.StringIO()
+    plan.dump(f)
+    f.seek(0)
+    loaded = Plan.load(f)
+
+    assert loaded.titles() == ['Mix', 'Mix (2)']
+    assert [(t.name, t.artists, t.video_id, t.state) for t in loaded.playlists[0]] == \
+        [('a', (), 'video-a', INSERTED), ('b', ('B',), None, PENDING)]
+    assert (loaded.playlists[1].spotify_id, loaded.playlists[1].snapshot_id) == ('p2', 'snap')
+    assert [t.name for t in loaded.playlists[1]] == ['c']
@@ -0,0 +1,81 @@
+import datetime
+import quota
+from journal import Journal
+from plan import Plan
+
+
+def test_next_reset_is_midnight_pacific():
+    # 2024-01-15 12:00 UTC is 04:00 PST
+    now = datetime.datetime(2024, 1, 15, 12, tzinfo=datetime.timezone.utc).timestamp()
+    reset = datetime.datetime.fromtimestamp(quota.next_reset(now), datetime.timezone.utc)
+    assert reset == datetime.datetime(2024, 1, 16, 8, tzinfo=datetime.timezone.utc)
+    # daylight saving time: midnight PDT is 07:00 UTC
+    now = datetime.datetime(2024, 7, 1, 6, 59, tzinfo=datetime.timezone.utc).timestamp()
+    reset = datetime.datetime.fromtimestamp(quota.next_reset(now), datetime.timezone.utc)
+    assert reset == datetime.datetime(2024, 7, 1, 7, tzinfo=datetime.timezone.utc)
+
+
+def test_estimate_counts_cache_hits_repeats_and_journal(song_cache):
+    song_cache.set('cached', 'video-cached')
+    plan = Plan()
+    plan.add('p1', 'A', songs=['done', 'cached', 'new', 'shared'])
+    plan.add('p2', 'B', songs=['shared', 'other'])
+    journal = Journal()
+    journal.record_playlist('p1', 'yt-a')
+    journal.record_track('p1', 0, True)
+
+    cost = quota.estimate(plan, song_cache, journal, match_candidates=5, daily_quota=500)
+
+    assert cost['calls'] == {'playlists.insert': 1, 'playlistItems.insert': 5, 'search.list': 3, 'videos.list': 3}
+    assert cost['units'] == 50 + 5 * 50 + 3 * 100 + 3
+    assert (cost['tracks'], cost['already_migrated'], cost['cache_hits'], cost['duplicates']) == (6, 1, 1, 1)
+    assert cost['days'] == 2
+
+
+def test_budget_spreads_jobs_over_windows(mocker):
+    clock = mocker.patch('quota.time.time', return_value=1000.0)
+    mocker.patch('quota.next_reset', side_effect=lambda now: (now // 86400 + 1) * 86400)
+    budget = quota.QuotaBudget(1000)
+    assert budget.admit('a', 600) is None
+    assert budget.remaining() == (400, 86400)
+    assert budget.admit('b', 600) == 86400
+    # a job can re-estimate without counting against itself
+    assert budget.admit('a', 700) is None
+
+    clock.return_value = 86400.0
+    assert budget.admit('b', 600) is None
+    assert budget.remaining() == (400, 2 * 86400)
+
+
+def test_job_bigger_than_a_day_starts_on_an_untouched_window(mocker):
+    mocker.patch('quota.time.time', return_value=1000.0)
+    budget = quota.QuotaBudget(1000)
+    assert budget.admit('big', 5000) is None
+    assert budget.remaining()[0] == 0
+
+
+def test_exhausted_window_holds_jobs_until_reset(mocker):
+    clock = mocker.patch('quota.time.time', return_value=1000.0)
+    mocker.patch('quota.next_reset', side_effect=lambda now: (now // 86400 + 1) * 86400)
+    budget = quota.QuotaBudget(1000)
+    assert budget.exhaust() == 86400
+    assert budget.remaining()[0] == 0
+    assert budget.admit('a', 10) == 86400
+    # nothing to spend needs no quota
+    assert budget.admit('b', 0) is None
+    clock.return_value = 86400.0
+    assert budget.admit('a', 10) is None
+
+
+def test_spend_is_reconciled_with_promises(mocker):
+    mocker.patch('quota.time.time', return_value=1000.0)
+    budget = quota.QuotaBudget(1000)
+    assert budget.admit('a', 600) is None
+    with budget.charging('a'):
+        budget.spend(200)
+    # calls outside any admitted job, such as a sync, are counted as they happen
+    budget.spend(100)
+    assert budget.remaining()[0] == 1000 - 600 - 100
+    budget.release('a')
+    assert budget.remaining()[0] == 1000 - 200 - 100
+    assert budget.admit('b', 700) is None
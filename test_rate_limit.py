@@ -0,0 +1,47 @@
+import pytest
+from rate_limit import RateLimiter, TokenBucket, QuotaExceededError, RateLimitedError
+from quota import QuotaBudget
+
+
+def error_response(mocker, status_code, reason=None, headers=None):
+    body = {'error': {'errors': [{'reason': reason}]}}
+    return mocker.Mock(status_code=status_code, json=lambda: body, headers=headers or {})
+
+
+def test_token_bucket_paces_after_burst():
+    bucket = TokenBucket(rate=10, capacity=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+
+
+def test_rate_limited_calls_are_retried(mocker):
+    sleep = mocker.patch('rate_limit.time.sleep')
+    ok = mocker.Mock(status_code=200)
+    send = mocker.Mock(side_effect=[error_response(mocker, 429, headers={'Retry-After': '2'}),
+                                    error_response(mocker, 403, 'rateLimitExceeded'),
+                                    ok])
+    budget = QuotaBudget(10000)
+    limiter = RateLimiter(rate=1000, budget=budget)
+
+    assert limiter.call('search.list', send) is ok
+    assert sleep.call_args_list[0] == mocker.call(2.0)
+    assert budget.remaining()[0] == 10000 - 300
+
+
+def test_quota_exceeded_is_not_retried(mocker):
+    send = mocker.Mock(return_value=error_response(mocker, 403, 'quotaExceeded'))
+
+    with pytest.raises(QuotaExceededError):
+        RateLimiter(rate=1000).call('playlistItems.insert', send)
+    assert send.call_count == 1
+
+
+def test_gives_up_after_max_retries(mocker):
+    mocker.patch('rate_limit.time.sleep')
+    send = mocker.Mock(return_value=error_response(mocker, 429))
+
+    with pytest.raises(RateLimitedError):
+        RateLimiter(rate=1000, max_retries=2).call('search.list', send)
+    assert send.call_count == 3
@@ -0,0 +1,57 @@
+import flask
+from flask import session
+
+from session_store import SqliteSessionInterface
+
+
+def make_app(tmp_path, ttl=3600):
+    test_app = flask.Flask(__name__)
+    test_app.secret_key = 'test'
+    test_app.session_interface = SqliteSessionInterface(str(tmp_path / 'sessions.db'), ttl)
+
+    @test_app.route('/set/<value>')
+    def set_value(value):
+        session['value'] = value
+        return ''
+
+    @test_app.route('/get')
+    def get_value():
+        return session.get('value', 'missing')
+
+    @test_app.route('/clear')
+    def clear():
+        session.clear()
+        return ''
+
+    return test_app
+
+
+def test_cookie_only_carries_session_id(tmp_path):
+    client = make_app(tmp_path).test_client()
+
+    response = client.get('/set/' + 'x' * 5000)
+
+    cookie = response.headers['Set-Cookie']
+    assert len(cookie) < 200
+    assert client.get('/get').text == 'x' * 5000
+
+
+def test_tampered_cookie_starts_new_session(tmp_path):
+    client = make_app(tmp_path).test_client()
+    client.get('/set/secret')
+    sid = client.get_cookie('session').value.split('.')[0]
+
+    client.set_cookie('session', sid + '.forged')
+
+    assert client.get('/get').text == 'missing'
+
+
+def test_expired_and_cleared_sessions_are_gone(tmp_path):
+    client = make_app(tmp_path, ttl=-1).test_client()
+    client.get('/set/value')
+    assert client.get('/get').text == 'missing'
+
+    client = make_app(tmp_path).test_client()
+    client.get('/set/value')
+    client.get('/clear')
+    assert client.get('/get').text == 'missing'
@@ -0,0 +1,29 @@
+import song_cache
+from song_cache import SongCache
+
+
+def test_lookup_survives_new_process(tmp_path):
+    path = str(tmp_path / 'songs.db')
+    SongCache(path).set('Test  Song', 'abcd1234')
+
+    assert SongCache(path).get('test song') == 'abcd1234'
+
+
+def test_expired_entries_are_dropped(tmp_path, monkeypatch):
+    cache = SongCache(str(tmp_path / 'songs.db'), ttl=10)
+    monkeypatch.setattr(song_cache.time, 'time', lambda: 1000)
+    cache.set('Test Song', 'abcd1234')
+
+    monkeypatch.setattr(song_cache.time, 'time', lambda: 1011)
+
+    assert cache.get('Test Song') is None
+
+
+def test_store_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(song_cache, 'TRIM_EVERY', 1)
+    cache = SongCache(str(tmp_path / 'songs.db'), max_entries=2, memory_entries=1)
+    for i in range(3):
+        cache.set(f'song{i}', f'video{i}')
+
+    assert cache.connect().execute('SELECT COUNT(*) FROM songs').fetchone()[0] == 2
+    assert cache.get('song0') is None
@@ -0,0 +1,47 @@
+import threading
+
+import app
+import jobs
+import sse
+
+
+def read_events(body):
+    return [dict(line.split(': ', 1) for line in chunk.splitlines() if not line.startswith(':'))
+            for chunk in body.split('\n\n') if chunk and not chunk.startswith(':')]
+
+
+def test_stream_sends_a_snapshot_then_live_events_until_the_job_ends():
+    job = jobs.Job('migration')
+    job.start_playlist('Test Playlist', total=1)
+
+    def migrate():
+        job.track_resolved('Test Playlist', 0, 'video1')
+        job.track_done('Test Playlist', index=0)
+        job.set_status('finished')
+    threading.Timer(0.05, migrate).start()
+
+    events = read_events(''.join(sse.job_stream(job, heartbeat=1)))
+
+    assert [e['event'] for e in events] == ['progress', 'resolved', 'inserted', 'status']
+    assert [int(e['id']) for e in events] == [1, 2, 3, 4]
+    assert '"status":"finished"' in events[-1]['data']
+
+
+def test_idle_stream_sends_keep_alive_comments():
+    job = jobs.Job('migration')
+    stream = sse.job_stream(job, last_event_id=0, heartbeat=0.01)
+
+    assert next(stream) == ': keep-alive\n\n'
+
+
+def test_events_endpoint_resumes_from_last_event_id():
+    job = jobs.Job('migration')
+    job.start_playlist('Test Playlist', total=1)
+    job.track_done('Test Playlist', index=0)
+    job.set_status('finished')
+    jobs._jobs[job.id] = job
+
+    response = app.app.test_client().get(f'/jobs/{job.id}/events', headers={'Last-Event-ID': '1'})
+
+    assert response.content_type == 'text/event-stream'
+    assert [e['event'] for e in read_events(response.get_data(as_text=True))] == ['inserted', 'status']
@@ -0,0 +1,59 @@
+import app
+import jobs
+import tracing
+from test_jobs import wait_for
+
+
+def test_spans_are_skipped_outside_a_traced_job():
+    tracer = tracing.Tracer()
+    with tracing.span('resolve', track='song1'):
+        pass
+
+    assert tracer.events == []
+
+
+def test_worker_spans_inherit_the_submitters_trace_and_tags():
+    tracer = tracing.Tracer()
+
+    def resolve():
+        with tracing.span('resolve', track='song1'):
+            pass
+
+    with tracing.trace(tracer), tracing.span('migrate playlist', playlist='Test Playlist'):
+        with tracing.ContextExecutor(max_workers=1) as executor:
+            executor.submit(resolve).result()
+
+    spans = {e['name']: e for e in tracer.events if e['ph'] == 'X'}
+    assert spans['resolve']['args'] == {'playlist': 'Test Playlist', 'track': 'song1'}
+    assert spans['migrate playlist']['args'] == {'playlist': 'Test Playlist'}
+    assert spans['resolve']['tid'] != spans['migrate playlist']['tid']
+    assert [e['ph'] for e in tracer.events if e['name'] == 'queued'] == ['b', 'e']
+
+
+def test_trace_of_a_sampled_job_is_served_as_chrome_trace_json(mocker):
+    mocker.patch('jobs.trace_sample_rate', 1)
+
+    def target(job):
+        with tracing.span('insert', track=0):
+            pass
+
+    job = jobs.submit('migration', target)
+    wait_for(job)
+    client = app.app.test_client()
+
+    response = client.get(f'/jobs/{job.id}/trace')
+
+    assert response.status_code == 200
+    names = [e['name'] for e in response.get_json()['traceEvents']]
+    assert 'migration' in names and 'insert' in names and 'thread_name' in names
+    assert job.to_dict()['traced'] is True
+
+
+def test_unsampled_job_has_no_trace(mocker):
+    mocker.patch('jobs.trace_sample_rate', 0)
+    job = jobs.submit('migration', lambda job: None)
+    wait_for(job)
+
+    response = app.app.test_client().get(f'/jobs/{job.id}/trace')
+
+    assert response.status_code == 404
@@ -0,0 +1,127 @@
+import threading
+
+import app
+import jobs
+import pytest
+import worker
+from rate_limit import QuotaExceededError
+from work_queue import LeaseLostError, WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path, mocker):
+    clock = mocker.patch('work_queue.time.time', return_value=1000.0)
+    queue = WorkQueue(str(tmp_path / 'queue.db'), lease_seconds=60, max_attempts=3, base_delay=5)
+    queue.clock = clock
+    return queue
+
+
+def test_lease_and_complete(queue):
+    task_id = queue.put('job', 'migrate_playlist', {'playlist_id': 'a'})
+    task = queue.lease('worker-1')
+    assert (task.id, task.payload, task.attempts) == (task_id, {'playlist_id': 'a'}, 1)
+    # a leased task is not handed out twice
+    assert queue.lease('worker-2') is None
+
+    queue.heartbeat(task, {'A': {'status': 'running'}})
+    queue.complete(task, {'A': 'yt-a'})
+    [row] = queue.tasks('job')
+    assert row['status'] == 'done'
+    assert row['result'] == {'A': 'yt-a'}
+    assert row['progress'] == {'A': {'status': 'running'}}
+
+
+def test_expired_lease_is_handed_to_another_worker(queue):
+    queue.put('job', 'migrate_playlist', {})
+    first = queue.lease('worker-1')
+    queue.clock.return_value += 61
+    second = queue.lease('worker-2')
+    assert second.id == first.id
+    assert second.attempts == 2
+    with pytest.raises(LeaseLostError):
+        queue.heartbeat(first)
+    queue.complete(second)
+
+
+def test_failed_task_retries_with_backoff_then_fails(queue):
+    queue.put('job', 'migrate_playlist', {})
+    task = queue.lease('worker')
+    queue.fail(task, 'boom')
+    assert queue.lease('worker') is None
+    queue.clock.return_value += 5
+    task = queue.lease('worker')
+    queue.fail(task, 'boom')
+    queue.clock.return_value += 9
+    assert queue.lease('worker') is None
+    queue.clock.return_value += 1
+    task = queue.lease('worker')
+    assert task.attempts == 3
+    queue.fail(task, 'boom')
+    [row] = queue.tasks('job')
+    assert (row['status'], row['error']) == ('failed', 'boom')
+
+
+def test_worker_runs_playlist_task(work_queue, mocker):
+    run_migration = mocker.patch('worker.app.run_migration', return_value={'A': 'yt-a'})
+    work_queue.put('job', 'migrate_playlist', {'spotify_token': 'sp', 'youtube_token': 'yt',
+                                               'playlist_id': 'a', 'youtube_channel_id': 'UC1'})
+    worker.run_task(work_queue, work_queue.lease('worker'))
+    assert run_migration.call_args.args[1:] == ('sp', 'yt', ['a'], 'UC1')
+    [row] = work_queue.tasks('job')
+    assert (row['status'], row['result']) == ('done', {'A': 'yt-a'})
+
+
+def test_worker_does_not_retry_quota_errors(work_queue, mocker):
+    mocker.patch('worker.app.run_migration', side_effect=QuotaExceededError('quota'))
+    work_queue.put('job', 'migrate_playlist', {'spotify_token': 'sp', 'youtube_token': 'yt',
+                                               'playlist_id': 'a', 'youtube_channel_id': None})
+    worker.run_task(work_queue, work_queue.lease('worker'))
+    assert work_queue.tasks('job')[0]['status'] == 'failed'
+
+
+def test_queued_migration_waits_for_workers(work_queue, mocker):
+    mocker.patch('worker.app.run_migration', side_effect=lambda job, *args: {'A': 'yt-a'})
+    mocker.patch.object(app, 'queue_poll_interval', 0.01)
+    job = jobs.Job('migration')
+    stop = threading.Event()
+    thread = threading.Thread(target=worker.main, args=(stop,))
+    mocker.patch.object(worker, 'worker_poll_interval', 0.01)
+    thread.start()
+    try:
+        assert app.run_queued_migration(job, 'sp', 'yt', ['a']) == {'a': 'yt-a'}
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_queued_same_named_playlists_stay_apart(work_queue, mocker):
+    def run_migration(job, spotify_token, youtube_token, playlist_ids, channel_id):
+        job.start_playlist('Mix')
+        job.finish_playlist('Mix', f'yt-{playlist_ids[0]}')
+        return {'Mix': f'yt-{playlist_ids[0]}'}
+    mocker.patch('worker.app.run_migration', side_effect=run_migration)
+    mocker.patch.object(app, 'queue_poll_interval', 0.01)
+    job = jobs.Job('migration')
+    stop = threading.Event()
+    thread = threading.Thread(target=worker.main, args=(stop,))
+    mocker.patch.object(worker, 'worker_poll_interval', 0.01)
+    thread.start()
+    try:
+        assert app.run_queued_migration(job, 'sp', 'yt', ['a', 'b']) == {'a': 'yt-a', 'b': 'yt-b'}
+    finally:
+        stop.set()
+        thread.join()
+    assert sorted(p['youtube_playlist_id'] for p in job.playlists.values()) == ['yt-a', 'yt-b']
+
+
+def test_queued_migration_fails_without_workers(work_queue, mocker):
+    mocker.patch.object(app, 'queue_poll_interval', 0.01)
+    mocker.patch.object(app, 'queue_pickup_timeout', 0.05)
+    job = jobs.Job('migration')
+
+    with pytest.raises(RuntimeError):
+        app.run_queued_migration(job, 'sp', 'yt', ['a'])
+
+    # a worker starting later must not migrate the abandoned playlist
+    assert work_queue.tasks(job.id)[0]['status'] == 'failed'
+
@@ -0,0 +1,138 @@
+"""
+Span tracing of background jobs, exported in the Chrome trace event format (chrome://tracing, Perfetto).
+Only a sampled share of jobs is traced, outside a traced job every span is a no-op.
+"""
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import itertools
+import os
+import random
+import threading
+import time
+
+# a runaway trace stops recording past this many events instead of growing without bound
+MAX_EVENTS = 200000
+
+_tracer = contextvars.ContextVar('tracer', default=None)
+_tags = contextvars.ContextVar('trace_tags', default={})
+
+
+class Tracer:
+    """
+    Spans of one job. Threads and asyncio tasks each get their own lane in the timeline
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.started = time.perf_counter()
+        self.events = []
+        self.dropped = 0
+        self._lanes = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _lane(self):
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            key, name = ('task', id(task)), f'task {task.get_name()}'
+        else:
+            key, name = ('thread', threading.get_ident()), threading.current_thread().name
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = (len(self._lanes) + 1, name)
+        return lane[0]
+
+    def _micros(self, timestamp):
+        return round((timestamp - self.started) * 1e6, 3)
+
+    def _record(self, *events):
+        if len(self.events) + len(events) > MAX_EVENTS:
+            self.dropped += len(events)
+            return
+        self.events.extend(events)
+
+    def add(self, name, category, start, end, tags):
+        """
+        Records a finished span on the calling thread or task's lane
+        """
+        with self._lock:
+            self._record({'name': name, 'cat': category, 'ph': 'X', 'ts': self._micros(start),
+                          'dur': round((end - start) * 1e6, 3), 'pid': self.pid, 'tid': self._lane(),
+                          'args': tags})
+
+    def add_async(self, name, category, start, end, tags):
+        """
+        Records a span that may overlap others on the same lane, such as time spent queued for a worker
+        """
+        with self._lock:
+            event = {'name': name, 'cat': category, 'id': next(self._ids), 'pid': self.pid, 'tid': self._lane(),
+                     'args': tags}
+            self._record(dict(event, ph='b', ts=self._micros(start)), dict(event, ph='e', ts=self._micros(end)))
+
+    def to_chrome(self):
+        """
+        The trace as a Chrome trace event JSON object
+        """
+        with self._lock:
+            lanes = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                     for tid, name in self._lanes.values()]
+            return {'traceEvents': lanes + list(self.events), 'displayTimeUnit': 'ms',
+                    'otherData': {'dropped_events': self.dropped}}
+
+
+def sampled(rate):
+    """
+    Whether to trace a job, for a sampling rate between 0 (never) and 1 (always)
+    """
+    return rate > 0 and random.random() < rate
+
+@contextlib.contextmanager
+def trace(tracer):
+    """
+    Sends the spans of the current thread or task, and of the work it hands off, to tracer (None disables)
+    """
+    token = _tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _tracer.reset(token)
+
+@contextlib.contextmanager
+def span(name, category='stage', **tags):
+    """
+    Times the enclosed block. Tags such as playlist or track also apply to every span nested inside it
+    """
+    tracer = _tracer.get()
+    if tracer is None:
+        yield
+        return
+    token = _tags.set({**_tags.get(), **tags}) if tags else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.add(name, category, start, time.perf_counter(), _tags.get())
+        if token is not None:
+            _tags.reset(token)
+
+def _run_queued(queued, fn, *args, **kwargs):
+    _tracer.get().add_async('queued', 'executor', queued, time.perf_counter(), _tags.get())
+    return fn(*args, **kwargs)
+
+
+class ContextExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    Thread pool whose tasks run in the submitter's context, so they belong to its trace, inherit its span tags
+    and are charged to its quota budget job. In a traced job the time each task waits for a free worker is recorded too
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        context = contextvars.copy_context()
+        if _tracer.get() is None:
+            return super().submit(context.run, fn, *args, **kwargs)
+        return super().submit(context.run, _run_queued, time.perf_counter(), fn, *args, **kwargs)
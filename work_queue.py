@@ -0,0 +1,160 @@
+"""
+Durable work queue in SQLite, shared by every worker process that can open the database.
+Workers lease a task for a while and keep extending the lease while they work on it;
+a task whose worker died is handed out again once its lease runs out, and failed tasks are
+retried with backoff until they run out of attempts.
+"""
+import json
+import time
+import uuid
+
+from storage import SqliteStore
+
+
+class Task:
+    """
+    A leased work item
+    """
+
+    def __init__(self, id, job_id, kind, payload, attempts, owner):
+        self.id = id
+        self.job_id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self.owner = owner
+
+
+class LeaseLostError(Exception):
+    """
+    The task's lease ran out and it was handed to another worker
+    """
+
+
+class WorkQueue(SqliteStore):
+    """
+    Tasks grouped by job, each queued, leased, done or failed.
+    Progress reported by a task's worker is kept on the task for whoever waits on the job
+    """
+    schema = '''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            job_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            payload TEXT,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            owner TEXT,
+            lease_expires REAL,
+            available_at REAL NOT NULL,
+            progress TEXT,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (status, available_at);
+        CREATE INDEX IF NOT EXISTS tasks_job ON tasks (job_id);
+    '''
+
+    def __init__(self, path, lease_seconds=60, max_attempts=5, base_delay=5.0, max_delay=300.0):
+        super().__init__(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def put(self, job_id, kind, payload, delay=0):
+        """
+        Queues a task, returns its id
+        """
+        now = time.time()
+        cursor = self.connect().execute(
+            'INSERT INTO tasks (job_id, kind, payload, status, max_attempts, available_at, created_at) '
+            "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), self.max_attempts, now + delay, now))
+        return cursor.lastrowid
+
+    def lease(self, owner=None, kinds=None):
+        """
+        Claims the oldest ready task (queued, or leased to a worker whose lease ran out), or returns None
+        """
+        owner = owner or uuid.uuid4().hex
+        now = time.time()
+        conn = self.connect()
+        kind_filter = f" AND kind IN ({','.join('?' * len(kinds))})" if kinds else ''
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT id, job_id, kind, payload, attempts FROM tasks "
+                "WHERE ((status = 'queued' AND available_at <= ?) OR (status = 'leased' AND lease_expires <= ?))"
+                f"{kind_filter} ORDER BY available_at, id LIMIT 1",
+                (now, now, *(kinds or ()))).fetchone()
+            if row is None:
+                return None
+            task_id, job_id, kind, payload, attempts = row
+            conn.execute("UPDATE tasks SET status = 'leased', owner = ?, lease_expires = ?, attempts = ? "
+                         "WHERE id = ?", (owner, now + self.lease_seconds, attempts + 1, task_id))
+        return Task(task_id, job_id, kind, json.loads(payload), attempts + 1, owner)
+
+    def _update(self, task, assignments, values):
+        cursor = self.connect().execute(
+            f"UPDATE tasks SET {assignments} WHERE id = ? AND owner = ? AND status = 'leased'",
+            (*values, task.id, task.owner))
+        if cursor.rowcount == 0:
+            raise LeaseLostError(f'task {task.id} is no longer leased to {task.owner}')
+
+    def heartbeat(self, task, progress=None):
+        """
+        Extends the task's lease and records its progress, raises LeaseLostError if the lease is gone
+        """
+        self._update(task, 'lease_expires = ?, progress = COALESCE(?, progress)',
+                     (time.time() + self.lease_seconds, None if progress is None else json.dumps(progress)))
+
+    def complete(self, task, result=None, progress=None):
+        """
+        Marks a task done. Its payload, which may hold access tokens, is dropped
+        """
+        self._update(task, "status = 'done', payload = NULL, result = ?, progress = COALESCE(?, progress)",
+                     (json.dumps(result), None if progress is None else json.dumps(progress)))
+
+    def fail(self, task, error, retry=True):
+        """
+        Puts a failed task back with exponential backoff, or marks it failed for good
+        once it is out of attempts (or retry is False)
+        """
+        conn = self.connect()
+        max_attempts = conn.execute('SELECT max_attempts FROM tasks WHERE id = ?', (task.id,)).fetchone()[0]
+        if retry and task.attempts < max_attempts:
+            delay = min(self.max_delay, self.base_delay * 2 ** (task.attempts - 1))
+            self._update(task, "status = 'queued', owner = NULL, available_at = ?, error = ?",
+                         (time.time() + delay, str(error)))
+        else:
+            self._update(task, "status = 'failed', payload = NULL, error = ?", (str(error),))
+
+    def cancel(self, job_id, error):
+        """
+        Marks a job's tasks that are still queued failed for good, returns how many there were
+        """
+        cursor = self.connect().execute(
+            "UPDATE tasks SET status = 'failed', payload = NULL, error = ? WHERE job_id = ? AND status = 'queued'",
+            (str(error), job_id))
+        return cursor.rowcount
+
+    def tasks(self, job_id):
+        """
+        Every task of a job as dicts of id, kind, status, attempts, progress, result and error
+        """
+        rows = self.connect().execute('SELECT id, kind, status, attempts, progress, result, error FROM tasks '
+                                      'WHERE job_id = ? ORDER BY id', (job_id,)).fetchall()
+        return [{'id': task_id, 'kind': kind, 'status': status, 'attempts': attempts,
+                 'progress': json.loads(progress) if progress else None,
+                 'result': json.loads(result) if result else None, 'error': error}
+                for task_id, kind, status, attempts, progress, result, error in rows]
+
+    def purge(self, older_than):
+        """
+        Deletes finished tasks created more than older_than seconds ago
+        """
+        self.connect().execute("DELETE FROM tasks WHERE status IN ('done', 'failed') AND created_at < ?",
+                               (time.time() - older_than,))
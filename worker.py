@@ -0,0 +1,95 @@
+"""
+Migration worker: pulls playlist tasks from the shared work queue (work_queue_path) and migrates them.
+
+    python worker.py
+
+Run as many as there are cores to spare, on any host that can open the queue database.
+Each worker paces its own youtube calls with youtube_requests_per_second, so split the budget between them.
+"""
+import os
+import threading
+import uuid
+
+import app
+import jobs
+from rate_limit import QuotaExceededError
+from work_queue import LeaseLostError
+
+# seconds between polls of an empty queue
+worker_poll_interval = float(os.environ.get("worker_poll_interval", 1))
+
+
+class PlaylistFailedError(Exception):
+    """
+    The playlist was not fully migrated, its journal lets the retry resume it
+    """
+
+
+def migrate_playlist(job, payload):
+    """
+    Migrates one playlist with the same engine and journal as an in-process migration
+    """
+    result = app.run_migration(job, payload['spotify_token'], payload['youtube_token'], [payload['playlist_id']],
+                               payload['youtube_channel_id'])
+    if not result or None in result.values():
+        raise PlaylistFailedError(f"playlist {payload['playlist_id']} was not fully migrated")
+    return result
+
+
+# task kind -> handler(job, payload) returning the task's result
+HANDLERS = {
+    'migrate_playlist': migrate_playlist,
+}
+
+
+def run_task(queue, task):
+    """
+    Runs a leased task, extending its lease and reporting its progress until it finishes
+    """
+    job = jobs.Job(task.kind)
+    done = threading.Event()
+
+    def heartbeat():
+        while not done.wait(queue.lease_seconds / 3):
+            try:
+                queue.heartbeat(task, job.to_dict()['playlists'])
+            except LeaseLostError as e:
+                print(f"Error occurred: {e}")
+                return
+
+    thread = threading.Thread(target=heartbeat, name=f'heartbeat-{task.id}', daemon=True)
+    thread.start()
+    try:
+        result = HANDLERS[task.kind](job, task.payload)
+    except QuotaExceededError as e:
+        # retrying before the quota resets only burns attempts
+        queue.fail(task, e, retry=False)
+    except Exception as e:
+        print(f"Error occurred in task {task.id}: {e}")
+        queue.fail(task, e)
+    else:
+        queue.complete(task, result, job.to_dict()['playlists'])
+    finally:
+        done.set()
+        thread.join()
+
+def main(stop=None):
+    """
+    Leases and runs tasks until stop is set
+    """
+    stop = stop or threading.Event()
+    owner = f'{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+    queue = app.work_queue
+    while not stop.is_set():
+        task = queue.lease(owner, kinds=list(HANDLERS))
+        if task is None:
+            stop.wait(worker_poll_interval)
+            continue
+        try:
+            run_task(queue, task)
+        except LeaseLostError as e:
+            print(f"Error occurred: {e}")
+
+
+if __name__ == '__main__':
+    main()